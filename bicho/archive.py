@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Archive of the traffic between the backends and the trackers.
+
+With X{record}, the requests sent by the backends and their
+responses are stored on an archive. With X{replay}, the responses
+are read back from the archive and the trackers are not accessed,
+so a run can be repeated on the same data.
+"""
+
+import cPickle
+import hashlib
+import os
+import threading
+import zlib
+
+from bicho.config import Config
+from bicho.utils import printdbg, create_dir
+
+
+ARCHIVE_INDEX = 'index'
+ARCHIVE_DATA = 'data'
+
+
+class NotRecorded(Exception):
+    """
+    The request is not on the archive being replayed.
+    """
+    pass
+
+
+class ArchiveExists(Exception):
+    """
+    There is already an archive where a new one was going to be
+    recorded.
+    """
+    pass
+
+
+class TrafficArchive(object):
+    """
+    Archive of requests and responses.
+
+    The archive is a directory with two files: C{data}, where each
+    response is appended compressed with zlib, and C{index}, with a
+    line for each response giving the key of the request and the
+    offset and length of the response on C{data}.
+
+    A request may be sent several times during a run, so its
+    responses are replayed in the order they were recorded; once
+    they are all sent, the last one is sent again.
+
+    Archives are never recorded over, so the traffic of a run is
+    not lost by recording another one on the same directory.
+
+    @param path: directory of the archive
+    @type path: C{str}
+    @param replaying: replay the archive instead of recording it
+    @type replaying: C{bool}
+
+    @raise ArchiveExists: when recording on a directory that already
+     has an archive
+    """
+    def __init__(self, path, replaying=False):
+        self.path = path
+        self.replaying = replaying
+        self._lock = threading.Lock()
+
+        # Offset and length of the responses, indexed by key
+        self._index = {}
+        # Responses already replayed, indexed by key
+        self._replayed = {}
+
+        index_path = os.path.join(path, ARCHIVE_INDEX)
+        data_path = os.path.join(path, ARCHIVE_DATA)
+
+        if replaying:
+            with open(index_path, 'r') as f:
+                for line in f:
+                    key, offset, length = line.split()
+                    self._index.setdefault(key, []).append((int(offset),
+                                                            int(length)))
+            self._data = open(data_path, 'rb')
+            self._index_file = None
+            printdbg("Replaying %d requests from %s" % (len(self._index), path))
+        else:
+            create_dir(path)
+            if os.path.exists(index_path) or os.path.exists(data_path):
+                raise ArchiveExists("%s already has an archive; remove it "
+                                    "or record on another directory" % path)
+            self._data = open(data_path, 'wb')
+            self._index_file = open(index_path, 'w')
+
+    def record(self, response, kind, *request):
+        """
+        Record the response of a request.
+
+        The archive is flushed on every response, so it can be
+        replayed even when the run fails.
+
+        @param response: the response; any value that can be pickled
+        @param kind: kind of request, like C{http} or C{ssh}
+        @type kind: C{str}
+        @param request: values that identify the request
+        @type request: C{str}
+        """
+        key = self._get_key(kind, request)
+        data = zlib.compress(cPickle.dumps(response, cPickle.HIGHEST_PROTOCOL))
+
+        with self._lock:
+            offset = self._data.tell()
+            self._data.write(data)
+            self._data.flush()
+            self._index_file.write("%s %d %d\n" % (key, offset, len(data)))
+            self._index_file.flush()
+            self._index.setdefault(key, []).append((offset, len(data)))
+
+    def replay(self, kind, *request):
+        """
+        Return the recorded response of a request.
+
+        @param kind: kind of request, like C{http} or C{ssh}
+        @type kind: C{str}
+        @param request: values that identify the request
+        @type request: C{str}
+
+        @raise NotRecorded: when the request is not on the archive
+        """
+        key = self._get_key(kind, request)
+
+        with self._lock:
+            if key not in self._index:
+                raise NotRecorded("%s request not recorded on %s: %r" %
+                                  (kind, self.path, request[0]))
+
+            responses = self._index[key]
+            n = self._replayed.get(key, 0)
+            offset, length = responses[min(n, len(responses) - 1)]
+            self._replayed[key] = n + 1
+
+            self._data.seek(offset)
+            data = self._data.read(length)
+
+        return cPickle.loads(zlib.decompress(data))
+
+    def _get_key(self, kind, request):
+        sha = hashlib.sha1(kind)
+        for value in request:
+            if isinstance(value, unicode):
+                value = value.encode('utf-8')
+            sha.update('\0' + str(value))
+        return sha.hexdigest()
+
+    def close(self):
+        with self._lock:
+            self._data.close()
+            if self._index_file is not None:
+                self._index_file.close()
+
+
+_archive = None
+_archive_lock = threading.Lock()
+
+
+def get_archive():
+    """
+    Return the archive given by the X{record} or X{replay} options;
+    C{None} when none of them is set.
+
+    @rtype: L{TrafficArchive}
+    """
+    global _archive
+
+    with _archive_lock:
+        if _archive is None:
+            replay = getattr(Config, 'replay', None)
+            record = getattr(Config, 'record', None)
+            if replay:
+                _archive = TrafficArchive(replay, replaying=True)
+            elif record:
+                _archive = TrafficArchive(record)
+        return _archive
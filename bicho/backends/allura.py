@@ -22,7 +22,10 @@
 from bicho.config import Config
 
 from bicho.backends import Backend
-from bicho.utils import create_dir, printdbg, printout, printerr
+from bicho.http import get_http_client
+from bicho.pool import get_fetch_pool
+from bicho.utils import create_dir, printdbg, printout, printerr, \
+    run_stats
 from bicho.db.database import DBIssue, DBBackend, get_database
 from bicho.common import Tracker, Issue, People, Change
 
@@ -30,12 +33,12 @@ from dateutil.parser import parse
 from datetime import datetime
 
 import errno
+import itertools
 import json
 import os
 import pprint
 import random
 import sys
-import time
 import traceback
 import urllib
 import feedparser
@@ -158,30 +161,26 @@ class DBAlluraBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBAlluraIssueExt,
-                                      DBAlluraIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBAlluraIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
-
-            db_issue_ext.labels = unicode(issue.labels)
-            db_issue_ext.private = bool(issue.private)
-            db_issue_ext.ticket_num = int(issue.ticket_num)
-            db_issue_ext.discussion_thread_url = unicode(issue.discussion_thread_url)
-            db_issue_ext.related_artifacts = unicode(issue.related_artifacts)
-            db_issue_ext.custom_fields = unicode(issue.custom_fields)
-            db_issue_ext.mod_date = issue.mod_date
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBAlluraIssueExt,
+                                  DBAlluraIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBAlluraIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+
+        db_issue_ext.labels = unicode(issue.labels)
+        db_issue_ext.private = bool(issue.private)
+        db_issue_ext.ticket_num = int(issue.ticket_num)
+        db_issue_ext.discussion_thread_url = unicode(issue.discussion_thread_url)
+        db_issue_ext.related_artifacts = unicode(issue.related_artifacts)
+        db_issue_ext.custom_fields = unicode(issue.custom_fields)
+        db_issue_ext.mod_date = issue.mod_date
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         """
@@ -189,7 +188,7 @@ class DBAlluraBackend(DBBackend):
         """
         pass
 
-    def get_last_modification_date(self, store):
+    def get_last_modification_date(self, store, tracker_id=None):
         # get last modification date (day) stored in the database
         # select date_last_updated as date from issues_ext_allura order by date
         result = store.find(DBAlluraIssueExt)
@@ -200,6 +199,12 @@ class DBAlluraBackend(DBBackend):
 
         return None
 
+    def get_issue_modification_date(self, issue):
+        return issue.mod_date
+
+    def format_last_modification_date(self, date):
+        return date.strftime('%Y-%m-%dT%H:%M:%SZ')
+
 
 class AlluraIssue(Issue):
     """
@@ -243,7 +248,7 @@ class Allura():
         bug_number = bug_url.split('/')[-1]
 
         try:
-            f = urllib.urlopen(bug_url)
+            f = get_http_client().urlopen(bug_url)
 
             # f = urllib.urlopen(bug_url)
             json_ticket = f.read()
@@ -295,13 +300,23 @@ class Allura():
 
         return issue
 
+    def _fetch_bug(self, issue_url):
+        """
+        Analyze the bug, returning the traceback of the error, if
+        any, instead of raising it, so the next bugs are analyzed.
+        """
+        try:
+            return self.analyze_bug(issue_url), None
+        except Exception:
+            return None, traceback.format_exc()
+
     def analyze_bug_changes(self, bug_url):
         bug_number = bug_url.split('/')[-1]
         changes_url = bug_url.replace("rest/", "") + "/feed.atom"
 
         printdbg("Analyzing issue changes" + changes_url)
 
-        d = feedparser.parse(changes_url)
+        d = feedparser.parse(get_http_client().get(changes_url).content)
         changes = self.parse_changes(d)
 
         return changes
@@ -362,7 +377,7 @@ class Allura():
         trk = Tracker(Config.url, "allura", "beta")
         dbtrk = bugsdb.insert_tracker(trk)
 
-        last_mod_date = bugsdb.get_last_modification_date()
+        last_mod_date = bugsdb.get_last_modification_date(tracker_id=dbtrk.id)
 
         # Date before the first ticket
         time_window_start = "1900-01-01T00:00:00Z"
@@ -380,7 +395,7 @@ class Allura():
         self.url_issues += urllib.quote("mod_date_dt:[" + time_window + "]")
         printdbg("URL for getting metadata " + self.url_issues)
 
-        f = urllib.urlopen(self.url_issues)
+        f = get_http_client().urlopen(self.url_issues)
         ticketTotal = json.loads(f.read())
 
         total_issues = int(ticketTotal['count'])
@@ -404,7 +419,7 @@ class Allura():
 
             printdbg("URL for next issues " + self.url_issues)
 
-            f = urllib.urlopen(self.url_issues)
+            f = get_http_client().urlopen(self.url_issues)
 
             ticketList = json.loads(f.read())
 
@@ -412,16 +427,23 @@ class Allura():
             for ticket in ticketList["tickets"]:
                 bugs.append(ticket["ticket_num"])
 
-            for bug in bugs:
+            issue_urls = [Config.url + "/" + str(bug) for bug in bugs]
+            analyzed = get_fetch_pool().map(run_stats.timed('parse',
+                                                            self._fetch_bug),
+                                            issue_urls)
+
+            for issue_url, (issue_data, error) in itertools.izip(issue_urls,
+                                                                 analyzed):
                 try:
-                    issue_url = Config.url + "/" + str(bug)
-                    issue_data = self.analyze_bug(issue_url)
+                    if error is not None:
+                        printerr("Error in function analyze_bug " + issue_url)
+                        sys.stdout.write(error)
+                        continue
                     if issue_data is None:
                         continue
                     bugsdb.insert_issue(issue_data, dbtrk.id)
                     remaining -= 1
                     print "Remaining time: ", (remaining) * Config.delay / 60, "m"
-                    time.sleep(self.delay)
                 except Exception, e:
                     printerr("Error in function analyze_bug " + issue_url)
                     traceback.print_exc(file=sys.stdout)
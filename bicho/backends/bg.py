@@ -22,8 +22,8 @@
 #          Santiago Dueñas <sduenas@libresoft.es>
 #          Alvaro del Castillo <acs@bitergia.com>
 
+import itertools
 import string
-import time
 import urllib
 import urllib2
 import urlparse
@@ -40,7 +40,10 @@ from bicho.config import Config
 from bicho.backends import Backend
 from bicho.common import Tracker, People, Issue, Comment, Change
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
-from bicho.utils import printerr, printdbg, printout, valid_XML_char_ordinal
+from bicho.http import get_http_client
+from bicho.pool import get_fetch_pool
+from bicho.utils import printerr, printdbg, printout, parse_xml_stream, \
+    run_stats
 
 BUGZILLA = "bugzilla"
 
@@ -153,47 +156,43 @@ class DBBugzillaBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBBugzillaIssueExt,
-                                      DBBugzillaIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBBugzillaIssueExt(issue_id)
-
-            db_issue_ext.alias = self.__return_unicode(issue.alias)
-            db_issue_ext.delta_ts = issue.delta_ts
-            db_issue_ext.reporter_accessible = issue.reporter_accessible
-            db_issue_ext.cclist_accessible = issue.cclist_accessible
-            db_issue_ext.classification_id = issue.classification_id
-            db_issue_ext.classification = self.__return_unicode(issue.classification)
-            db_issue_ext.product = self.__return_unicode(issue.product)
-            db_issue_ext.component = self.__return_unicode(issue.component)
-            db_issue_ext.version = self.__return_unicode(issue.version)
-            db_issue_ext.rep_platform = self.__return_unicode(issue.rep_platform)
-            db_issue_ext.op_sys = self.__return_unicode(issue.op_sys)
-            db_issue_ext.dup_id = issue.dup_id
-            db_issue_ext.bug_file_loc = self.__return_unicode(issue.bug_file_loc)
-            db_issue_ext.status_whiteboard = self.__return_unicode(issue.status_whiteboard)
-            db_issue_ext.target_milestone = self.__return_unicode(issue.target_milestone)
-            db_issue_ext.votes = self.__return_int(issue.votes)
-            db_issue_ext.everconfirmed = self.__return_unicode(issue.everconfirmed)
-            db_issue_ext.qa_contact = self.__return_unicode(issue.qa_contact)
-            db_issue_ext.estimated_time = self.__return_unicode(issue.estimated_time)
-            db_issue_ext.remaining_time = self.__return_unicode(issue.remaining_time)
-            db_issue_ext.actual_time = self.__return_unicode(issue.actual_time)
-            db_issue_ext.deadline = issue.deadline
-            db_issue_ext.keywords = self.__return_unicode(issue.keywords)
-            db_issue_ext.group = self.__return_unicode(issue.group)
-            db_issue_ext.flag = self.__return_unicode(issue.flag)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBBugzillaIssueExt,
+                                  DBBugzillaIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBBugzillaIssueExt(issue_id)
+
+        db_issue_ext.alias = self.__return_unicode(issue.alias)
+        db_issue_ext.delta_ts = issue.delta_ts
+        db_issue_ext.reporter_accessible = issue.reporter_accessible
+        db_issue_ext.cclist_accessible = issue.cclist_accessible
+        db_issue_ext.classification_id = issue.classification_id
+        db_issue_ext.classification = self.__return_unicode(issue.classification)
+        db_issue_ext.product = self.__return_unicode(issue.product)
+        db_issue_ext.component = self.__return_unicode(issue.component)
+        db_issue_ext.version = self.__return_unicode(issue.version)
+        db_issue_ext.rep_platform = self.__return_unicode(issue.rep_platform)
+        db_issue_ext.op_sys = self.__return_unicode(issue.op_sys)
+        db_issue_ext.dup_id = issue.dup_id
+        db_issue_ext.bug_file_loc = self.__return_unicode(issue.bug_file_loc)
+        db_issue_ext.status_whiteboard = self.__return_unicode(issue.status_whiteboard)
+        db_issue_ext.target_milestone = self.__return_unicode(issue.target_milestone)
+        db_issue_ext.votes = self.__return_int(issue.votes)
+        db_issue_ext.everconfirmed = self.__return_unicode(issue.everconfirmed)
+        db_issue_ext.qa_contact = self.__return_unicode(issue.qa_contact)
+        db_issue_ext.estimated_time = self.__return_unicode(issue.estimated_time)
+        db_issue_ext.remaining_time = self.__return_unicode(issue.remaining_time)
+        db_issue_ext.actual_time = self.__return_unicode(issue.actual_time)
+        db_issue_ext.deadline = issue.deadline
+        db_issue_ext.keywords = self.__return_unicode(issue.keywords)
+        db_issue_ext.group = self.__return_unicode(issue.group)
+        db_issue_ext.flag = self.__return_unicode(issue.flag)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def __return_int(self, str):
         """
@@ -247,6 +246,9 @@ class DBBugzillaBackend(DBBackend):
         delta_ts = db_issue_ext.delta_ts
         return delta_ts
 
+    def get_issue_modification_date(self, issue):
+        return issue.delta_ts
+
 
 class SoupHtmlParser():
     """
@@ -916,9 +918,6 @@ class BugsHandler(xml.sax.handler.ContentHandler):
 
         return issue
 
-# length of hibernation in seconds
-HIBERNATION_LENGTH = 100
-
 
 class BGBackend(Backend):
 
@@ -964,21 +963,15 @@ class BGBackend(Backend):
             printdbg("No account data provided. Not logged in bugzilla")
             return
 
-        import cookielib
-
-        cookie_j = cookielib.CookieJar()
-        cookie_h = urllib2.HTTPCookieProcessor(cookie_j)
-
         url = self._get_login_url(self.url)
         values = {'Bugzilla_login': self.backend_user,
                   'Bugzilla_password': self.backend_password}
 
-        opener = urllib2.build_opener(cookie_h)
-        urllib2.install_opener(opener)
+        # The session cookies are kept by the HTTP client
+        http = get_http_client()
         data = urllib.urlencode(values)
-        request = urllib2.Request(url, data)
-        urllib2.urlopen(request)
-        for i, c in enumerate(cookie_j):
+        http.urlopen(url, data)
+        for c in http.cookies:
             self.cookies[c.name] = c.value
 
         printout("Logged in bugzilla as %s" % self.backend_user)
@@ -991,26 +984,9 @@ class BGBackend(Backend):
 
         info_url = self._get_info_url(self.url)
 
-        f = self._urlopen_auth(info_url)
-        try:
-            printdbg("Getting bugzilla version from %s" % info_url)
-            contents = f.read()
-        except Exception:
-            printerr("Error retrieving URL %s" % info_url)
-            raise
-        f.close()
-
+        printdbg("Getting bugzilla version from %s" % info_url)
         handler = BugzillaHandler()
-        parser = xml.sax.make_parser()
-        parser.setContentHandler(handler)
-        try:
-            cleaned_contents = ''. \
-                join(c for c in contents if valid_XML_char_ordinal(ord(c)))
-            parser.feed(cleaned_contents)
-        except Exception:
-            printerr("Error parsing URL %s" % info_url)
-            raise
-        parser.close()
+        self._safe_xml_parse(info_url, handler)
 
         self.version = handler.get_version()
         printdbg("Bugzilla version: %s" % self.version)
@@ -1063,14 +1039,14 @@ class BGBackend(Backend):
         url = self._get_issues_list_url(base_url, version, from_date)
         printdbg("Getting bugzilla issues from %s" % url)
 
-        f = self._urlopen_auth(url)
+        data = self._urlopen_auth(url).read()
 
         # Problems using csv library, not all the fields are delimited by
         # '"' character. Easier using split.
         # Moreover, we drop the first line of the CSV because it contains
         # the headers
         ids = []
-        csv = f.read().split('\n')[1:]
+        csv = data.split('\n')[1:]
         for line in csv:
             # 0: bug_id, 7: changeddate
             values = line.split(',')
@@ -1103,8 +1079,10 @@ class BGBackend(Backend):
             issues = handler.get_issues()
 
             # Retrieving changes
-            for issue in issues:
-                changes = self._retrieve_issue_activity(base_url, issue.issue)
+            activities = get_fetch_pool().map(self._retrieve_issue_activity,
+                                              itertools.repeat(base_url),
+                                              [issue.issue for issue in issues])
+            for issue, changes in itertools.izip(issues, activities):
                 for c in changes:
                     issue.add_change(c)
 
@@ -1113,15 +1091,15 @@ class BGBackend(Backend):
                 self._store_issue(issue, trk_id)
                 self.retrieved[issue.issue] = self._timestamp_to_str(issue.delta_ts)
 
-                time.sleep(self.delay)
-
     def _retrieve_issue_activity(self, base_url, id):
         activity_url = self._get_issue_activity_url(base_url, id)
         printdbg("Retrieving activity of issue #%s from %s"
                  % (id, activity_url))
         data = self._urlopen_auth(activity_url).read()
-        parser = SoupHtmlParser(data, id)
-        changes = parser.parse_changes()
+
+        with run_stats.phase('parse'):
+            parser = SoupHtmlParser(data, id)
+            changes = parser.parse_changes()
         return changes
 
     def _store_issue(self, issue, trk_id):
@@ -1160,31 +1138,20 @@ class BGBackend(Backend):
             url = tokens[0] + 'product=' + urllib.quote(tokens[1])
         return url
 
-    def _urlopen_auth(self, url):
+    def _urlopen_auth(self, url, stream=False):
         """
         Opens an URL using an authenticated session
         """
-        keep_trying = True
-        while keep_trying:
-            if self._is_auth_session():
-                opener = urllib2.build_opener()
-                for c in self.cookies:
-                    q = str(c) + '=' + self.cookies[c]
-                    opener.addheaders.append(('Cookie', q))
-            keep_trying = False
-            try:
-                aux = urllib2.urlopen(url)
-            except urllib2.HTTPError as e:
-                printerr("The server couldn\'t fulfill the request.")
-                printerr("Error code: %s" % e.code)
-            except urllib2.URLError as e:
-                printdbg("Bicho failed to reach the Bugzilla server")
-                printdbg("Reason: %s" % e.reason)
-                printdbg("Bicho goes into hibernation for %s seconds"
-                         % HIBERNATION_LENGTH)
-                time.sleep(HIBERNATION_LENGTH)
-                keep_trying = True
-        return aux
+        try:
+            return get_http_client().urlopen(url, stream=stream)
+        except urllib2.HTTPError as e:
+            printerr("The server couldn\'t fulfill the request.")
+            printerr("Error code: %s" % e.code)
+            raise
+        except urllib2.URLError as e:
+            printerr("Bicho failed to reach the Bugzilla server")
+            printerr("Reason: %s" % e.reason)
+            raise
 
     def _is_auth_session(self):
         """
@@ -1264,34 +1231,17 @@ class BGBackend(Backend):
         return base_url + "show_activity.cgi?id=" + issue_id
 
     def _safe_xml_parse(self, bugs_url, handler):
-        f = self._urlopen_auth(bugs_url)
-        parser = xml.sax.make_parser()
-        parser.setContentHandler(handler)
-
+        f = self._urlopen_auth(bugs_url, stream=True)
         try:
-            contents = f.read()
+            parse_xml_stream(f, handler)
+        except xml.sax.SAXException:
+            printerr("Error parsing URL: %s" % (bugs_url))
+            raise
         except Exception:
             printerr("Error retrieving URL: %s" % (bugs_url))
             raise
-
-        try:
-            parser.feed(contents)
-            parser.close()
-        except Exception:
-            # Clean only the invalid XML
-            try:
-                parser2 = xml.sax.make_parser()
-                parser2.setContentHandler(handler)
-                parser2.setContentHandler(handler)
-                printdbg("Cleaning dirty XML")
-                cleaned_contents = ''. \
-                    join(c for c in contents if valid_XML_char_ordinal(ord(c)))
-                parser2.feed(cleaned_contents)
-                parser2.close()
-            except Exception:
-                printerr("Error parsing URL: %s" % (bugs_url))
-                raise
-        f.close()
+        finally:
+            f.close()
 
     def _timestamp_to_str(self, ts):
         if not ts:
@@ -19,12 +19,14 @@
 # Authors:  Alvaro del Castillo <acs@bitergia.com>
 #
 
+from bicho.archive import get_archive
 from bicho.config import Config
 
 from bicho.backends import Backend
-from bicho.utils import create_dir, printdbg, printout, printerr
+from bicho.utils import create_dir, printdbg, printout, printerr, run_stats
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
 from bicho.common import Tracker, Issue, Comment, People, Change
+from bicho.retry import retry, RetryPolicy
 
 from dateutil.parser import parse
 from datetime import datetime
@@ -93,6 +95,8 @@ class DBGerritBackend(DBBackend):
     """
     Adapter for Gerrit backend.
     """
+    uses_store = True
+
     def __init__(self):
         self.MYSQL_EXT = [DBGerritIssueExtMySQL]
 
@@ -113,30 +117,26 @@ class DBGerritBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBGerritIssueExt,
-                                      DBGerritIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBGerritIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
-
-            db_issue_ext.branch = issue.branch
-            db_issue_ext.url = issue.url
-            db_issue_ext.change_id = issue.change_id
-            db_issue_ext.related_artifacts = issue.related_artifacts
-            db_issue_ext.project = issue.project
-            db_issue_ext.mod_date = issue.mod_date
-            db_issue_ext.open = unicode(issue.open)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBGerritIssueExt,
+                                  DBGerritIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBGerritIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+
+        db_issue_ext.branch = issue.branch
+        db_issue_ext.url = issue.url
+        db_issue_ext.change_id = issue.change_id
+        db_issue_ext.related_artifacts = issue.related_artifacts
+        db_issue_ext.project = issue.project
+        db_issue_ext.mod_date = issue.mod_date
+        db_issue_ext.open = unicode(issue.open)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         """
@@ -158,6 +158,12 @@ class DBGerritBackend(DBBackend):
 
         return None
 
+    def get_issue_modification_date(self, issue):
+        return issue.mod_date
+
+    def format_last_modification_date(self, date):
+        return date.strftime('%Y-%m-%d %H:%M:%S')
+
     def insert_comment_ext(self, store, comment, comment_id):
         """
         Does nothing
@@ -180,6 +186,7 @@ class Gerrit():
 
     MAX_SSH_RETRIES = 5
     MIN_SSH_WAIT_SECS = 5
+    MAX_SSH_WAIT_SECS = 120
 
     project_test_file = None
     safe_delay = 5
@@ -197,13 +204,14 @@ class Gerrit():
 
     def analyze_review(self, review):
         try:
-            issue = self.parse_review(review)
-            changes = self.analyze_review_changes(review)
-            for c in changes:
-                issue.add_change(c)
-            comments = self.analyze_review_comments(review)
-            for com in comments:
-                issue.add_comment(com)
+            with run_stats.phase('parse'):
+                issue = self.parse_review(review)
+                changes = self.analyze_review_changes(review)
+                for c in changes:
+                    issue.add_change(c)
+                comments = self.analyze_review_comments(review)
+                for com in comments:
+                    issue.add_comment(com)
             return issue
 
         except Exception, e:
@@ -352,11 +360,11 @@ class Gerrit():
         # Check with changes added from MERGED and ABANDONED comments
         query_i = "SELECT COUNT(id) FROM  "
         query_c = "SELECT COUNT(DISTINCT(issue_id)) FROM  "
-        query_i_m = query_i + 'issues WHERE status="MERGED" AND tracker_id='+str(dbtrk_id)
-        query_c_m = query_c + 'changes, issues WHERE field="status" AND new_value="MERGED"'
+        query_i_m = query_i + "issues WHERE status='MERGED' AND tracker_id="+str(dbtrk_id)
+        query_c_m = query_c + "changes, issues WHERE field='status' AND new_value='MERGED'"
         query_c_m += ' AND changes.issue_id = issues.id AND tracker_id='+str(dbtrk_id)
-        query_i_a = query_i + 'issues WHERE status="ABANDONED" AND tracker_id='+str(dbtrk_id)
-        query_c_a = query_c + 'changes, issues WHERE field="status" AND new_value="ABANDONED"'
+        query_i_a = query_i + "issues WHERE status='ABANDONED' AND tracker_id="+str(dbtrk_id)
+        query_c_a = query_c + "changes, issues WHERE field='status' AND new_value='ABANDONED'"
         query_c_a += ' AND changes.issue_id = issues.id AND tracker_id='+str(dbtrk_id)
         aux = store.execute(query_i_m)
         issues_merged = aux.get_one()[0]
@@ -549,25 +557,29 @@ class Gerrit():
         return tickets
 
     def run_ssh_command(self, cmd):
-        retries = 0
-        wait = self.MIN_SSH_WAIT_SECS
-
-        while True:
-            try:
-                output = subprocess.check_output(cmd)
-                return output
-            except subprocess.CalledProcessError, e:
-                printdbg("Command failded. code: %s, output: %s" % (e.returncode, e.output))
-
-                if retries == self.MAX_SSH_RETRIES:
-                    printdbg("Aborting. Max retriying times excedeed")
-                    raise
-
-                printdbg("Retriying in %s seconds" % str(wait))
-                time.sleep(wait)
+        archive = get_archive()
+        if archive is not None and archive.replaying:
+            return archive.replay('ssh', ' '.join(cmd))
+
+        policy = RetryPolicy('ssh', self.MAX_SSH_RETRIES,
+                             self.MIN_SSH_WAIT_SECS, self.MAX_SSH_WAIT_SECS)
+
+        def fetch():
+            with run_stats.phase('fetch'):
+                return subprocess.check_output(cmd)
+
+        def get_policy(error):
+            if isinstance(error, subprocess.CalledProcessError):
+                printdbg("Command failed. code: %s, output: %s"
+                         % (error.returncode, error.output))
+                return policy
+            return None
 
-                retries += 1
-                wait = wait * 2
+        output = retry(fetch, get_policy)
+        run_stats.add_bytes(len(output))
+        if archive is not None:
+            archive.record(output, 'ssh', ' '.join(cmd))
+        return output
 
     def run(self):
         """
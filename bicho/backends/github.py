@@ -18,14 +18,15 @@
 # Authors: Luis Cañas Díaz <lcanas@libresoft.es>
 
 import sys
-import time
 import urllib2
 import base64
 import json
 
 from bicho.backends import Backend
 from bicho.config import Config
-from bicho.utils import printerr, printdbg, printout
+from bicho.http import get_http_client
+from bicho.pool import get_fetch_pool
+from bicho.utils import printerr, printdbg, printout, run_stats
 from bicho.common import Tracker, People, Issue, Comment, Change, \
     TempRelationship, Attachment
 from bicho.db.database import DBIssue, DBTracker, DBBackend, get_database
@@ -123,6 +124,9 @@ class DBGithubBackend(DBBackend):
 
         return None
 
+    def get_issue_modification_date(self, issue):
+        return issue.updated_at
+
     def insert_issue_ext(self, store, issue, issue_id):
         """
         Insert the given extra parameters of issue with id X{issue_id}.
@@ -140,39 +144,35 @@ class DBGithubBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBGithubIssueExt,
-                                      DBGithubIssueExt.issue_id
-                                      ==
-                                      issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBGithubIssueExt(issue_id)
-
-            db_issue_ext.status = self.__return_unicode(issue.status)
-            db_issue_ext.description = self.__return_unicode(issue.description)
-            db_issue_ext.web_link = self.__return_unicode(issue.web_link)
-            db_issue_ext.closed_at = issue.closed_at
-            db_issue_ext.updated_at = issue.updated_at
-            db_issue_ext.milestone_name = self.__return_unicode(
-                issue.milestone_name)
-            db_issue_ext.milestone_summary = self.__return_unicode(
-                issue.milestone_summary)
-            db_issue_ext.milestone_title = self.__return_unicode(
-                issue.milestone_title)
-            db_issue_ext.milestone_web_link = self.__return_unicode(
-                issue.milestone_web_link)
-            db_issue_ext.labels = self.__return_unicode(issue.labels)
-            db_issue_ext.title = self.__return_unicode(issue.title)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBGithubIssueExt,
+                                  DBGithubIssueExt.issue_id
+                                  ==
+                                  issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBGithubIssueExt(issue_id)
+
+        db_issue_ext.status = self.__return_unicode(issue.status)
+        db_issue_ext.description = self.__return_unicode(issue.description)
+        db_issue_ext.web_link = self.__return_unicode(issue.web_link)
+        db_issue_ext.closed_at = issue.closed_at
+        db_issue_ext.updated_at = issue.updated_at
+        db_issue_ext.milestone_name = self.__return_unicode(
+            issue.milestone_name)
+        db_issue_ext.milestone_summary = self.__return_unicode(
+            issue.milestone_summary)
+        db_issue_ext.milestone_title = self.__return_unicode(
+            issue.milestone_title)
+        db_issue_ext.milestone_web_link = self.__return_unicode(
+            issue.milestone_web_link)
+        db_issue_ext.labels = self.__return_unicode(issue.labels)
+        db_issue_ext.title = self.__return_unicode(issue.title)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def __return_int(self, str):
         """
@@ -500,7 +500,7 @@ class GithubBackend(Backend):
         self.__set_request_auth(request)
 
         try:
-            result = urllib2.urlopen(request)
+            result = get_http_client().urlopen(request)
             content = result.read()
         except urllib2.HTTPError, e:
             if e.code == 403:
@@ -592,9 +592,14 @@ class GithubBackend(Backend):
         auxcont = 0
         while len(bugs) > 0:
 
+            # Issues are analyzed concurrently, but in the order of bugs
+            analyzed = get_fetch_pool().map(run_stats.timed('parse',
+                                                            self.analyze_bug),
+                                            bugs)
+
             for bug in bugs:
                 try:
-                    issue_data = self.analyze_bug(bug)
+                    issue_data = next(analyzed)
                 except GitHubRateLimitReached:
                     printout("GitHub rate limit reached. To resume, wait some minutes.")
                     sys.exit(0)
@@ -621,7 +626,6 @@ class GithubBackend(Backend):
                     print e
 
                 printdbg ("Getting ticket number " + str(bug["number"]))
-                time.sleep(self.delay)
 
             self.pagecont += 1
 
@@ -93,26 +93,22 @@ class DBGoogleCodeBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBGoogleCodeIssueExt,
-                                      DBGoogleCodeIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBGoogleCodeIssueExt(issue_id)
-
-            db_issue_ext.star = unicode(issue.star)
-            db_issue_ext.ticket_num = int(issue.ticket_num)
-            db_issue_ext.mod_date = issue.mod_date
-            db_issue_ext.closed_date = issue.closed_date
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBGoogleCodeIssueExt,
+                                  DBGoogleCodeIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBGoogleCodeIssueExt(issue_id)
+
+        db_issue_ext.star = unicode(issue.star)
+        db_issue_ext.ticket_num = int(issue.ticket_num)
+        db_issue_ext.mod_date = issue.mod_date
+        db_issue_ext.closed_date = issue.closed_date
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         pass
@@ -21,9 +21,9 @@
 #          Santiago Dueñas <sduenas@libresoft.es>
 #          Alvaro del Castillo <acs@bitergia.com>
 
+import itertools
 import urllib2
 import base64
-import time
 import sys
 
 from storm.locals import Int, DateTime, Unicode, Reference, Desc
@@ -33,7 +33,10 @@ from bicho.common import Issue, People, Tracker, Comment, Change, Attachment
 from bicho.backends import Backend
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
 from bicho.config import Config
-from bicho.utils import printout, printerr, printdbg
+from bicho.http import get_http_client
+from bicho.pool import get_fetch_pool
+from bicho.utils import printout, printerr, printdbg, run_stats, \
+    parse_xml_stream
 from BeautifulSoup import BeautifulSoup
 #from BeautifulSoup import NavigableString
 from BeautifulSoup import Comment as BFComment
@@ -133,37 +136,33 @@ class DBJiraBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBJiraIssueExt,
-                                      DBJiraIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBJiraIssueExt(issue_id)
-
-            db_issue_ext.title = self.__return_unicode(issue.title)
-            db_issue_ext.issue_key = self.__return_unicode(issue.issue_key)
-            db_issue_ext.link = self.__return_unicode(issue.link)
-            db_issue_ext.environment = self.__return_unicode(issue.environment)
-            db_issue_ext.security = self.__return_unicode(issue.security)
-            db_issue_ext.updated = issue.updated
-            db_issue_ext.version = self.__return_unicode(issue.version)
-            db_issue_ext.fix_version = self.__return_unicode(issue.fix_version)
-            db_issue_ext.component = self.__return_unicode(issue.component)
-            db_issue_ext.votes = issue.votes
-            db_issue_ext.project = self.__return_unicode(issue.project)
-            db_issue_ext.project_id = issue.project_id
-            db_issue_ext.project_key = self.__return_unicode(issue.project_key)
-            db_issue_ext.status = self.__return_unicode(issue.status)
-            db_issue_ext.resolution = self.__return_unicode(issue.resolution)
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBJiraIssueExt,
+                                  DBJiraIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBJiraIssueExt(issue_id)
+
+        db_issue_ext.title = self.__return_unicode(issue.title)
+        db_issue_ext.issue_key = self.__return_unicode(issue.issue_key)
+        db_issue_ext.link = self.__return_unicode(issue.link)
+        db_issue_ext.environment = self.__return_unicode(issue.environment)
+        db_issue_ext.security = self.__return_unicode(issue.security)
+        db_issue_ext.updated = issue.updated
+        db_issue_ext.version = self.__return_unicode(issue.version)
+        db_issue_ext.fix_version = self.__return_unicode(issue.fix_version)
+        db_issue_ext.component = self.__return_unicode(issue.component)
+        db_issue_ext.votes = issue.votes
+        db_issue_ext.project = self.__return_unicode(issue.project)
+        db_issue_ext.project_id = issue.project_id
+        db_issue_ext.project_key = self.__return_unicode(issue.project_key)
+        db_issue_ext.status = self.__return_unicode(issue.status)
+        db_issue_ext.resolution = self.__return_unicode(issue.resolution)
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def __return_unicode(self, str):
         """
@@ -206,6 +205,12 @@ class DBJiraBackend(DBBackend):
             db_issue_ext = result.order_by(Desc(DBJiraIssueExt.updated))[0]
             return db_issue_ext.updated.strftime('%Y-%m-%d %H:%M')
 
+    def get_issue_modification_date(self, issue):
+        return issue.updated
+
+    def format_last_modification_date(self, date):
+        return date.strftime('%Y-%m-%d %H:%M')
+
 ####################################
 
 
@@ -702,10 +707,8 @@ class BugsHandler(xml.sax.handler.ContentHandler):
         return email
 
     def getIssues(self, conn):
-        bicho_bugs = []
-        for bug in self.issues_data:
-            bicho_bugs.append(self.getIssue(bug, conn))
-        return bicho_bugs
+        return list(get_fetch_pool().map(self.getIssue, self.issues_data,
+                                         itertools.repeat(conn)))
 
     def getIssue(self, bug, conn):
         #Return the parse data bug into issue object
@@ -750,8 +753,10 @@ class BugsHandler(xml.sax.handler.ContentHandler):
         printdbg("Bug activity: " + bug_activity_url)
         f = conn.urlopen_auth(bug_activity_url)
         data_activity = f.read()
-        parser = SoupHtmlParser(data_activity, bug.key_id)
-        changes = parser.parse_changes()
+
+        with run_stats.phase('parse'):
+            parser = SoupHtmlParser(data_activity, bug.key_id)
+            changes = parser.parse_changes()
         for c in changes:
             issue.add_change(c)
 
@@ -787,11 +792,6 @@ class JiraConnection(object):
             printout("No account data provided. Not logged in Jira")
             return
 
-        import cookielib
-
-        cookie_j = cookielib.CookieJar()
-        cookie_h = urllib2.HTTPCookieProcessor(cookie_j)
-
         auth_info = user + ':' + password
         auth_info = auth_info.replace('\n', '')
         base64string = base64.encodestring(auth_info)
@@ -799,30 +799,21 @@ class JiraConnection(object):
         request = urllib2.Request(url)
         request.add_header("Authorization", "Basic %s" % base64string)
 
-        opener = urllib2.build_opener(cookie_h)
-        urllib2.install_opener(opener)
-
-        urllib2.urlopen(request)
-        for i, c in enumerate(cookie_j):
+        # The session cookies are kept by the HTTP client
+        http = get_http_client()
+        http.urlopen(request)
+        for c in http.cookies:
             self.cookies[c.name] = c.value
 
         printout("Logged in Jira as %s" % user)
         printdbg("Jira session cookies: %s" % self.cookies)
 
-    def urlopen_auth(self, url):
+    def urlopen_auth(self, url, stream=False):
         """
         Opens an URL using an authenticated session
         """
-        request = urllib2.Request(url)
-
-        opener = urllib2.build_opener()
-
-        if self.is_auth_session():
-            q = [str(c) + '=' + v for c, v in self.cookies.items()]
-            opener.addheaders.append(('Cookie', '; '.join(q)))
-
         try:
-            return opener.open(request)
+            return get_http_client().urlopen(url, stream=stream)
         except (urllib2.HTTPError, urllib2.URLError) as e:
             printerr("Error code: %s, reason: %s" % (e.code, e.reason))
             raise e
@@ -872,38 +863,15 @@ class JiraBackend(Backend):
         bugs = data_url.split("<issue")[1].split('\"/>')[0].split("total=\"")[1]
         return int(bugs)
 
-    # http://stackoverflow.com/questions/8733233/filtering-out-certain-bytes-in-python
-    def valid_XML_char_ordinal(self, i):
-        return (  # conditions ordered by presumed frequency
-            0x20 <= i <= 0xD7FF
-            or i in (0x9, 0xA, 0xD)
-            or 0xE000 <= i <= 0xFFFD
-            or 0x10000 <= i <= 0x10FFFF)
-
     def safe_xml_parse(self, url_issues, handler):
-        f = self.conn.urlopen_auth(url_issues)
-        parser = xml.sax.make_parser()
-        parser.setContentHandler(handler)
-
+        f = self.conn.urlopen_auth(url_issues, stream=True)
         try:
-            contents = f.read()
-            parser.feed(contents)
-            parser.close()
-        except Exception:
-            # Clean only the invalid XML
-            try:
-                parser2 = xml.sax.make_parser()
-                parser2.setContentHandler(handler)
-                parser2.setContentHandler(handler)
-                printdbg("Cleaning dirty XML")
-                cleaned_contents = ''. \
-                    join(c for c in contents if self.valid_XML_char_ordinal(ord(c)))
-                parser2.feed(cleaned_contents)
-                parser2.close()
-            except Exception:
-                printerr("Error parsing URL: %s" % (url_issues))
-                raise
-        f.close()
+            parse_xml_stream(f, handler)
+        except xml.sax.SAXException:
+            printerr("Error parsing URL: %s" % (url_issues))
+            raise
+        finally:
+            f.close()
 
     def analyze_bug_list(self, nissues, offset, bugsdb, dbtrk_id):
         url_issues = self.basic_jira_url()
@@ -948,7 +916,7 @@ class JiraBackend(Backend):
             handler = BugsHandler()
             parser.setContentHandler(handler)
             try:
-                parser.parse(serverUrl + query + bug_key + "/" + bug_key + ".xml")
+                parser.parse(get_http_client().urlopen(serverUrl + query + bug_key + "/" + bug_key + ".xml"))
                 issue = handler.getIssues(self.conn)[0]
                 bugsdb.insert_issue(issue, dbtrk.id)
             except Exception, e:
@@ -968,7 +936,6 @@ class JiraBackend(Backend):
                 self.analyze_bug_list(self.max_issues, bugs_number - remaining, bugsdb, dbtrk.id)
                 remaining -= self.max_issues
                 #print "Remaining time: ", (remaining/issues_per_xml_query)*Config.delay/60, "m", "(",remaining,")"
-                time.sleep(self.delay)
 
             printout("Done. %s bugs analyzed" % (bugs_number))
 
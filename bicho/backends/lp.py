@@ -154,68 +154,64 @@ class DBLaunchpadBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBLaunchpadIssueExt,
-                                      DBLaunchpadIssueExt.issue_id
-                                      ==
-                                      issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBLaunchpadIssueExt(issue_id)
-
-            db_issue_ext.status = self.__return_unicode(issue.status)
-            db_issue_ext.description = self.__return_unicode(issue.description)
-            db_issue_ext.web_link = self.__return_unicode(issue.web_link)
-            db_issue_ext.target_display_name = self.__return_unicode(
-                issue.target_display_name)
-            db_issue_ext.target_name = self.__return_unicode(issue.target_name)
-            db_issue_ext.date_assigned = issue.date_assigned
-            db_issue_ext.date_closed = issue.date_closed
-            db_issue_ext.date_confirmed = issue.date_confirmed
-            db_issue_ext.date_created = issue.date_created
-            db_issue_ext.date_fix_committed = issue.date_fix_committed
-            db_issue_ext.date_fix_released = issue.date_fix_released
-            db_issue_ext.date_in_progress = issue.date_in_progress
-            db_issue_ext.date_incomplete = issue.date_incomplete
-            db_issue_ext.date_left_closed = issue.date_left_closed
-            db_issue_ext.date_left_new = issue.date_left_new
-            db_issue_ext.date_triaged = issue.date_triaged
-            db_issue_ext.date_last_message = issue.date_last_message
-            db_issue_ext.date_last_updated = issue.date_last_updated
-            db_issue_ext.milestone_code_name = self.__return_unicode(
-                issue.milestone_code_name)
-            db_issue_ext.milestone_data_targeted = self.__return_unicode(
-                issue.milestone_data_targeted)
-            db_issue_ext.milestone_name = self.__return_unicode(
-                issue.milestone_name)
-            db_issue_ext.milestone_summary = self.__return_unicode(
-                issue.milestone_summary)
-            db_issue_ext.milestone_title = self.__return_unicode(
-                issue.milestone_title)
-            db_issue_ext.milestone_web_link = self.__return_unicode(
-                issue.milestone_web_link)
-            db_issue_ext.heat = issue.heat
-            db_issue_ext.linked_branches = self.__return_unicode(
-                issue.linked_branches)
+        db_issue_ext = store.find(DBLaunchpadIssueExt,
+                                  DBLaunchpadIssueExt.issue_id
+                                  ==
+                                  issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBLaunchpadIssueExt(issue_id)
+
+        db_issue_ext.status = self.__return_unicode(issue.status)
+        db_issue_ext.description = self.__return_unicode(issue.description)
+        db_issue_ext.web_link = self.__return_unicode(issue.web_link)
+        db_issue_ext.target_display_name = self.__return_unicode(
+            issue.target_display_name)
+        db_issue_ext.target_name = self.__return_unicode(issue.target_name)
+        db_issue_ext.date_assigned = issue.date_assigned
+        db_issue_ext.date_closed = issue.date_closed
+        db_issue_ext.date_confirmed = issue.date_confirmed
+        db_issue_ext.date_created = issue.date_created
+        db_issue_ext.date_fix_committed = issue.date_fix_committed
+        db_issue_ext.date_fix_released = issue.date_fix_released
+        db_issue_ext.date_in_progress = issue.date_in_progress
+        db_issue_ext.date_incomplete = issue.date_incomplete
+        db_issue_ext.date_left_closed = issue.date_left_closed
+        db_issue_ext.date_left_new = issue.date_left_new
+        db_issue_ext.date_triaged = issue.date_triaged
+        db_issue_ext.date_last_message = issue.date_last_message
+        db_issue_ext.date_last_updated = issue.date_last_updated
+        db_issue_ext.milestone_code_name = self.__return_unicode(
+            issue.milestone_code_name)
+        db_issue_ext.milestone_data_targeted = self.__return_unicode(
+            issue.milestone_data_targeted)
+        db_issue_ext.milestone_name = self.__return_unicode(
+            issue.milestone_name)
+        db_issue_ext.milestone_summary = self.__return_unicode(
+            issue.milestone_summary)
+        db_issue_ext.milestone_title = self.__return_unicode(
+            issue.milestone_title)
+        db_issue_ext.milestone_web_link = self.__return_unicode(
+            issue.milestone_web_link)
+        db_issue_ext.heat = issue.heat
+        db_issue_ext.linked_branches = self.__return_unicode(
+            issue.linked_branches)
 
         #### TO DO : create comment instances for
         ## issue.set_messages()
 
-            db_issue_ext.tags = self.__return_unicode(issue.tags)
-            db_issue_ext.title = self.__return_unicode(issue.title)
-            db_issue_ext.users_affected_count = self.__return_int(
-                issue.users_affected_count)
-            db_issue_ext.web_link_standalone = self.__return_unicode(
-                issue.web_link_standalone)
+        db_issue_ext.tags = self.__return_unicode(issue.tags)
+        db_issue_ext.title = self.__return_unicode(issue.title)
+        db_issue_ext.users_affected_count = self.__return_int(
+            issue.users_affected_count)
+        db_issue_ext.web_link_standalone = self.__return_unicode(
+            issue.web_link_standalone)
 
-            if newIssue is True:
-                store.add(db_issue_ext)
+        if newIssue is True:
+            store.add(db_issue_ext)
 
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        store.flush()
+        return db_issue_ext
 
     def __return_int(self, str):
         """
@@ -280,6 +276,9 @@ class DBLaunchpadBackend(DBBackend):
         return None
 
 
+    def get_issue_modification_date(self, issue):
+        return issue.date_last_updated
+
 
 class LaunchpadIssue(Issue):
     """
@@ -981,7 +980,7 @@ class LPBackend(Backend):
         try:
             # we read the temporary table with the relationships and create
             # the final one
-            bugsdb.store_final_relationships()
+            bugsdb.store_final_relationships(dbtrk.id)
         except Exception, e:
             raise e
 
@@ -30,7 +30,9 @@ import requests
 from storm.locals import DateTime, Int, Float, Reference, Unicode, Desc
 
 from bicho.config import Config
-from bicho.utils import printout, printdbg, printerr
+from bicho.http import get_http_client
+from bicho.pool import get_fetch_pool
+from bicho.utils import printout, printdbg, printerr, run_stats
 from bicho.backends import Backend
 from bicho.common import Tracker, People, Issue, Comment, Change
 from bicho.db.database import DBIssue, DBTracker, DBBackend, NotFoundError, get_database
@@ -176,31 +178,30 @@ class DBManiphestBackend(DBBackend):
 
         return updated_on
 
+    def get_issue_modification_date(self, issue):
+        return issue.updated_on
+
     def insert_issue_ext(self, store, issue, issue_id):
         is_new = False
 
-        try:
-            db_issue_ext = store.find(DBManiphestIssueExt,
-                                      DBManiphestIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                is_new = True
-                db_issue_ext = DBManiphestIssueExt(issue_id)
-
-            db_issue_ext.phid = self.__to_unicode(issue.phid)
-            db_issue_ext.object_name = self.__to_unicode(issue.object_name)
-            db_issue_ext.status_name = self.__to_unicode(issue.status_name)
-            db_issue_ext.priority_color = self.__to_unicode(issue.priority_color)
-            db_issue_ext.points = issue.points
-            db_issue_ext.uri = self.__to_unicode(issue.uri)
-            db_issue_ext.updated_on = issue.updated_on
-
-            if is_new:
-                store.add(db_issue_ext)
+        db_issue_ext = store.find(DBManiphestIssueExt,
+                                  DBManiphestIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            is_new = True
+            db_issue_ext = DBManiphestIssueExt(issue_id)
 
-            store.flush()
-        except:
-            store.rollback()
-            raise
+        db_issue_ext.phid = self.__to_unicode(issue.phid)
+        db_issue_ext.object_name = self.__to_unicode(issue.object_name)
+        db_issue_ext.status_name = self.__to_unicode(issue.status_name)
+        db_issue_ext.priority_color = self.__to_unicode(issue.priority_color)
+        db_issue_ext.points = issue.points
+        db_issue_ext.uri = self.__to_unicode(issue.uri)
+        db_issue_ext.updated_on = issue.updated_on
+
+        if is_new:
+            store.add(db_issue_ext)
+
+        store.flush()
 
         # Remove all relationships
         self.remove_issues_projects(store, issue_id)
@@ -214,31 +215,32 @@ class DBManiphestBackend(DBBackend):
         return db_issue_ext
 
     def insert_project(self, store, project):
-        try:
+        db_project = store.find(DBManiphestProject,
+                                DBManiphestProject.phid == unicode(project.phid)).one()
+        if not db_project:
             db_project = DBManiphestProject(unicode(project.name),
                                             unicode(project.phid))
             store.add(db_project)
-            store.commit()
-        except:
-            db_project = self._get_db_project(store, project.phid)
-            db_project.name = project.name
-            store.commit()
+        else:
+            db_project.name = unicode(project.name)
+        store.flush()
         return db_project
 
     def insert_issue_project(self, store, issue_id, project_id):
-        try:
+        db_rel = store.find(DBManiphestIssueProject,
+                            DBManiphestIssueProject.issue_id == issue_id,
+                            DBManiphestIssueProject.project_id == project_id).one()
+        if not db_rel:
             db_rel = DBManiphestIssueProject(issue_id, project_id)
             store.add(db_rel)
-            store.commit()
-        except:
-            pass
+            store.flush()
 
     def remove_issues_projects(self, store, issue_id):
         result = self._get_db_issues_projects(store, issue_id)
 
         for r in result:
             store.remove(r)
-        store.commit()
+        store.flush()
 
     def insert_comment_ext(self, store, comment, comment_id):
         pass
@@ -486,9 +488,9 @@ class Conduit(object):
                 'output' : 'json',
                 '__conduit__' : True}
 
-        req = requests.post('%s/api/%s' % (self.url, method),
-                            headers=self.HEADERS,
-                            data=data)
+        req = get_http_client().post('%s/api/%s' % (self.url, method),
+                                     headers=self.HEADERS,
+                                     data=data)
         printdbg("Conduit %s method called: %s" % (method, req.url))
 
         # Raise HTTP errors, if any
@@ -759,6 +761,8 @@ class Maniphest(Backend):
                                       as_id=as_id)
 
         while ph_tasks:
+            tasks = []
+
             for pht in ph_tasks:
                 updated_on = unix_to_datetime(pht['dateModified'])
 
@@ -771,8 +775,11 @@ class Maniphest(Backend):
                              (pht['objectName'] ,str(updated_on)))
                     continue
 
-                issue = self.get_issue_from_task(pht)
+                tasks.append(pht)
+
+            get_issue = run_stats.timed('parse', self.get_issue_from_task)
 
+            for issue in get_fetch_pool().map(get_issue, tasks):
                 # Insert issue
                 self.db.insert_issue(issue, dbtrk.id)
 
@@ -21,7 +21,6 @@
 #
 
 import json
-import time
 import urllib2
 import base64
 import pprint
@@ -35,7 +34,9 @@ from BeautifulSoup import BeautifulSoup
 
 from bicho.config import Config
 from bicho.backends import Backend
-from bicho.utils import printdbg, printout
+from bicho.http import get_http_client
+from bicho.pool import get_fetch_pool
+from bicho.utils import printdbg, printout, run_stats
 from bicho.db.database import DBIssue, DBBackend, DBTracker, get_database
 from bicho.common import Tracker, Issue, People, Change, Comment
 
@@ -111,37 +112,33 @@ class DBRedmineBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBRedmineIssueExt,
-                                      DBRedmineIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBRedmineIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
-
-            db_issue_ext.category_id = issue.category_id
-            db_issue_ext.done_ratio = issue.done_ratio
-            #db_issue_ext.due_date = issue.due_date
-            #db_issue_ext.estimated_hours = issue.estimated_hours
-            db_issue_ext.fixed_version_id = issue.fixed_version_id
-            #db_issue_ext.lft = issue.lft
-            #db_issue_ext.rgt = issue.rgt
-            #db_issue_ext.lock_version = issue.lock_version
-            #db_issue_ext.parent_id = issue.parent_id
-            db_issue_ext.project_id = issue.project_id
-            #db_issue_ext.root_id = issue.root_id
-            db_issue_ext.start_date = issue.start_date
-            db_issue_ext.tracker_id = issue.tracker_id
-            db_issue_ext.updated_on = issue.updated_on
-
-            if newIssue is True:
-                store.add(db_issue_ext)
-
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBRedmineIssueExt,
+                                  DBRedmineIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBRedmineIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+
+        db_issue_ext.category_id = issue.category_id
+        db_issue_ext.done_ratio = issue.done_ratio
+        #db_issue_ext.due_date = issue.due_date
+        #db_issue_ext.estimated_hours = issue.estimated_hours
+        db_issue_ext.fixed_version_id = issue.fixed_version_id
+        #db_issue_ext.lft = issue.lft
+        #db_issue_ext.rgt = issue.rgt
+        #db_issue_ext.lock_version = issue.lock_version
+        #db_issue_ext.parent_id = issue.parent_id
+        db_issue_ext.project_id = issue.project_id
+        #db_issue_ext.root_id = issue.root_id
+        db_issue_ext.start_date = issue.start_date
+        db_issue_ext.tracker_id = issue.tracker_id
+        db_issue_ext.updated_on = issue.updated_on
+
+        if newIssue is True:
+            store.add(db_issue_ext)
+
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         """
@@ -171,6 +168,9 @@ class DBRedmineBackend(DBBackend):
         updated_on = db_issue_ext.updated_on
         return updated_on
 
+    def get_issue_modification_date(self, issue):
+        return issue.updated_on
+
 
 class RedmineIssue(Issue):
     """
@@ -214,7 +214,7 @@ class Redmine():
     def _get_statuses(self):
         root = self._get_redmine_root(Config.url)
         statuses_url = root + "issue_statuses.json"
-        f = urllib2.urlopen(statuses_url)
+        f = get_http_client().urlopen(statuses_url)
         statuses = json.loads(f.read())
 
         for status in statuses["issue_statuses"]:
@@ -230,7 +230,7 @@ class Redmine():
         #print author_url
         identity = None
         try:
-            f = urllib2.urlopen(author_url)
+            f = get_http_client().urlopen(author_url)
             person = json.loads(f.read())
             identity = person['user']['mail']
         except (urllib2.HTTPError, KeyError):
@@ -345,7 +345,7 @@ class Redmine():
         issue_url = self._get_issue_url(issue_id)
 
         printdbg("Analyzing issue journals " + issue_url)
-        f = urllib2.urlopen(issue_url)
+        f = get_http_client().urlopen(issue_url)
         data = json.loads(f.read())
         journals = data["issue"]["journals"]
 
@@ -439,17 +439,17 @@ class Redmine():
         # Get statuses
         self._get_statuses()
 
-        f = urllib2.urlopen(request)
+        f = get_http_client().urlopen(request)
         tickets = json.loads(f.read())
 
         if not tickets["issues"]:
             printout("Done. No new bugs to analyze")
             return
 
-        for ticket in tickets["issues"]:
-            issue = self.analyze_bug(ticket)
+        analyze_bug = run_stats.timed('parse', self.analyze_bug)
+
+        for issue in get_fetch_pool().map(analyze_bug, tickets["issues"]):
             bugsdb.insert_issue(issue, dbtrk.id)
-            time.sleep(self.delay)
 
         last_ticket = tickets["issues"][0]['id']
 
@@ -459,7 +459,7 @@ class Redmine():
             request = urllib2.Request(url)
             #base64string = base64.encodestring('%s:%s' % (Config.backend_user, Config.backend_password)).replace('\n', '')
             #request.add_header("Authorization", "Basic %s" % base64string)
-            f = urllib2.urlopen(request)
+            f = get_http_client().urlopen(request)
             tickets = json.loads(f.read())
 
             if len(tickets['issues']) == 0:
@@ -470,10 +470,9 @@ class Redmine():
             if tickets["issues"][0]['id'] == last_ticket:
                 break
 
-            for ticket in tickets["issues"]:
-                issue = self.analyze_bug(ticket)
+            for issue in get_fetch_pool().map(analyze_bug,
+                                              tickets["issues"]):
                 bugsdb.insert_issue(issue, dbtrk.id)
-                time.sleep(self.delay)
 
         pprint.pprint("Total pages: " + str(last_page))
 
@@ -38,6 +38,7 @@ from bicho.common import Issue, People, Tracker, Comment, Attachment, Change
 from bicho.backends import Backend
 from bicho.db.database import DBIssue, DBBackend, get_database
 from bicho.config import Config
+from bicho.http import get_http_client
 from bicho.utils import printdbg, printout, printerr
 
 from dateutil.parser import parse
@@ -187,25 +188,21 @@ class DBSourceForgeBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBSourceForgeIssueExt,
-                                      DBSourceForgeIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBSourceForgeIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+        db_issue_ext = store.find(DBSourceForgeIssueExt,
+                                  DBSourceForgeIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBSourceForgeIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
 
-            db_issue_ext.category = unicode(issue.category)
-            db_issue_ext.group = unicode(issue.group)
+        db_issue_ext.category = unicode(issue.category)
+        db_issue_ext.group = unicode(issue.group)
 
-            if newIssue is True:
-                store.add(db_issue_ext)
+        if newIssue is True:
+            store.add(db_issue_ext)
 
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        store.flush()
+        return db_issue_ext
 
     def insert_comment_ext(self, store, comment, comment_id):
         """
@@ -684,7 +681,7 @@ class SourceForge():
     def __get_html(self, url):
         """
         """
-        html = urllib2.urlopen(url).read()
+        html = get_http_client().urlopen(url).read()
         return html
 
     def __check_tracker_url(self, url):
@@ -22,7 +22,9 @@
 from bicho.config import Config
 
 from bicho.backends import Backend
-from bicho.utils import create_dir, printdbg, printout, printerr
+from bicho.http import get_http_client
+from bicho.utils import create_dir, printdbg, printout, printerr, \
+    run_stats
 from bicho.db.database import DBIssue, DBChange, DBPeople, DBBackend, get_database
 from bicho.common import Tracker, Issue, People, Change
 
@@ -39,7 +41,6 @@ import random
 import sys
 import time
 import traceback
-import urllib
 
 
 from storm.locals import DateTime, Desc, Int, Reference, Unicode, Bool
@@ -118,38 +119,36 @@ class DBStoryBoardBackend(DBBackend):
     """
     Adapter for StoryBoard backend.
     """
+    uses_store = True
+
     def __init__(self):
         self.MYSQL_EXT = [DBStoryBoardIssueExtMySQL,DBStoryBoardStoryMySQL]
 
     def insert_story(self, store, story):
         newStory = False
-        try:
-            db_story = store.find(DBStoryBoardStory,
-                                  DBStoryBoardStory.story_id == story['id']).one()
-            if not db_story:
-                newStory = True
-                db_story = DBStoryBoardStory(story['id'])
-
-            db_story.updated_at = StoryBoard.convert_to_datetime(story['updated_at'])
-            db_story.created_at = StoryBoard.convert_to_datetime(story['created_at'])
-            db_story.status = story['status']
-            if story['creator_id']:
-                db_story.creator_id = story['creator_id']
-            else:
-                db_story.creator_id = -1
-            db_story.is_bug = story['is_bug']
-            db_story.description = story['description']
-            db_story.title = story['title']
-            db_story.tags = unicode(";".join(story['tags']))
+        db_story = store.find(DBStoryBoardStory,
+                              DBStoryBoardStory.story_id == story['id']).one()
+        if not db_story:
+            newStory = True
+            db_story = DBStoryBoardStory(story['id'])
+
+        db_story.updated_at = StoryBoard.convert_to_datetime(story['updated_at'])
+        db_story.created_at = StoryBoard.convert_to_datetime(story['created_at'])
+        db_story.status = story['status']
+        if story['creator_id']:
+            db_story.creator_id = story['creator_id']
+        else:
+            db_story.creator_id = -1
+        db_story.is_bug = story['is_bug']
+        db_story.description = story['description']
+        db_story.title = story['title']
+        db_story.tags = unicode(";".join(story['tags']))
 
-            if newStory is True:
-                store.add(db_story)
+        if newStory is True:
+            store.add(db_story)
 
-            store.flush()
-            return db_story
-        except:
-            store.rollback()
-            raise
+        store.flush()
+        return db_story
 
     def insert_issue_ext(self, store, issue, issue_id):
         """
@@ -168,31 +167,27 @@ class DBStoryBoardBackend(DBBackend):
 
         newIssue = False
 
-        try:
-            db_issue_ext = store.find(DBStoryBoardIssueExt,
-                                      DBStoryBoardIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                newIssue = True
-                db_issue_ext = DBStoryBoardIssueExt(issue_id)
-                #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
+        db_issue_ext = store.find(DBStoryBoardIssueExt,
+                                  DBStoryBoardIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            newIssue = True
+            db_issue_ext = DBStoryBoardIssueExt(issue_id)
+            #db_issue_ext = DBSourceForgeIssueExt(issue.category, issue.group, issue_id)
 
 
-            self.project_id = None
-            self.story_id = None
-            self.mod_date = None
+        self.project_id = None
+        self.story_id = None
+        self.mod_date = None
 
-            db_issue_ext.project_id = issue.project_id
-            db_issue_ext.story_id = issue.story_id
-            db_issue_ext.mod_date = issue.mod_date
+        db_issue_ext.project_id = issue.project_id
+        db_issue_ext.story_id = issue.story_id
+        db_issue_ext.mod_date = issue.mod_date
 
-            if newIssue is True:
-                store.add(db_issue_ext)
+        if newIssue is True:
+            store.add(db_issue_ext)
 
-            store.flush()
-            return db_issue_ext
-        except:
-            store.rollback()
-            raise
+        store.flush()
+        return db_issue_ext
 
     def insert_change_ext(self, store, change, change_id):
         """
@@ -211,6 +206,12 @@ class DBStoryBoardBackend(DBBackend):
 
         return None
 
+    def get_issue_modification_date(self, issue):
+        return issue.mod_date
+
+    def format_last_modification_date(self, date):
+        return date.strftime('%Y-%m-%dT%H:%M:%SZ')
+
 
 class StoryBoardIssue(Issue):
     """
@@ -329,7 +330,7 @@ class StoryBoard():
 
         logging.debug("URL for getting tasks " + self.url_tasks)
 
-        f = urllib.urlopen(self.url_tasks_total)
+        f = get_http_client().urlopen(self.url_tasks_total)
         total_tasks = int(f.info()['x-total'])
         limit_tasks = int(f.info()['x-limit'])
         f.close()
@@ -353,12 +354,13 @@ class StoryBoard():
 
             logging.info("URL for next tasks " + self.url_tasks_page)
 
-            f = urllib.urlopen(self.url_tasks_page)
+            f = get_http_client().urlopen(self.url_tasks_page)
             taskList = json.loads(f.read())
 
             for task in taskList:
                 try:
-                    issue_data = self.analyze_task(task)
+                    with run_stats.phase('parse'):
+                        issue_data = self.analyze_task(task)
                     marker = task['id']
                     if issue_data is None:
                         continue
@@ -405,7 +407,7 @@ class StoryBoard():
                         continue
                     # logging.info("Adding to " + task.summary + " " + task.status + " event")
                     change = Change(field, old_value, task.status, by, task_ext.mod_date)
-                    self.bugsdb._insert_change(change, task.id, self.dbtrk.id)
+                    self.bugsdb.insert_changes([change], task.id, self.dbtrk.id)
 
     def analyze_stories_and_events(self):
         # The changes in tasks is in stories events
@@ -416,7 +418,7 @@ class StoryBoard():
         self.url_stories_total = self.url_stories + "&limit=1"
         self.url_stories += "&limit="+str(self.items_per_query)
 
-        f = urllib.urlopen(self.url_stories_total)
+        f = get_http_client().urlopen(self.url_stories_total)
         total_stories = int(f.info()['x-total'])
         f.close()
 
@@ -441,7 +443,7 @@ class StoryBoard():
 
             logging.info("URL for next stories " + self.url_stories_page)
 
-            f = urllib.urlopen(self.url_stories_page)
+            f = get_http_client().urlopen(self.url_stories_page)
             storiesList = json.loads(f.read())
             logging.info("Stories gathered: " + str(len(storiesList)))
 
@@ -479,9 +481,11 @@ class StoryBoard():
         remaining = len(storiesUpdated)
         for story_id in storiesUpdated:
             url_events = Config.url + "/api/v1/stories/" + str(story_id) + "/events"
-            f = urllib.urlopen(url_events)
+            f = get_http_client().urlopen(url_events)
             data = f.read()
             events = json.loads(data)
+            # Changes of the tasks of the story, by issue
+            changes = {}
 
             for event in events:
                 if event['event_info'] is None: continue
@@ -495,10 +499,11 @@ class StoryBoard():
                         logging.info(event)
                         continue
                     change = self.parse_change(event)
-                    db_change = self.bugsdb._get_db_change(change, issue.id, self.dbtrk.id)
-                    if db_change == -1:
-                        self.bugsdb._insert_change(change, issue.id, self.dbtrk.id)
+                    changes.setdefault(issue.id, []).append(change)
 
+            # Changes already stored are skipped
+            for issue_id, issue_changes in changes.items():
+                self.bugsdb.insert_changes(issue_changes, issue_id, self.dbtrk.id)
 
             remaining -= 1
             if remaining % 100 == 0: logging.info("Remaining: " + str(remaining))
@@ -525,7 +530,7 @@ class StoryBoard():
         self.url_users_total = self.url_users + "?limit=1"
         self.url_users += "?limit="+str(self.items_per_query)
 
-        f = urllib.urlopen(self.url_users_total)
+        f = get_http_client().urlopen(self.url_users_total)
         total_users = int(f.info()['x-total'])
         f.close()
 
@@ -541,7 +546,7 @@ class StoryBoard():
 
             logging.info("URL for next users " + self.url_users_page)
 
-            f = urllib.urlopen(self.url_users_page)
+            f = get_http_client().urlopen(self.url_users_page)
             userList = json.loads(f.read())
             marker = userList[-1]['id']
             start_page += 1
@@ -568,7 +573,7 @@ class StoryBoard():
         trk = Tracker(Config.url, "storyboard", "beta")
         self.dbtrk = self.bugsdb.insert_tracker(trk)
 
-        self.last_mod_date = self.bugsdb.get_last_modification_date()
+        self.last_mod_date = self.bugsdb.get_last_modification_date(tracker_id=self.dbtrk.id)
 
         if self.last_mod_date:
             logging.info("Last bugs analyzed were modified on: %s" % self.last_mod_date)
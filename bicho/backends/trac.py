@@ -31,7 +31,9 @@ from storm.locals import DateTime, Int, Float, Reference, Unicode, Desc
 from bicho.backends import Backend
 from bicho.common import Tracker, People, Issue, Comment, Change
 from bicho.config import Config
-from bicho.utils import printout, printdbg, printerr
+from bicho.http import get_http_client
+from bicho.pool import get_fetch_pool
+from bicho.utils import printout, printdbg, printerr, run_stats
 from bicho.db.database import DBIssue, DBTracker, DBBackend, get_database
 
 
@@ -99,31 +101,30 @@ class DBTracBackend(DBBackend):
 
         return updated_on
 
+    def get_issue_modification_date(self, issue):
+        return issue.updated_on
+
     def insert_issue_ext(self, store, issue, issue_id):
         is_new = False
 
-        try:
-            db_issue_ext = store.find(DBTracIssueExt,
-                                      DBTracIssueExt.issue_id == issue_id).one()
-            if not db_issue_ext:
-                is_new = True
-                db_issue_ext = DBTracIssueExt(issue_id)
-
-                db_issue_ext.milestone = self.__to_unicode(issue.milestone)
-                db_issue_ext.component = self.__to_unicode(issue.component)
-                db_issue_ext.keywords = self.__to_unicode(issue.keywords)
-                db_issue_ext.version = self.__to_unicode(issue.version)
-                db_issue_ext.rhbz = issue.rhbz
-                db_issue_ext.uri = self.__to_unicode(issue.uri)
-                db_issue_ext.updated_on = issue.updated_on
-
-            if is_new:
-                store.add(db_issue_ext)
-
-            store.flush()
-        except:
-            store.rollback()
-            raise
+        db_issue_ext = store.find(DBTracIssueExt,
+                                  DBTracIssueExt.issue_id == issue_id).one()
+        if not db_issue_ext:
+            is_new = True
+            db_issue_ext = DBTracIssueExt(issue_id)
+
+            db_issue_ext.milestone = self.__to_unicode(issue.milestone)
+            db_issue_ext.component = self.__to_unicode(issue.component)
+            db_issue_ext.keywords = self.__to_unicode(issue.keywords)
+            db_issue_ext.version = self.__to_unicode(issue.version)
+            db_issue_ext.rhbz = issue.rhbz
+            db_issue_ext.uri = self.__to_unicode(issue.uri)
+            db_issue_ext.updated_on = issue.updated_on
+
+        if is_new:
+            store.add(db_issue_ext)
+
+        store.flush()
 
     def insert_comment_ext(self, store, comment, comment_id):
         pass
@@ -302,10 +303,10 @@ class TracRPC(object):
         else:
             url = '%s/jsonrpc' % self.url
 
-        res = requests.post(url,
-                            headers=self.HEADERS,
-                            data=data,
-                            auth=auth)
+        res = get_http_client().post(url,
+                                     headers=self.HEADERS,
+                                     data=data,
+                                     auth=auth)
         
         printdbg("Trac RPC %s method called: %s" % (method, res.url))
 
@@ -363,6 +364,11 @@ class Trac(Backend):
 
         return identity
 
+    def fetch_issue(self, ticket_id):
+        printdbg("Fetching ticket %s" % str(ticket_id))
+        ticket = self.trac_rpc.ticket(ticket_id)
+        return self.get_issue_from_ticket(ticket)
+
     def get_issue_from_ticket(self, ticket):
         printdbg("Parsing ticket %s" % (ticket[0]))
 
@@ -470,12 +476,11 @@ class Trac(Backend):
 
         trac_tickets = self.trac_rpc.tickets(last_mod_date)
 
-        for ticket_id in trac_tickets:
-            printdbg("Fetching ticket %s" % str(ticket_id))
-            ticket = self.trac_rpc.ticket(ticket_id)
-
-            issue = self.get_issue_from_ticket(ticket)
+        issues = get_fetch_pool().map(run_stats.timed('parse',
+                                                      self.fetch_issue),
+                                      trac_tickets)
 
+        for issue in issues:
             # Insert issue
             self.db.insert_issue(issue, dbtrk.id)
 
@@ -113,18 +113,41 @@ class Config():
         same as the configuration argument specifying that backend. For
         instance, invoking the Launchpad backend uses 'lp', and so the filename
         is 'lp.py'.
+
+        When issues are read from a database, the URL only selects the
+        tracker to read and the backend the post-processing to run;
+        the tracker is not accessed.
         """
-        Config.check_params(['url', 'backend'])
+        from_db = getattr(Config, 'input', None) == 'db'
 
-        if Config.backend + ".py" not in Backend.get_all_backends():
-            raise InvalidConfig('Backend "' + Config.backend + '" does not exist')
+        if not from_db:
+            Config.check_params(['url', 'backend'])
 
-        url = urlparse.urlparse(Config.url)
-        check_url = urlparse.urljoin(url.scheme + '://' + url.netloc, '')
-        print("Checking URL: " + check_url)
-        req = Request(check_url)
+        backend = getattr(Config, 'backend', None)
+        if backend is not None and \
+                backend + ".py" not in Backend.get_all_backends():
+            raise InvalidConfig('Backend "' + Config.backend + '" does not exist')
 
-        if Config.backend != 'github':
+        # Archives are never recorded over
+        record = getattr(Config, 'record', None)
+        if record:
+            from archive import ARCHIVE_INDEX, ARCHIVE_DATA
+            if os.path.exists(os.path.join(record, ARCHIVE_INDEX)) or \
+                    os.path.exists(os.path.join(record, ARCHIVE_DATA)):
+                raise InvalidConfig('There is already an archive on %s; '
+                                    'remove it or record on another '
+                                    'directory' % record)
+
+        # Replayed runs don't access the tracker
+        access_tracker = not from_db and not getattr(Config, 'replay', None)
+
+        if access_tracker:
+            url = urlparse.urlparse(Config.url)
+            check_url = urlparse.urljoin(url.scheme + '://' + url.netloc, '')
+            print("Checking URL: " + check_url)
+            req = Request(check_url)
+
+        if access_tracker and Config.backend != 'github':
             try:
                 response = urlopen(req)
             except HTTPError, e:
@@ -135,7 +158,7 @@ class Config():
             except ValueError, e:
                 print("Not an URL: " + Config.url)
 
-        if Config.backend == 'maniphest':
+        if backend == 'maniphest':
             start_from = getattr(Config, 'start_from', None)
             from_id = getattr(Config, 'from_id', None)
 
@@ -158,11 +181,17 @@ class Config():
             else:
                 Config.from_id = None
 
-        if getattr(Config, 'input', None) == 'db':
+        if from_db and getattr(Config, 'db_driver_in', None) == 'sqlite':
+            Config.check_params(['db_database_in'])
+        elif from_db:
             Config.check_params(['db_driver_in', 'db_user_in',
                                  'db_password_in', 'db_hostname_in',
                                  'db_port_in', 'db_database_in'])
-        if getattr(Config, 'output', None) == 'db':
+        if getattr(Config, 'output', None) == 'db' and \
+                getattr(Config, 'db_driver_out', None) == 'sqlite':
+            # SQLite only needs the path of the database file
+            Config.check_params(['db_database_out'])
+        elif getattr(Config, 'output', None) == 'db':
             Config.check_params(['db_driver_out', 'db_user_out',
                                  'db_password_out', 'db_hostname_out',
                                  'db_port_out', 'db_database_out'])
@@ -210,7 +239,9 @@ class Config():
         parser.add_argument('-c', '--cfg', dest='cfgfile',
                             help='Use a custom configuration file', default=None)
         parser.add_argument('-d', '--delay', type=int, dest='delay',
-                            help='Delay in seconds betweeen petitions to avoid been banned',
+                            help='Minimum delay in seconds between requests '
+                            'to a host; it grows when the host asks to '
+                            'slow down',
                             default='5')
         parser.add_argument('-g', '--debug', action='store_true', dest='debug',
                             help='Enable debug mode', default=False)
@@ -219,8 +250,26 @@ class Config():
                             default=None)
         parser.add_argument('-i', '--input', choices=['url', 'db'],
                             dest='input', help='Input format', default='url')
-        parser.add_argument('-o', '--output', choices=['db'],
-                            dest='output', help='Output format', default='db')
+        parser.add_argument('-o', '--output', choices=['db', 'jsonl', 'null'],
+                            dest='output',
+                            help='Output format; null discards the issues '
+                            'and reports the throughput of the backend',
+                            default='db')
+        parser.add_argument('--output-file', dest='output_file',
+                            help='File where jsonl output is written; '
+                            'gzip compressed when it ends with .gz. '
+                            'Default: standard output',
+                            default=None)
+        group = parser.add_mutually_exclusive_group()
+        group.add_argument('--record', dest='record', metavar='DIR',
+                           help='Record the requests to the tracker and '
+                           'their responses on DIR, which must not hold '
+                           'another archive',
+                           default=None)
+        group.add_argument('--replay', dest='replay', metavar='DIR',
+                           help='Read the responses recorded on DIR '
+                           'instead of accessing the tracker',
+                           default=None)
         parser.add_argument('-p', '--path', dest='path',
                             help='Path where downloaded URLs will be stored',
                             default=None)
@@ -234,6 +283,34 @@ class Config():
         parser.add_argument('-n', '--num-issues', type=int, dest='nissues',
                             help='Number of issues requested on each query',
                             default=MAX_ISSUES_PER_QUERY)
+        parser.add_argument('--http-timeout', type=int, dest='http_timeout',
+                            help='Seconds to wait for the tracker before '
+                            'giving up a request',
+                            default=120)
+        parser.add_argument('--http-cache-size', type=int,
+                            dest='http_cache_size',
+                            help='Maximum size in MB of the cache of HTTP '
+                            'responses; 0 disables the cache',
+                            default=256)
+        parser.add_argument('--fetch-workers', type=int, dest='fetch_workers',
+                            help='Number of threads fetching the details '
+                            'of the issues',
+                            default=1)
+        parser.add_argument('--fetch-engine', choices=['threads', 'gevent'],
+                            dest='fetch_engine',
+                            help='Workers fetching the details of the '
+                            'issues; gevent runs them on an event loop',
+                            default='threads')
+        parser.add_argument('--host-requests', type=int, dest='host_requests',
+                            help='Maximum number of requests sent at once '
+                            'to a host. Default: 4, or the number of fetch '
+                            'workers with gevent',
+                            default=None)
+        parser.add_argument('--retry-max-time', type=int,
+                            dest='retry_max_time',
+                            help='Maximum number of seconds spent retrying '
+                            'a failed request',
+                            default=600)
 
         # Options for output database
         group = parser.add_argument_group('Output database specific options')
@@ -253,6 +330,24 @@ class Config():
                            default='3306')
         group.add_argument('--db-database-out', dest='db_database_out',
                            help='Output database name', default=None)
+        group.add_argument('--commit-every', type=int, dest='commit_every',
+                           help='Number of issues stored on each commit; '
+                           '0 disables commits by number of issues',
+                           default=1)
+        group.add_argument('--commit-interval', type=int,
+                           dest='commit_interval',
+                           help='Maximum number of seconds between commits',
+                           default=None)
+        group.add_argument('--store-queue-size', type=int,
+                           dest='store_queue_size',
+                           help='Number of issues queued for a storage '
+                           'thread; 0 stores them while fetching',
+                           default=0)
+        group.add_argument('--store-cache-size', type=int,
+                           dest='store_cache_size',
+                           help='Maximum number of database objects kept '
+                           'in memory between commits',
+                           default=10000)
 
         # Options for input database
         group = parser.add_argument_group('Input database specific options')
@@ -24,15 +24,231 @@
 Database module
 """
 
+import atexit
 import datetime
+import hashlib
+import re
+import time
 
+from storm.cache import GenerationalCache
 from storm.exceptions import IntegrityError # DatabaseError,
-from storm.locals import DateTime, Int, Reference, Unicode
+from storm.locals import DateTime, Int, Reference, Store, Unicode
 
-from bicho.utils import printdbg
+from bicho.utils import printdbg, printerr, run_stats, LRUCache
 from bicho.config import Config
 
 
+# Limits of each multi-row INSERT statement. The size limit is
+# approximated from the length of the values and keeps statements
+# under the default max_allowed_packet of MySQL.
+MAX_ROWS_PER_INSERT = 500
+MAX_BYTES_PER_INSERT = 1024 * 1024
+
+# Number of identities whose database identifier is kept in memory
+PEOPLE_CACHE_SIZE = 50000
+
+# Number of database objects kept in the cache of the store. The
+# store is reset after a commit when more objects are alive.
+STORE_CACHE_SIZE = 10000
+
+# Savepoint set before storing each issue when commits are batched
+ISSUE_SAVEPOINT = 'bicho_issue'
+
+
+def fingerprint(*values):
+    """
+    Return a stable hash of the given values.
+
+    Dates are truncated to seconds, which is the precision they
+    are stored with.
+
+    @return: hexadecimal SHA-1 digest
+    @rtype: C{unicode}
+    """
+    h = hashlib.sha1()
+    for value in values:
+        if value is None:
+            value = '\x01'
+        elif isinstance(value, datetime.datetime):
+            value = value.strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif not isinstance(value, str):
+            value = str(value)
+        h.update(value)
+        h.update('\x00')
+    return unicode(h.hexdigest())
+
+
+def issue_fingerprint(issue):
+    """
+    Return the fingerprint of the whole content of an issue.
+
+    Every attribute of the issue is hashed, including the ones
+    added by the backends and its comments, attachments, changes,
+    relationships and watchers, so any change on the data fetched
+    gives a different fingerprint.
+
+    @param issue: issue to hash
+    @type issue: L{Issue}
+
+    @return: hexadecimal SHA-1 digest
+    @rtype: C{unicode}
+    """
+    values = []
+    _flatten_issue_value(issue, values, set())
+    return fingerprint(*values)
+
+
+def _flatten_issue_value(value, values, seen):
+    """
+    Append the given value to X{values} as a sequence of plain
+    values, in a stable order.
+    """
+    if value is None or isinstance(value, (basestring, int, long, float,
+                                           datetime.datetime)):
+        # Dates with time zone or microseconds are kept as they are
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        values.append(value)
+    elif isinstance(value, (list, tuple)):
+        values.append('[%d' % len(value))
+        for item in value:
+            _flatten_issue_value(item, values, seen)
+    elif isinstance(value, (set, frozenset, dict)):
+        if isinstance(value, dict):
+            items = value.items()
+        else:
+            items = [(item, None) for item in value]
+        values.append('{%d' % len(items))
+        for key, item in sorted(items, key=lambda i: repr(i[0])):
+            _flatten_issue_value(key, values, seen)
+            _flatten_issue_value(item, values, seen)
+    elif hasattr(value, '__dict__') and id(value) not in seen:
+        seen.add(id(value))
+        values.append('<' + value.__class__.__name__)
+        _flatten_issue_value(vars(value), values, seen)
+        seen.discard(id(value))
+    else:
+        values.append(repr(value))
+
+
+def comment_fingerprint(issue_id, submitted_by, submitted_on, text):
+    """
+    Return the fingerprint that identifies a comment of an issue.
+    """
+    return fingerprint(issue_id, submitted_by, submitted_on, text)
+
+
+def attachment_fingerprint(issue_id, submitted_by, submitted_on, url):
+    """
+    Return the fingerprint that identifies an attachment of an issue.
+    """
+    return fingerprint(issue_id, submitted_by, submitted_on, url)
+
+
+def change_fingerprint(issue_id, changed_by, changed_on, field,
+                       old_value, new_value):
+    """
+    Return the fingerprint that identifies a change of an issue.
+    """
+    return fingerprint(issue_id, changed_by, changed_on, field,
+                       old_value, new_value)
+
+
+def convert_mysql_table(sql, primary_key, types=None):
+    """
+    Convert a MySQL CREATE TABLE statement into statements for
+    other databases.
+
+    Only the subset of MySQL used by the backends is supported:
+    X{AUTO_INCREMENT} and X{UNSIGNED} columns, X{UNIQUE KEY} and
+    X{INDEX} definitions, foreign keys and table options. Indexes
+    are created on their own statements because their names must
+    be unique in the whole database.
+
+    @param sql: MySQL CREATE TABLE statement
+    @type sql: C{str}
+    @param primary_key: definition of the X{AUTO_INCREMENT} column
+    @type primary_key: C{str}
+    @param types: regular expressions of MySQL types and their
+     replacements
+    @type types: C{list} of C{tuple}
+
+    @return: statements separated by semicolons
+    @rtype: C{str}
+    """
+    m = re.match(r'\s*CREATE\s+(TEMPORARY\s+)?TABLE\s+(IF\s+NOT\s+EXISTS\s+)?'
+                 r'(\w+)\s*\((.*)\)[^)]*$', sql, re.I | re.S)
+    if not m:
+        raise ValueError('Unsupported table definition: %s' % sql)
+
+    temporary, table, body = m.group(1), m.group(3), m.group(4)
+
+    columns = []
+    indexes = []
+    auto_increment = None
+
+    for definition in _split_definitions(body):
+        definition = ' '.join(definition.split())
+        upper = definition.upper()
+
+        if upper.startswith('PRIMARY KEY'):
+            key = re.search(r'\((.*)\)', definition).group(1).strip()
+            if key == auto_increment:
+                continue
+            columns.append(definition)
+        elif upper.startswith('UNIQUE'):
+            key = re.search(r'\((.*)\)', definition).group(1)
+            columns.append('UNIQUE(%s)' % key)
+        elif re.match(r'(INDEX|KEY)\s+\w+\s*\(', upper):
+            im = re.match(r'\w+\s+(\w+)\s*\((.*)\)', definition)
+            indexes.append('CREATE INDEX IF NOT EXISTS %s_%s ON %s(%s)'
+                           % (table, im.group(1), table, im.group(2)))
+        elif upper.startswith('FOREIGN KEY'):
+            columns.append(definition)
+        else:
+            definition = re.sub(r'(?i)\s+UNSIGNED\b', '', definition)
+            if 'AUTO_INCREMENT' in upper:
+                auto_increment = definition.split()[0]
+                definition = auto_increment + ' ' + primary_key
+            else:
+                name, rest = definition.split(' ', 1)
+                for mysql_type, new_type in types or []:
+                    rest = re.sub(r'(?i)^' + mysql_type, new_type, rest)
+                definition = name + ' ' + rest
+            columns.append(definition)
+
+    if temporary:
+        stmt = 'CREATE TEMPORARY TABLE IF NOT EXISTS'
+    else:
+        stmt = 'CREATE TABLE IF NOT EXISTS'
+    stmts = ['%s %s (%s)' % (stmt, table, ', '.join(columns))] + indexes
+    return '; '.join(stmts)
+
+
+def _split_definitions(body):
+    """
+    Split the body of a CREATE TABLE statement in its definitions.
+    """
+    definitions = []
+    depth = 0
+    current = ''
+    for char in body:
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        if char == ',' and depth == 0:
+            definitions.append(current)
+            current = ''
+        else:
+            current += char
+    if current.strip():
+        definitions.append(current)
+    return [d.strip() for d in definitions if d.strip()]
+
+
 class NotFoundError(Exception):
     """
     Exception raised when an entry is not found into the database.
@@ -49,24 +265,87 @@ class NotFoundError(Exception):
 
 class DBDatabase:
     """
+    Base class of the database adapters.
+
+    Stored issues are committed in batches of X{commit_every} issues
+    or every X{commit_interval} seconds, whichever comes first. When
+    commits are batched on a X{transactional} database, each issue is
+    stored under a savepoint so a failure only discards that issue.
+    Databases without transactions keep the rows written before the
+    failure; the issue is written again on the next run, because its
+    fingerprint is only saved once it is completely stored.
+
+    The memory used by the store is bounded by X{store_cache_size}
+    objects: the store is reset after a commit when it keeps more
+    objects alive. Database objects got before a reset can still be
+    read, but changes made to them are no longer stored.
     """
+    # Whether the changes of a failed issue can be rolled back
+    transactional = True
+
+    # Value of assigned_to for issues without assignee
+    unassigned_id = 0
+
+    # Whether the database inserts several rows with a single
+    # INSERT statement; otherwise, rows are inserted one per
+    # statement. Either way, adapters that write rows with
+    # _insert_rows must implement _get_first_insert_id.
+    multi_row_insert = False
+
+    # Maximum number of parameters of a statement; None when
+    # the database doesn't limit it
+    max_insert_params = None
+
+    # Expression to convert a value to a string that can be compared
+    # with the identifiers of the issues in SQL statements
+    text_cast = 'CAST(%s AS CHAR)'
+
     def __init__(self, backend=None):
         self.database = None
         self.store = None
         self.backend = backend
+        self._people_cache = LRUCache(PEOPLE_CACHE_SIZE)
+
+        self.store_cache_size = getattr(Config, 'store_cache_size',
+                                        STORE_CACHE_SIZE)
+        self._store_resets = 0
+
+        self.commit_every = getattr(Config, 'commit_every', 1)
+        self.commit_interval = getattr(Config, 'commit_interval', None)
+        self._pending_issues = 0
+        self._last_commit = time.time()
+
+        # Watermarks of the issues pending to be committed, indexed
+        # by tracker
+        self._pending_watermarks = {}
+
+    def _create_store(self):
+        """
+        Create the store of the database, caching up to
+        X{store_cache_size} objects.
+
+        @return: the store
+        @rtype: L{Store}
+        """
+        # The cache keeps two generations of the given size
+        size = max(self.store_cache_size // 2, 1)
+        return Store(self.database, cache=GenerationalCache(size))
 
     def create_tables(self, clsl):
         """
         Create the database tables.
 
         SQL query with the structure of each table is stored into
-        X{__sql_table__} attribute of database classes.
+        X{__sql_table__} attribute of database classes. It may have
+        several statements separated by semicolons.
 
         @param clsl: a list of database classes
         @type clsl: C{list} of L{object}
         """
         for c in clsl:
-            self.store.execute(c.__sql_table__)
+            for stmt in c.__sql_table__.split(';'):
+                if stmt.strip():
+                    self.store.execute(stmt)
 
     def insert_supported_traker(self, name, version):
         """
@@ -81,11 +360,11 @@ class DBDatabase:
         @rtype: L{DBSupportedTracker}
         """
         try:
+            db_sup = self._get_db_supported_tracker(name, version)
+        except NotFoundError:
             db_sup = DBSupportedTracker(name, version)
             self.store.add(db_sup)
-            self.store.commit()
-        except:
-            db_sup = self._get_db_supported_tracker(name, version)
+            self.store.flush()
         return db_sup
 
     def insert_tracker(self, tracker):
@@ -98,20 +377,16 @@ class DBDatabase:
         @return: the inserted tracker
         @rtype: L{DBTracker}
         """
-        try:
-            db_sup = self._get_db_supported_tracker(tracker.name,
-                                                    tracker.version)
-        except:
-            raise
+        db_sup = self._get_db_supported_tracker(tracker.name,
+                                                tracker.version)
 
         try:
-            db_tracker = DBTracker(tracker.url, db_sup.id)
-            self.store.add(db_tracker)
-            self.store.commit()
-        except:
             db_tracker = self._get_db_tracker(tracker.url)
             db_tracker.retrieved_on = datetime.datetime.now()
-            self.store.commit()
+        except NotFoundError:
+            db_tracker = DBTracker(tracker.url, db_sup.id)
+            self.store.add(db_tracker)
+        self.store.flush()
         return db_tracker
 
     def insert_people(self, people):
@@ -124,16 +399,39 @@ class DBDatabase:
         @return: the inserted identity
         @rtype: L{People}
         """
-        try:
-            db_people = DBPeople(people.user_id)
+        user_id = unicode(people.user_id)
+
+        db_people = self.store.find(DBPeople,
+                                    DBPeople.user_id == user_id).one()
+        if not db_people:
+            db_people = DBPeople(user_id)
             db_people.set_name(people.name)
             db_people.set_email(people.email)
             self.store.add(db_people)
-            self.store.commit()
-        except IntegrityError:
-            db_people = self._get_db_people(people.user_id)
+            self.store.flush()
+
+        self._people_cache[user_id] = db_people.id
         return db_people
 
+    def _get_people_id(self, people):
+        """
+        Get the database identifier of the given identity, inserting
+        it when it is not stored yet.
+
+        Identifiers are kept in a LRU cache, so identities seen
+        recently do not need any query.
+
+        @param people: identity
+        @type people: L{People}
+
+        @return: identifier of the identity
+        @rtype: C{int}
+        """
+        people_id = self._people_cache.get(unicode(people.user_id))
+        if people_id is None:
+            people_id = self.insert_people(people).id
+        return people_id
+
     def insert_issue(self, issue, tracker_id):
         """
         Insert the given issue managed by the tracker with X{tracker_id}.
@@ -146,257 +444,841 @@ class DBDatabase:
         @return: the inserted issue
         @rtype: L{DBIssue}
         """
+        return self.insert_issues([issue], tracker_id)[0]
 
-        newIssue = False
+    def insert_issues(self, issues, tracker_id):
+        """
+        Insert the given issues managed by the tracker with X{tracker_id}.
 
-        try:
-            db_issue = self._get_db_issue(issue.issue, tracker_id)
+        Issues are stored one by one but their comments, attachments,
+        changes, temporal relationships and watchers are collected and
+        written together using multi-row INSERT statements. Issues
+        whose fingerprint matches the stored one are not written.
 
-            #if issue does not in the tracker, we create a new one
-            if db_issue == -1:
-                newIssue = True
-                db_issue = DBIssue(issue.issue, tracker_id)
+        @param issues: issues to insert
+        @type issues: C{list} of L{Issue}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
 
-            #update the data, or take the new one
-            db_issue.type = unicode(issue.type)
-            db_issue.summary = unicode(issue.summary)
-            db_issue.description = unicode(issue.description)
-            db_issue.status = unicode(issue.status)
-            db_issue.resolution = unicode(issue.resolution)
-            db_issue.priority = unicode(issue.priority)
-            db_issue.submitted_by = self.insert_people(issue.submitted_by).id
+        @return: the inserted issues
+        @rtype: C{list} of L{DBIssue}
+        """
+        with run_stats.phase('store'):
+            db_issues = self._insert_issues(issues, tracker_id)
+        run_stats.add_issues(len(db_issues))
+        return db_issues
 
+    def insert_changes(self, changes, issue_id, tracker_id):
+        """
+        Insert the given changes of the issue X{issue_id}, skipping
+        the ones already stored.
 
-            db_issue.submitted_on = issue.submitted_on
+        For the backends that get the changes apart from their
+        issues. Changes are written like the ones of the issues
+        stored by L{insert_issues}.
 
-            if issue.assigned_to is not None:
-                db_issue.assigned_to = self.insert_people(issue.assigned_to).id
-            else:
-                db_issue.assigned_to = 0
+        @param changes: changes to insert
+        @type changes: C{list} of L{Change}
+        @param issue_id: identifier of the issue in the database
+        @type issue_id: C{int}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        """
+        batches = self._create_child_batches()
+        stored = self._get_stored_fingerprints(DBChange, issue_id)
+        self._collect_changes(changes, issue_id, batches['changes'], stored)
+        self._write_child_batches(batches, tracker_id)
 
-            #if issue is new, we add to the data base before the flush()
-            if newIssue == True:
-                self.store.add(db_issue)
+    def _insert_issues(self, issues, tracker_id):
+        batched = self._is_commit_batched() and self.transactional
 
-            self.store.flush()
+        if batched:
+            self.store.execute('SAVEPOINT %s' % ISSUE_SAVEPOINT,
+                               noresult=True)
 
-            # Insert extra data of the issue, if any
-            if self.backend is not None:
-                self.backend.insert_issue_ext(self.store, issue, db_issue.id)
-
-            # Insert temporal relationships
-            for trel in issue.temp_relationships:
-                db_trel = self._get_db_temp_rel(trel, db_issue.id)
-                if db_trel == -1:
-                    db_trel = self._insert_temp_rel(trel, db_issue.id, tracker_id)
-                    if self.backend is not None:
-                        self.backend.insert_temp_rel(self.store, trel, db_trel, tracker_id)
-
-            # Insert comments
-            for comment in issue.comments:
-                db_comment = self._get_db_comment(comment, db_issue.id, tracker_id)
-                if db_comment == -1:
-                    db_comment = self._insert_comment(comment, db_issue.id, tracker_id)
-                    if self.backend is not None:
-                        self.backend.insert_comment_ext(self.store, comment, db_comment.id)
-
-            # Insert attachments
-            for attachment in issue.attachments:
-                db_attch = self._get_db_attachment(attachment, db_issue.id, tracker_id)
-                if db_attch == -1:
-                    db_attch = self._insert_attachment(attachment, db_issue.id, tracker_id)
-                    if self.backend is not None:
-                        self.backend.insert_attachment_ext(self.store, attachment, db_attch.id)
-
-            # Insert changes
-            for change in issue.changes:
-                db_change = self._get_db_change(change, db_issue.id, tracker_id)
-                if db_change == -1:
-                    db_change = self._insert_change(change, db_issue.id, tracker_id)
-                    if self.backend is not None:
-                        self.backend.insert_change_ext(self.store, change, db_change.id)
-
-            # Insert CC/watchers
-            # Remove old watchers
-            self._remove_issues_watchers(db_issue.id, tracker_id)
-
-            for person in issue.watchers:
-                try:
-                    #db_issues_watchers = self._insert_issues_watchers(person, db_issue.id,
-                    #                                                  tracker_id)
-                    self._insert_issues_watchers(person, db_issue.id, tracker_id)
-                except:
-                    None
-
-            self.store.commit()
-
-            return db_issue
+        try:
+            batches = self._create_child_batches()
+            db_issues = []
+            fingerprints = []
+
+            for issue in issues:
+                issue_fp = issue_fingerprint(issue)
+                db_issue = self._get_db_issue(issue.issue, tracker_id)
+
+                if db_issue != -1 and db_issue.fingerprint == issue_fp:
+                    # Nothing changed since the issue was stored
+                    printdbg("Issue %s not changed" % issue.issue)
+                    db_issues.append(db_issue)
+                    continue
+
+                db_issue, new_issue = self._insert_issue_data(issue,
+                                                              tracker_id,
+                                                              db_issue)
+                self._collect_issue_children(issue, db_issue.id, tracker_id,
+                                             batches, new_issue)
+                db_issues.append(db_issue)
+                fingerprints.append((db_issue, issue_fp))
+
+            self._write_child_batches(batches, tracker_id)
+
+            # Issues are only skipped on later runs once all their
+            # data is stored
+            for db_issue, issue_fp in fingerprints:
+                db_issue.fingerprint = issue_fp
+            self.store.flush()
         except:
-            self.store.rollback()
+            if batched:
+                self._rollback_to_savepoint()
+            else:
+                self.store.rollback()
+            # Identities inserted by the failed issues are gone
+            self._people_cache.clear()
             raise
 
-    def get_last_modification_date(self, state=None, tracker_id=None):
+        if batched:
+            self.store.execute('RELEASE SAVEPOINT %s' % ISSUE_SAVEPOINT,
+                               noresult=True)
+
+        self._pending_issues += len(db_issues)
+        self._update_watermark(issues, tracker_id)
+        if self._is_commit_due():
+            self.commit()
+
+        return db_issues
+
+    def commit(self):
         """
-        Return last modification date stored in database
+        Commit the issues stored since the last commit.
+
+        The sync state of the trackers is updated in the same
+        transaction.
         """
-        if self.backend is not None:
-            # in the github backend we need to get both open and closed
-            # issues in two different petitions
-            if state:
-                return self.backend.get_last_modification_date(self.store, state, tracker_id)
-            else:
-                return self.backend.get_last_modification_date(self.store, tracker_id)
+        self._store_watermarks()
+        self.store.commit()
+        self._pending_issues = 0
+        self._last_commit = time.time()
+        self._evict_store_objects()
 
-    def _insert_relationship(self, issue_id, type, rel_id):
+    def get_store_stats(self):
         """
-        Insert a relationship between the given issues.
+        Get the number of objects kept in memory by the store.
 
-        @param rel_id: related issued
-        @type rel_id: C{int}
-        @param type: type of the relationship
-        @type type: C{str}
-        @param issue_id: issue identifier
-        @type issue_id: C{int}
+        The stats are X{alive}, objects of the store still referenced,
+        X{cached}, objects kept by its cache, X{dirty}, objects pending
+        to be flushed, X{people}, identities kept by the people cache,
+        and X{resets}, times the store has been reset to release
+        memory.
 
-        @return: the inserted relationship
-        @rtype: L{DBIssueRelationship}
+        @return: the stats
+        @rtype: C{dict}
         """
-        db_rel = DBIssueRelationship(rel_id, type, issue_id)
-        self.store.add(db_rel)
-        self.store.flush()
-        return db_rel
+        return {'alive': len(self.store._alive),
+                'cached': len(self.store._cache.get_cached()),
+                'dirty': len(self.store._dirty),
+                'people': len(self._people_cache),
+                'resets': self._store_resets}
 
-    def _insert_temp_rel(self, relationship, issue_id, tracker_id):
+    def _evict_store_objects(self):
         """
-        Insert temporal relationships for the issue X{issue_id}
+        Reset the store when it keeps more objects alive than
+        X{store_cache_size}, the most its cache can hold.
 
-        @return: the inserted relationship
-        @rtype: L{DBComment}
+        Must be called right after a commit, when no object has
+        pending changes.
         """
-        db_temp_rel = DBIssueTempRelationship(relationship.issue,
-                                              relationship.type,
-                                              relationship.related_to,
-                                              tracker_id)
+        if len(self.store._alive) <= self.store_cache_size:
+            return
 
-        self.store.add(db_temp_rel)
-        self.store.flush()
-        return db_temp_rel
+        printdbg("Resetting store: %(alive)s objects alive, "
+                 "%(cached)s cached" % self.get_store_stats())
+        self.store.reset()
+        self._store_resets += 1
 
-    def store_final_relationships(self):
-        """
+    def get_sync_state(self, tracker_id):
         """
-        temp_rels = self.store.find(DBIssueTempRelationship)
+        Get the sync state of the tracker X{tracker_id} for the
+        current backend.
 
-        for tr in temp_rels:
-            aux_issue_id = self._get_db_issue(tr.issue_id, tr.tracker_id)
-            aux_related_to = self._get_db_issue(tr.related_to, tr.tracker_id)
-            if (aux_related_to != -1 and aux_issue_id != -1):
-                db_rel = self._get_db_rel(aux_issue_id.id, tr.type, aux_related_to.id)
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
 
-                if db_rel == -1:
-                    self._insert_relationship(aux_issue_id.id, tr.type, aux_related_to.id)
-            else:
-                printdbg("Issue %s belongs to a different tracker and won't be stored" % tr.related_to)
+        @return: the sync state; C{None} when the tracker has
+         not been synced yet
+        @rtype: L{DBTrackerSyncState}
+        """
+        return self.store.find(DBTrackerSyncState,
+                               DBTrackerSyncState.tracker_id == tracker_id,
+                               DBTrackerSyncState.backend == self._get_backend_name()).one()
 
-    def _insert_comment(self, comment, issue_id, tracker_id):
+    def _get_backend_name(self):
+        """
+        Return the name of the backend used on the sync state.
         """
-        Insert a comment for the issue X{issue_id}
+        return unicode(self.backend.__class__.__name__)
 
-        @param comment: comment to insert
-        @type comment: L{Comment}
-        @param issue_id: issue identifier
-        @type issue_id: C{int}
+    def _update_watermark(self, issues, tracker_id):
+        """
+        Update the pending watermark of the tracker with the last
+        modification dates of the given issues.
+
+        @param issues: stored issues
+        @type issues: C{list} of L{Issue}
         @param tracker_id: identifier of the tracker
         @type tracker_id: C{int}
+        """
+        if self.backend is None:
+            return
+
+        watermark = self._pending_watermarks.get(tracker_id)
+
+        for issue in issues:
+            mod_date = self.backend.get_issue_modification_date(issue)
+            if not isinstance(mod_date, datetime.datetime):
+                continue
+            # Dates are stored without time zone
+            mod_date = mod_date.replace(tzinfo=None)
+            if watermark is None or mod_date >= watermark[0]:
+                watermark = (mod_date, unicode(issue.issue))
+
+        if watermark is not None:
+            self._pending_watermarks[tracker_id] = watermark
+
+    def _store_watermarks(self):
+        """
+        Save the pending watermarks on the sync state of each tracker.
+        """
+        for tracker_id, (mod_date, issue) in self._pending_watermarks.items():
+            sync_state = self.get_sync_state(tracker_id)
+            if sync_state is None:
+                sync_state = DBTrackerSyncState(tracker_id,
+                                                self._get_backend_name())
+                self.store.add(sync_state)
+
+            if sync_state.last_modification is None or \
+                    mod_date >= sync_state.last_modification:
+                sync_state.last_modification = mod_date
+                sync_state.last_issue = issue
+            sync_state.updated_on = datetime.datetime.now()
+        self._pending_watermarks = {}
+
+    def close(self):
+        """
+        Commit the pending issues and close the connection to the
+        database.
+        """
+        if self.store is None:
+            return
+        self.commit()
+        printdbg("Store stats: %(alive)s objects alive, %(cached)s cached, "
+                 "%(people)s identities, %(resets)s resets"
+                 % self.get_store_stats())
+        self.store.close()
+        self.store = None
 
-        @return: the inserted comment
-        @rtype: L{DBComment}
+    def _is_commit_batched(self):
         """
-        submitted_by = self.insert_people(comment.submitted_by)
+        Return whether several issues may be stored on each commit.
+        """
+        return self.commit_every != 1 or self.commit_interval is not None
 
-        db_comment = DBComment(comment.comment, submitted_by.id,
-                               comment.submitted_on, issue_id)
-        self.store.add(db_comment)
+    def _is_commit_due(self):
+        """
+        Return whether the pending issues have to be committed,
+        according to the commit policy.
+        """
+        if self.commit_every and self._pending_issues >= self.commit_every:
+            return True
+        if self.commit_interval is not None and \
+                time.time() - self._last_commit >= self.commit_interval:
+            return True
+        return False
+
+    def _rollback_to_savepoint(self):
+        """
+        Discard the changes made since the savepoint of the current
+        issue, keeping the issues stored before it.
+        """
+        # Pending changes belong to the failed issue, don't flush them
+        self.store.block_implicit_flushes()
         try:
-            self.store.flush()
-        except UnicodeEncodeError:
-            print("UnicodeEncodeError: one of the comments of the issue_id " + \
-                  "%s couldn't be stored" % (issue_id))
-        return db_comment
+            self.store.execute('ROLLBACK TO SAVEPOINT %s' % ISSUE_SAVEPOINT,
+                               noresult=True)
+        finally:
+            self.store.unblock_implicit_flushes()
+
+        # Objects in memory may hold values that were rolled back
+        self.store.reset()
 
-    def _insert_attachment(self, attachment, issue_id, tracker_id):
+    def _commit_on_exit(self):
         """
-        Insert an attachment for the issue X{issue_id}
+        Commit pending changes before the program exits.
+        """
+        if self.store is None:
+            return
+        try:
+            self.commit()
+        except Exception, e:
+            printerr("Error committing pending issues: %s" % str(e))
 
-        @param attachment: attachment to insert
-        @type attachment: L{Attachment}
-        @param issue_id: issue identifier
-        @type issue_id: C{int}
+    def _insert_issue_data(self, issue, tracker_id, db_issue):
+        """
+        Insert or update the row of the given issue and its extra data.
+
+        @param issue: issue to insert
+        @type issue: L{Issue}
         @param tracker_id: identifier of the tracker
         @type tracker_id: C{int}
+        @param db_issue: stored issue; -1 when it's a new one
+        @type db_issue: L{DBIssue}
 
-        @return: the inserted attachment
-        @rtype: L{DBAttachment}
+        @return: the inserted issue and whether it was a new one
+        @rtype: C{tuple} of (L{DBIssue}, C{bool})
         """
-        if attachment.submitted_by is not None:
-            submitter = self.insert_people(attachment.submitted_by)
-            submitted_by = submitter.id
+        newIssue = False
+
+        #if issue does not in the tracker, we create a new one
+        if db_issue == -1:
+            newIssue = True
+            db_issue = DBIssue(issue.issue, tracker_id)
+
+        #update the data, or take the new one
+        db_issue.type = unicode(issue.type)
+        db_issue.summary = unicode(issue.summary)
+        db_issue.description = unicode(issue.description)
+        db_issue.status = unicode(issue.status)
+        db_issue.resolution = unicode(issue.resolution)
+        db_issue.priority = unicode(issue.priority)
+        db_issue.submitted_by = self._get_people_id(issue.submitted_by)
+
+        db_issue.submitted_on = issue.submitted_on
+
+        if issue.assigned_to is not None:
+            db_issue.assigned_to = self._get_people_id(issue.assigned_to)
         else:
-            submitted_by = None
+            db_issue.assigned_to = self.unassigned_id
+
+        #if issue is new, we add to the data base before the flush()
+        if newIssue == True:
+            self.store.add(db_issue)
 
-        db_attachment = DBAttachment(attachment.name, attachment.description,
-                                     attachment.url, submitted_by,
-                                     attachment.submitted_on, issue_id)
-        self.store.add(db_attachment)
         self.store.flush()
-        return db_attachment
 
-    def _insert_change(self, change, issue_id, tracker_id):
+        # Insert extra data of the issue, if any
+        if self.backend is not None:
+            self.backend.insert_issue_ext(self.store, issue, db_issue.id)
+
+        return db_issue, newIssue
+
+    def _create_child_batches(self):
+        """
+        Create the batches where the child rows of the issues are
+        collected before writing them.
+
+        @return: batches of rows indexed by the kind of child
+        @rtype: C{dict} of L{DBRowsBatch}
+        """
+        return {
+            'temp_rels': DBRowsBatch(DBIssueTempRelationship.__storm_table__,
+                                     ['issue_id', 'type', 'related_to',
+                                      'tracker_id']),
+            'comments': DBRowsBatch(DBComment.__storm_table__,
+                                    ['text', 'submitted_by', 'submitted_on',
+                                     'issue_id', 'fingerprint'],
+                                    skip_unencodable=True,
+                                    key_column='fingerprint'),
+            'attachments': DBRowsBatch(DBAttachment.__storm_table__,
+                                       ['name', 'description', 'url',
+                                        'submitted_by', 'submitted_on',
+                                        'issue_id', 'fingerprint'],
+                                       key_column='fingerprint'),
+            'changes': DBRowsBatch(DBChange.__storm_table__,
+                                   ['field', 'old_value', 'new_value',
+                                    'changed_by', 'changed_on', 'issue_id',
+                                    'fingerprint'],
+                                   key_column='fingerprint'),
+            'watchers': DBRowsBatch(DBIssuesWatchers.__storm_table__,
+                                    ['issue_id', 'person_id']),
+        }
+
+    def _collect_issue_children(self, issue, issue_id, tracker_id, batches,
+                                new_issue=False):
+        """
+        Add the child rows of the issue X{issue_id} that are not
+        stored yet to the given batches.
+
+        The keys of the stored children are loaded once per issue, so
+        deciding whether a child is new does not need any other query.
+
+        @param issue: issue whose children will be collected
+        @type issue: L{Issue}
+        @param issue_id: identifier of the issue in the database
+        @type issue_id: C{int}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        @param batches: batches where the rows are added
+        @type batches: C{dict} of L{DBRowsBatch}
+        @param new_issue: whether the issue was inserted right now,
+         so it cannot have stored children
+        @type new_issue: C{bool}
+        """
+        if new_issue:
+            stored = {'temp_rels': set(), 'comments': set(),
+                      'attachments': set(), 'changes': set(),
+                      'watchers': {}}
+        else:
+            stored = self._get_stored_children_keys(issue, issue_id,
+                                                    tracker_id)
+
+        # Temporal relationships
+        for trel in issue.temp_relationships:
+            row = (trel.issue, unicode(trel.type), trel.related_to,
+                   tracker_id)
+            key = fingerprint(*row)
+            if key not in stored['temp_rels']:
+                batches['temp_rels'].add(row, trel, key=key)
+
+        # Comments
+        for comment in issue.comments:
+            text = unicode(comment.comment)
+            submitted_by = self._get_people_id(comment.submitted_by)
+            key = comment_fingerprint(issue_id, submitted_by,
+                                      comment.submitted_on, text)
+            if key in stored['comments']:
+                continue
+            row = (text, submitted_by, comment.submitted_on, issue_id, key)
+            batches['comments'].add(row, comment, key=key)
+
+        # Attachments
+        for attachment in issue.attachments:
+            url = unicode(attachment.url)
+            if attachment.submitted_by is not None:
+                submitted_by = self._get_people_id(attachment.submitted_by)
+            else:
+                submitted_by = None
+            key = attachment_fingerprint(issue_id, submitted_by,
+                                         attachment.submitted_on, url)
+            if key in stored['attachments']:
+                continue
+            row = (unicode(attachment.name), unicode(attachment.description),
+                   url, submitted_by, attachment.submitted_on, issue_id, key)
+            batches['attachments'].add(row, attachment, key=key)
+
+        # Changes
+        self._collect_changes(issue.changes, issue_id, batches['changes'],
+                              stored['changes'])
+
+        # CC/watchers
+        # Only the watchers added or removed since the last time
+        # are written
+        watchers = set()
+        for person in issue.watchers:
+            person_id = self._get_people_id(person)
+            watchers.add(person_id)
+            if person_id in stored['watchers']:
+                continue
+            row = (issue_id, person_id)
+            batches['watchers'].add(row, person, key=row)
+
+        removed = [row_id for person_id, row_id in stored['watchers'].items()
+                   if person_id not in watchers]
+        if removed:
+            self.store.find(DBIssuesWatchers,
+                            DBIssuesWatchers.id.is_in(removed)).remove()
+
+    def _collect_changes(self, changes, issue_id, batch, stored):
+        """
+        Add the rows of the given changes of the issue X{issue_id}
+        that are not stored yet to X{batch}.
+
+        @param changes: changes to collect
+        @type changes: C{list} of L{Change}
+        @param issue_id: identifier of the issue in the database
+        @type issue_id: C{int}
+        @param batch: batch where the rows are added
+        @type batch: L{DBRowsBatch}
+        @param stored: fingerprints of the stored changes
+        @type stored: C{set} of C{unicode}
+        """
+        for change in changes:
+            field = unicode(change.field)
+            old_value = unicode(change.old_value)
+            new_value = unicode(change.new_value)
+            changed_by = self._get_people_id(change.changed_by)
+            key = change_fingerprint(issue_id, changed_by, change.changed_on,
+                                     field, old_value, new_value)
+            if key in stored:
+                continue
+            row = (field, old_value, new_value, changed_by,
+                   change.changed_on, issue_id, key)
+            batch.add(row, change, key=key)
+
+    def _get_stored_children_keys(self, issue, issue_id, tracker_id):
         """
-        Insert a change for the issue X{issue_id}
+        Get the fingerprints of the children of the issue X{issue_id}
+        already stored in the database, running one query per table.
+        Watchers are returned as a dict of their people identifiers
+        and the identifiers of their rows.
 
-        @param change: change to insert
-        @type change: L{Change}
-        @param issue_id: issue identifier
+        @param issue: issue whose children will be inserted
+        @type issue: L{Issue}
+        @param issue_id: identifier of the issue in the database
         @type issue_id: C{int}
         @param tracker_id: identifier of the tracker
         @type tracker_id: C{int}
 
-        @return: the inserted change
-        @rtype: L{DBChange}
+        @return: fingerprints indexed by the kind of child
+        @rtype: C{dict} of C{set}
+        """
+        stored = {'temp_rels': set(), 'comments': set(),
+                  'attachments': set(), 'changes': set(),
+                  'watchers': {}}
+
+        if issue.temp_relationships:
+            issues = set([trel.issue for trel in issue.temp_relationships])
+            result = self.store.find((DBIssueTempRelationship.issue_id,
+                                      DBIssueTempRelationship.type,
+                                      DBIssueTempRelationship.related_to),
+                                     DBIssueTempRelationship.issue_id.is_in(issues),
+                                     DBIssueTempRelationship.tracker_id == tracker_id)
+            for trel_issue, type, related_to in result:
+                stored['temp_rels'].add(fingerprint(trel_issue, type,
+                                                    related_to, tracker_id))
+
+        if issue.comments:
+            stored['comments'] = self._get_stored_fingerprints(DBComment,
+                                                               issue_id)
+        if issue.attachments:
+            stored['attachments'] = self._get_stored_fingerprints(DBAttachment,
+                                                                  issue_id)
+        if issue.changes:
+            stored['changes'] = self._get_stored_fingerprints(DBChange,
+                                                              issue_id)
+
+        # Watchers are always loaded, to remove them when the issue
+        # has none
+        result = self.store.find((DBIssuesWatchers.person_id,
+                                  DBIssuesWatchers.id),
+                                 DBIssuesWatchers.issue_id == issue_id)
+        stored['watchers'] = dict(result)
+        return stored
+
+    def _get_stored_fingerprints(self, cls, issue_id):
         """
-        changed_by = self.insert_people(change.changed_by)
+        Get the fingerprints of the rows of X{cls} that belong to the
+        issue X{issue_id}.
 
-        db_change = DBChange(change.field, change.old_value, change.new_value,
-                             changed_by.id, change.changed_on, issue_id)
-        self.store.add(db_change)
-        self.store.flush()
-        return db_change
+        Rows stored before fingerprints existed get theirs computed
+        and saved here. Duplicated rows among them are left without
+        fingerprint, so the unique index is not violated.
+
+        @param cls: database class of the child
+        @type cls: L{DBComment}, L{DBAttachment} or L{DBChange}
+        @param issue_id: identifier of the issue in the database
+        @type issue_id: C{int}
+
+        @return: fingerprints of the stored rows
+        @rtype: C{set} of C{unicode}
+        """
+        fingerprints = set()
+        legacy = []
+
+        result = self.store.find((cls.id, cls.fingerprint),
+                                 cls.issue_id == issue_id)
+        for row_id, fp in result:
+            if fp is None:
+                legacy.append(row_id)
+            else:
+                fingerprints.add(fp)
+
+        if legacy:
+            for db_obj in self.store.find(cls, cls.id.is_in(legacy)):
+                fp = db_obj.get_fingerprint()
+                if fp not in fingerprints:
+                    db_obj.fingerprint = fp
+                    fingerprints.add(fp)
+            self.store.flush()
+        return fingerprints
 
-    def _insert_issues_watchers(self, people, issue_id, tracker_id):
+    def _write_child_batches(self, batches, tracker_id):
         """
-        Insert watchers for the issue X{issue_id}
+        Write the collected child rows and insert their extra data.
 
-        @return: the inserted watcher
-        @rtype: L{DBIssuesWatchers}
+        @param batches: batches of rows to write
+        @type batches: C{dict} of L{DBRowsBatch}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        """
+        for kind in ('temp_rels', 'comments', 'attachments', 'changes',
+                     'watchers'):
+            batch = batches[kind]
+            ids = self._write_rows(batch)
+
+            if self.backend is None or kind == 'watchers':
+                continue
+
+            for obj, row_id in zip(batch.objs, ids):
+                if row_id is None:
+                    continue
+                if kind == 'temp_rels':
+                    self.backend.insert_temp_rel(self.store, obj, row_id,
+                                                 tracker_id)
+                elif kind == 'comments':
+                    self.backend.insert_comment_ext(self.store, obj, row_id)
+                elif kind == 'attachments':
+                    self.backend.insert_attachment_ext(self.store, obj, row_id)
+                elif kind == 'changes':
+                    self.backend.insert_change_ext(self.store, obj, row_id)
+
+    def _write_rows(self, batch):
         """
-        watcher = self.insert_people(people)
+        Write the rows of the given batch.
 
-        db_issues_watchers = DBIssuesWatchers(issue_id, watcher.id)
+        When the batch allows it, rows that can not be encoded by the
+        database driver are skipped instead of aborting the whole batch.
 
-        self.store.add(db_issues_watchers)
-        self.store.flush()
-        return db_issues_watchers
+        @param batch: batch of rows to write
+        @type batch: L{DBRowsBatch}
+
+        @return: identifiers of the written rows, in the same order;
+         C{None} for the skipped ones
+        @rtype: C{list} of C{int}
+        """
+        if not batch.rows:
+            return []
+
+        try:
+            return self._insert_rows(batch.table, batch.columns, batch.rows,
+                                     batch.key_column)
+        except UnicodeEncodeError:
+            if not batch.skip_unencodable:
+                raise
+
+        # Fall back to one row per statement to find the wrong rows
+        ids = []
+        for row in batch.rows:
+            try:
+                ids.extend(self._insert_rows(batch.table, batch.columns, [row],
+                                             batch.key_column))
+            except UnicodeEncodeError:
+                printerr("UnicodeEncodeError: one of the rows of table %s "
+                         "couldn't be stored" % batch.table)
+                ids.append(None)
+        return ids
+
+    def _insert_rows(self, table, columns, rows, key_column=None):
+        """
+        Insert the given rows into X{table}.
+
+        Adapters with X{multi_row_insert} write the rows using
+        multi-row INSERT statements; the rest, one by one.
+
+        When X{key_column} is given, it must have a unique index and
+        rows whose key is already stored are ignored by the database.
+        Ignored rows get C{None} as identifier, so the extra data of
+        the backend is only inserted for the new rows.
+
+        @param table: name of the table
+        @type table: C{str}
+        @param columns: names of the columns set on each row
+        @type columns: C{list} of C{str}
+        @param rows: values of each row, sorted as X{columns}
+        @type rows: C{list} of C{tuple}
+        @param key_column: name of the unique column of the rows
+        @type key_column: C{str}
+
+        @return: identifiers of the inserted rows, in the same order;
+         C{None} for the ignored ones
+        @rtype: C{list} of C{int}
+        """
+        if not self.multi_row_insert:
+            return [self._insert_row(table, columns, row, key_column)
+                    for row in rows]
+
+        ids = []
+        ignore_duplicates = key_column is not None
+
+        for chunk in self._split_rows(rows):
+            stmt = self._get_insert_statement(table, columns, len(chunk),
+                                              ignore_duplicates)
+            params = [value for row in chunk for value in row]
+            ninserted = self.store.execute(stmt, params).rowcount
+
+            if ninserted == len(chunk):
+                first_id = self._get_first_insert_id(len(chunk))
+                ids.extend(range(first_id, first_id + len(chunk)))
+            elif ninserted == 0:
+                ids.extend([None] * len(chunk))
+            else:
+                # Rows inserted by the statement get greater
+                # identifiers than the ones already stored
+                first_id = self._get_first_insert_id(ninserted)
+                pos = columns.index(key_column)
+                stored_ids = self._get_ids_by_key(table, key_column,
+                                                  [row[pos] for row in chunk])
+                ids.extend([row_id if row_id is not None and
+                            row_id >= first_id else None
+                            for row_id in stored_ids])
+        return ids
+
+    def _insert_row(self, table, columns, row, key_column=None):
+        """
+        Insert a row into X{table} with its own INSERT statement.
 
-    def _remove_issues_watchers(self, issue_id, tracker_id):
+        @return: identifier of the inserted row; C{None} when its
+         key is already stored
+        @rtype: C{int}
         """
-        Remove watchers from the issue X{issue_id}
+        if key_column is not None:
+            key = row[columns.index(key_column)]
+            if self._get_ids_by_key(table, key_column, [key])[0] is not None:
+                return None
+
+        stmt = self._get_insert_statement(table, columns, 1)
+        self.store.execute(stmt, list(row), noresult=True)
+        return self._get_first_insert_id(1)
+
+    def _get_first_insert_id(self, nrows):
         """
-        result = self._get_db_watchers(issue_id, tracker_id)
+        Get the identifier of the first row written by the last
+        INSERT statement.
 
-        for r in result:
-            self.store.remove(r)
-        self.store.flush()
+        @param nrows: number of rows written by the statement
+        @type nrows: C{int}
+
+        @rtype: C{int}
+        """
+        raise NotImplementedError
+
+    def _get_insert_statement(self, table, columns, nrows,
+                              ignore_duplicates=False):
+        """
+        Build a multi-row INSERT statement.
+
+        Adapters able to ignore rows that violate a unique index
+        must override this method to do it when X{ignore_duplicates}
+        is set.
+
+        @param table: name of the table
+        @type table: C{str}
+        @param columns: names of the columns set on each row
+        @type columns: C{list} of C{str}
+        @param nrows: number of rows
+        @type nrows: C{int}
+        @param ignore_duplicates: ignore rows with duplicated keys
+        @type ignore_duplicates: C{bool}
+
+        @return: the statement, with '?' as parameter marks
+        @rtype: C{str}
+        """
+        row_marks = '(' + ', '.join(['?'] * len(columns)) + ')'
+        return 'INSERT INTO %s (%s) VALUES %s' % \
+            (table, ', '.join(columns), ', '.join([row_marks] * nrows))
+
+    def _get_ids_by_key(self, table, key_column, keys):
+        """
+        Get the identifiers of the rows of X{table} with the given keys.
+
+        @return: identifiers sorted as X{keys}
+        @rtype: C{list} of C{int}
+        """
+        stmt = 'SELECT id, %s FROM %s WHERE %s IN (%s)' % \
+            (key_column, table, key_column, ', '.join(['?'] * len(keys)))
+        result = self.store.execute(stmt, keys)
+        stored = dict([(key, row_id) for row_id, key in result])
+        return [stored.get(key) for key in keys]
+
+    def _split_rows(self, rows):
+        """
+        Split the given rows in chunks that fit in a single statement.
+
+        @param rows: rows to split
+        @type rows: C{list} of C{tuple}
+
+        @return: chunks of rows
+        @rtype: generator of C{list} of C{tuple}
+        """
+        max_rows = MAX_ROWS_PER_INSERT
+        if self.max_insert_params and rows:
+            max_rows = min(max_rows,
+                           max(self.max_insert_params / len(rows[0]), 1))
+
+        chunk = []
+        size = 0
+        for row in rows:
+            row_size = sum([len(v) for v in row if isinstance(v, basestring)])
+            if chunk and (len(chunk) >= max_rows or
+                          size + row_size > MAX_BYTES_PER_INSERT):
+                yield chunk
+                chunk = []
+                size = 0
+            chunk.append(row)
+            size += row_size
+        if chunk:
+            yield chunk
+
+    def get_last_modification_date(self, state=None, tracker_id=None):
+        """
+        Return last modification date stored in database
+
+        Pending issues are committed first, so the date never refers
+        to data that could still be rolled back. The date is read from
+        the sync state of the tracker. Trackers synced by older versions
+        don't have it, so the backend looks for the date on its tables.
+        """
+        self.commit()
+
+        if self.backend is not None:
+            # in the github backend we need to get both open and closed
+            # issues in two different petitions
+            if state:
+                return self.backend.get_last_modification_date(self.store, state, tracker_id)
+
+            if tracker_id is not None:
+                sync_state = self.get_sync_state(tracker_id)
+                if sync_state is not None and \
+                        sync_state.last_modification is not None:
+                    return self.backend.format_last_modification_date(sync_state.last_modification)
+
+            return self.backend.get_last_modification_date(self.store, tracker_id)
+
+    def store_final_relationships(self, tracker_id=None):
+        """
+        Store the relationships among issues saved on the temporal
+        table.
+
+        Both ends of the relationships are resolved in the database
+        with a single INSERT ... SELECT, which also skips the stored
+        relationships. Issues that belong to a different tracker
+        can't be resolved and are not stored. Both ends are cast
+        with X{text_cast}, so they compare with the identifiers of
+        the issues whatever the collation of the temporal table.
+
+        @param tracker_id: only store the relationships of this
+         tracker; all of them when it is C{None}
+        @type tracker_id: C{int}
+        """
+        stmt = 'INSERT INTO related_to (issue_id, related_to, type) \
+                SELECT DISTINCT i1.id, i2.id, t.type \
+                FROM temp_related_to t \
+                JOIN issues i1 ON i1.issue = %s \
+                  AND i1.tracker_id = t.tracker_id \
+                JOIN issues i2 ON i2.issue = %s \
+                  AND i2.tracker_id = t.tracker_id \
+                WHERE NOT EXISTS (SELECT 1 FROM related_to r \
+                                  WHERE r.issue_id = i1.id \
+                                    AND r.related_to = i2.id \
+                                    AND r.type = t.type)' \
+            % (self.text_cast % 't.issue_id', self.text_cast % 't.related_to')
+        params = []
+
+        if tracker_id is not None:
+            stmt += ' AND t.tracker_id = ?'
+            params.append(tracker_id)
+
+        result = self.store.execute(stmt, params)
+        printdbg("%s relationships stored" % result.rowcount)
+
+        self.commit()
 
     def _get_db_supported_tracker(self, name, version):
         """
@@ -485,120 +1367,61 @@ class DBDatabase:
 
         return db_issue
 
-    def _get_db_comment(self,comment, issue_id, tracker_id):
-        """
-        Search a comment for the issue X{issue_id}
-
-        @param comment: comment to insert
-        @type comment: L{Comment}
-        @param issue_id: issue identifier
-        @type issue_id: C{int}
-        @param tracker_id: identifier of the tracker
-        @type tracker_id: C{int}
-
-        """
-        db_comment = self.store.find(DBComment,
-                                     DBComment.issue_id == issue_id,
-                                     DBComment.text == unicode(comment.comment),
-                                     DBComment.submitted_on == comment.submitted_on).one()
-
-        if not db_comment:
-            #if comment is not stored, return -1 to know it's a new one
-            db_comment = -1
-
-        return db_comment
 
-    def _get_db_change(self,change, issue_id, tracker_id):
-        """
-        Search a change for the issue X{issue_id}
-
-        @param change: change to insert
-        @type change: L{Change}
-        @param issue_id: issue identifier
-        @type issue_id: C{int}
-        @param tracker_id: identifier of the tracker
-        @type tracker_id: C{int}
-
-        """
-        #source forge don't have new_value so we recived
-        #a string that must be unicode
-        if change.new_value == "unknown":
-            change.new_value = unicode(change.new_value)
-
-        db_change = self.store.find(DBChange,
-                                    DBChange.issue_id == issue_id,
-                                    DBChange.field == change.field,
-                                    DBChange.changed_on == change.changed_on,
-                                    DBChange.old_value == change.old_value,
-                                    DBChange.new_value == change.new_value).one()
-        if not db_change:
-            #if change is not stored, return -1 to know it's a new one
-            db_change = -1
-
-        return db_change
-
-    def _get_db_attachment(self, attachment, issue_id, tracker_id):
-        """
-        Search an attachment for the issue X{issue_id}
-
-        @param attachment: attachment to insert
-        @type attachment: L{Attachment}
-        @param issue_id: issue identifier
-        @type issue_id: C{int}
-        @param tracker_id: identifier of the tracker
-        @type tracker_id: C{int}
-
-        """
-        db_attachment = self.store.find(DBAttachment,
-                                    DBAttachment.issue_id == issue_id,
-                                    DBAttachment.url == attachment.url,
-                                    DBAttachment.submitted_on == attachment.submitted_on).one()
-        if not db_attachment:
-            #if attachment is not stored, return -1 to know it's a new one
-            db_attachment = -1
-
-        return db_attachment
-
-    def _get_db_watchers(self, issue_id, tracker_id):
-        """
-        Look for the watchers of the issue X{issue_id}
-
-        @param issue_id: issue identifier
-        @type issue_id: C{int}
-        @param tracker_id: identifier of the tracker
-        @type tracker_id: C{int}
-        """
-        db_watchers = self.store.find(DBIssuesWatchers,
-                                      DBIssuesWatchers.issue_id == issue_id)
-        return db_watchers
-
-    def _get_db_temp_rel(self, t_relationship, issue_id):
-        """
+class DBRowsBatch(object):
+    """
+    Rows of a table pending to be written.
+
+    @param table: name of the table
+    @type table: C{str}
+    @param columns: names of the columns set on each row
+    @type columns: C{list} of C{str}
+    @param skip_unencodable: skip the rows that can not be encoded
+     instead of failing
+    @type skip_unencodable: C{bool}
+    @param key_column: name of the column with a unique index used
+     to ignore rows already stored
+    @type key_column: C{str}
+
+    @ivar rows: values of each row, sorted as X{columns}
+    @type rows: C{list} of C{tuple}
+    @ivar objs: objects the rows were built from
+    @type objs: C{list}
+    """
+    def __init__(self, table, columns, skip_unencodable=False,
+                 key_column=None):
+        self.table = table
+        self.columns = columns
+        self.skip_unencodable = skip_unencodable
+        self.key_column = key_column
+        self.rows = []
+        self.objs = []
+        self._keys = set()
+
+    def add(self, row, obj=None, key=None):
         """
-        #DBIssueTempRelationship
-        db_temp_rel = self.store.find(DBIssueTempRelationship,
-                                      DBIssueTempRelationship.issue_id == issue_id,
-                                      DBIssueTempRelationship.type == t_relationship.type,
-                                      DBIssueTempRelationship.related_to == t_relationship.related_to).one()
-
-        if not db_temp_rel:
-            db_temp_rel = -1
+        Add a row to the batch.
 
-        return db_temp_rel
+        @param row: values of the row
+        @type row: C{tuple}
+        @param obj: object the row was built from
+        @param key: when given, rows with a key already in the
+         batch are discarded
+        @type key: C{tuple}
 
-    def _get_db_rel(self, issue_id, type, related_to):
+        @return: whether the row was added
+        @rtype: C{bool}
         """
-        """
-        #DBIssueRelationship
-        db_rel = self.store.find(DBIssueRelationship,
-                                 DBIssueRelationship.issue_id == issue_id,
-                                 DBIssueRelationship.type == type,
-                                 DBIssueRelationship.related_to == related_to).one()
-
-        if not db_rel:
-            db_rel = -1
+        if key is not None:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+        self.rows.append(row)
+        self.objs.append(obj)
+        return True
 
-        return db_rel
+    def __len__(self):
+        return len(self.rows)
 
 
 class DBSupportedTracker(object):
@@ -669,6 +1492,47 @@ class DBTracker(object):
         self.retrieved_on = datetime.datetime.now()
 
 
+class DBTrackerSyncState(object):
+    """
+    Maps elements from X{tracker_sync_state} table.
+
+    @param tracker_id: identifier of the tracker
+    @type tracker_id: C{int}
+    @param backend: name of the backend
+    @type backend: C{str}
+
+    @ivar __storm_table__: Name of the database table.
+    @type __storm_table__: C{str}
+
+    @ivar id: Sync state identifier.
+    @type id: L{storm.locals.Int}
+    @ivar tracker_id: Tracker identifier.
+    @type tracker_id: L{storm.locals.Int}
+    @ivar backend: Name of the backend.
+    @type backend: L{storm.locals.Unicode}
+    @ivar last_modification: Last modification date of the stored
+     issues (watermark).
+    @type last_modification: L{storm.locals.DateTime}
+    @ivar last_issue: Identifier of the issue modified on
+     X{last_modification} (cursor).
+    @type last_issue: L{storm.locals.Unicode}
+    @ivar updated_on: Date when the state was updated.
+    @type updated_on: L{storm.locals.DateTime}
+    """
+    __storm_table__ = 'tracker_sync_state'
+
+    id = Int(primary=True)
+    tracker_id = Int()
+    backend = Unicode()
+    last_modification = DateTime()
+    last_issue = Unicode()
+    updated_on = DateTime()
+
+    def __init__(self, tracker_id, backend):
+        self.tracker_id = tracker_id
+        self.backend = unicode(backend)
+
+
 class DBPeople(object):
     """
     Maps elements form X{people} table.
@@ -759,6 +1623,8 @@ class DBIssue(object):
     @type assigned_to: L{storm.locals.Int}
     @ivar tracker_id: Tracker identifier.
     @type tracker_id: L{storm.locals.Int}
+    @ivar fingerprint: Hash of the content of the issue.
+    @type fingerprint: L{storm.locals.Unicode}
     @ivar tracker: Reference to L{DBTracker} object.
     @type tracker: L{storm.locals.Reference}
     @ivar submitted: Reference to L{DBPeople} object.
@@ -780,6 +1646,7 @@ class DBIssue(object):
     submitted_on = DateTime()
     assigned_to = Int()
     tracker_id = Int()
+    fingerprint = Unicode()
 
     tracker = Reference(tracker_id, DBTracker.id)
     submitted = Reference(submitted_by, DBPeople.id)
@@ -926,6 +1793,8 @@ class DBComment(object):
     @type submitted: L{storm.locals.Reference}
     @ivar issue_id: Issue identifier.
     @type issue_id: L{storm.locals.Int}
+    @ivar fingerprint: Hash that identifies the comment.
+    @type fingerprint: L{storm.locals.Unicode}
     """
     __storm_table__ = 'comments'
 
@@ -934,6 +1803,7 @@ class DBComment(object):
     submitted_by = Int()
     submitted_on = DateTime()
     issue_id = Int()
+    fingerprint = Unicode()
 
     issue = Reference(issue_id, DBIssue.id)
     submitted = Reference(submitted_by, DBPeople.id)
@@ -943,6 +1813,14 @@ class DBComment(object):
         self.submitted_by = submitted_by
         self.submitted_on = submitted_on
         self.issue_id = issue_id
+        self.fingerprint = self.get_fingerprint()
+
+    def get_fingerprint(self):
+        """
+        Compute the fingerprint of the comment from its values.
+        """
+        return comment_fingerprint(self.issue_id, self.submitted_by,
+                                   self.submitted_on, self.text)
 
 
 class DBAttachment(object):
@@ -980,6 +1858,8 @@ class DBAttachment(object):
     @type issue: L{storm.locals.Reference}
     @ivar submitted: Reference to L{DBPeople} object.
     @type submitted: L{storm.locals.Reference}
+    @ivar fingerprint: Hash that identifies the attachment.
+    @type fingerprint: L{storm.locals.Unicode}
     """
     __storm_table__ = 'attachments'
 
@@ -990,6 +1870,7 @@ class DBAttachment(object):
     submitted_by = Int()
     submitted_on = DateTime()
     issue_id = Int()
+    fingerprint = Unicode()
 
     issue = Reference(issue_id, DBIssue.id)
     submitted = Reference(submitted_by, DBPeople.id)
@@ -1001,6 +1882,14 @@ class DBAttachment(object):
         self.submitted_by = submitted_by
         self.submitted_on = submitted_on
         self.issue_id = issue_id
+        self.fingerprint = self.get_fingerprint()
+
+    def get_fingerprint(self):
+        """
+        Compute the fingerprint of the attachment from its values.
+        """
+        return attachment_fingerprint(self.issue_id, self.submitted_by,
+                                      self.submitted_on, self.url)
 
 
 class DBChange(object):
@@ -1041,6 +1930,8 @@ class DBChange(object):
     @type issue: L{storm.locals.Reference}
     @ivar people: Reference to L{DBPeople} object.
     @type people: L{storm.locals.Reference}
+    @ivar fingerprint: Hash that identifies the change.
+    @type fingerprint: L{storm.locals.Unicode}
     """
     __storm_table__ = 'changes'
 
@@ -1051,6 +1942,7 @@ class DBChange(object):
     changed_by = Int()
     changed_on = DateTime()
     issue_id = Int()
+    fingerprint = Unicode()
 
     issue = Reference(issue_id, DBIssue.id)
     people = Reference(changed_by, DBPeople.id)
@@ -1062,11 +1954,25 @@ class DBChange(object):
         self.changed_by = changed_by
         self.changed_on = changed_on
         self.issue_id = issue_id
+        self.fingerprint = self.get_fingerprint()
+
+    def get_fingerprint(self):
+        """
+        Compute the fingerprint of the change from its values.
+        """
+        return change_fingerprint(self.issue_id, self.changed_by,
+                                  self.changed_on, self.field,
+                                  self.old_value, self.new_value)
 
 
 class DBBackend:
     """
     """
+    # Whether the backend uses the store of the database out of its
+    # hooks. The store can't be shared with a storage thread, so the
+    # issues of these backends are stored while fetching.
+    uses_store = False
+
     def __init__(self):
         self.MYSQL_EXT = None
 
@@ -1100,6 +2006,26 @@ class DBBackend:
         """
         raise NotImplementedError
 
+    def get_issue_modification_date(self, issue):
+        """
+        Return the last modification date of the given issue, which
+        is kept as the sync watermark of the tracker.
+
+        Backends that don't know it return C{None}.
+        """
+        return None
+
+    def format_last_modification_date(self, date):
+        """
+        Format the sync watermark of the tracker as returned by
+        L{get_last_modification_date}.
+        """
+        return date
+
+
+# Databases opened during the run, closed by close_databases
+_databases = []
+
 
 def get_database(backend=None):
     """
@@ -1108,6 +2034,70 @@ def get_database(backend=None):
     if not vars(Config).has_key('url'):
         opts = Config()
 
-    if opts.db_driver_out == "mysql":
+    queue_size = getattr(opts, 'store_queue_size', 0)
+    if queue_size and backend is not None and backend.uses_store:
+        printdbg("Storage thread disabled; %s uses the store"
+                 % backend.__class__.__name__)
+        queue_size = 0
+
+    if queue_size:
+        # The pipeline commits the issues of its adapter on exit
+        from bicho.db.pipeline import DBPipeline
+        db = DBPipeline(lambda: create_database_adapter(opts, backend, False),
+                        queue_size)
+    else:
+        db = create_database_adapter(opts, backend)
+    _databases.append(db)
+    return db
+
+
+def close_databases():
+    """
+    Commit the pending issues of the databases opened during the
+    run and close them, so they are complete before the issues are
+    post-processed.
+    """
+    while _databases:
+        _databases.pop(0).close()
+
+
+def create_database_adapter(opts, backend=None, commit_on_exit=True):
+    """
+    Create the adapter of the output database.
+
+    @param opts: configuration options
+    @type opts: L{Config}
+    @param backend: database backend
+    @type backend: L{DBBackend}
+    @param commit_on_exit: whether the issues pending when the
+     program exits are committed by the adapter. Adapters owned by
+     a L{DBPipeline} leave it to the pipeline, which runs them on
+     its own thread.
+    @type commit_on_exit: C{bool}
+
+    @return: the adapter
+    @rtype: L{DBDatabase}
+    """
+    if getattr(opts, 'output', 'db') == 'null':
+        from bicho.db.null import DBNull
+        db = DBNull(backend)
+    elif getattr(opts, 'output', 'db') == 'jsonl':
+        from bicho.db.jsonl import DBJSONLines
+        db = DBJSONLines(backend)
+    elif opts.db_driver_out == "mysql":
         from bicho.db.mysql import DBMySQL
-        return DBMySQL(backend)
+        db = DBMySQL(backend)
+    elif opts.db_driver_out == "sqlite":
+        from bicho.db.sqlite import DBSQLite
+        db = DBSQLite(backend)
+    elif opts.db_driver_out == "postgresql":
+        from bicho.db.postgresql import DBPostgreSQL
+        db = DBPostgreSQL(backend)
+    else:
+        raise ValueError('Unsupported output database driver: %s'
+                         % opts.db_driver_out)
+
+    # Issues pending when the backend finishes are committed too
+    if commit_on_exit:
+        atexit.register(db._commit_on_exit)
+    return db
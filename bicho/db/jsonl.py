@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+JSON Lines output module
+"""
+
+import datetime
+import gzip
+import json
+import sys
+
+from bicho.config import Config
+from bicho.db.database import DBIssue, DBTracker
+from bicho.db.sqlite import DBSQLite
+
+
+class DBJSONLines(DBSQLite):
+    """
+    Output adapter that writes the issues as JSON Lines.
+
+    Each issue, with its comments, changes, attachments, watchers
+    and the fields added by the backend, is written on its own line
+    as soon as the backend stores it. The file is given by
+    X{output_file}; it is compressed with gzip when its name ends
+    with C{.gz}, and issues go to the standard output when it's
+    not set or C{-}. In that case, messages printed by Bicho go to
+    the standard error output until the adapter is closed.
+
+    Trackers and the tables of the backend live in an in-memory
+    SQLite database, for the backends that query the store.
+
+    @param backend: database backend
+    @type backend: L{DBBackend}
+    @param path: path of the output file
+    @type path: C{str}
+    """
+    def __init__(self, backend=None, path=None):
+        DBSQLite.__init__(self, backend, ':memory:')
+
+        if path is None:
+            path = getattr(Config, 'output_file', None)
+
+        self._stdout = None
+        if not path or path == '-':
+            self.output = sys.stdout
+            self._stdout = sys.stdout
+            sys.stdout = sys.stderr
+        elif path.endswith('.gz'):
+            self.output = gzip.open(path, 'wb')
+        else:
+            self.output = open(path, 'wb')
+
+        self._tracker_urls = {}
+
+    def _insert_issues(self, issues, tracker_id):
+        tracker_url = self._get_tracker_url(tracker_id)
+
+        for issue in issues:
+            record = issue_to_json(issue)
+            record['tracker'] = tracker_url
+            self.output.write(json.dumps(record, sort_keys=True))
+            self.output.write('\n')
+
+        if self._stdout is not None:
+            self.output.flush()
+
+        return [DBIssue(issue.issue, tracker_id) for issue in issues]
+
+    def _get_tracker_url(self, tracker_id):
+        """
+        Return the URL of the tracker X{tracker_id}.
+        """
+        if tracker_id not in self._tracker_urls:
+            db_tracker = self.store.get(DBTracker, tracker_id)
+            url = db_tracker.url if db_tracker is not None else None
+            self._tracker_urls[tracker_id] = url
+        return self._tracker_urls[tracker_id]
+
+    def close(self):
+        DBSQLite.close(self)
+        self._close_output()
+
+    def _commit_on_exit(self):
+        DBSQLite._commit_on_exit(self)
+        self._close_output()
+
+    def _close_output(self):
+        """
+        Flush the output, closing it unless it's the standard output.
+        """
+        if self.output is None:
+            return
+        if self._stdout is not None:
+            self.output.flush()
+            sys.stdout = self._stdout
+        else:
+            self.output.close()
+        self.output = None
+
+
+def issue_to_json(issue):
+    """
+    Convert an issue into a value that can be encoded as JSON.
+
+    Attributes of the issue and of its comments, changes and other
+    objects are converted into dictionaries; dates into ISO 8601
+    strings.
+
+    @param issue: issue to convert
+    @type issue: L{Issue}
+
+    @return: the converted issue
+    @rtype: C{dict}
+    """
+    return _to_json(issue, set())
+
+
+def _to_json(value, seen):
+    if value is None or isinstance(value, (bool, int, long, float)):
+        return value
+    elif isinstance(value, unicode):
+        return value
+    elif isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    elif isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    elif isinstance(value, dict):
+        return dict((unicode(k), _to_json(v, seen))
+                    for k, v in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        return [_to_json(item, seen) for item in value]
+    elif hasattr(value, '__dict__') and id(value) not in seen:
+        seen.add(id(value))
+        result = _to_json(vars(value), seen)
+        seen.discard(id(value))
+        return result
+    else:
+        return unicode(value)
@@ -25,18 +25,19 @@ MySQL database module
 
 import warnings
 
-from storm.locals import Store, create_database
+from storm.locals import create_database
 
 from bicho.config import Config
 from bicho.db.database import DBDatabase, DBTracker, DBPeople, \
     DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, DBAttachment, \
-    DBChange, DBSupportedTracker, DBIssueTempRelationship
+    DBChange, DBSupportedTracker, DBIssueTempRelationship, DBTrackerSyncState
 
 
 class DBMySQL(DBDatabase):
     """
     MySQL database adapter.
     """
+    multi_row_insert = True
 
     def __init__(self, backend=None):
         DBDatabase.__init__(self, backend)
@@ -47,21 +48,105 @@ class DBMySQL(DBDatabase):
                                         + opts.db_hostname_out + ':'
                                         + opts.db_port_out + '/'
                                         + opts.db_database_out)
-        self.store = Store(self.database)
+        self.store = self._create_store()
 
         clsl = [DBSupportedTracker, DBTrackerMySQL, DBPeopleMySQL,
                 DBIssueMySQL, DBIssueRelationshipMySQL,
                 DBCommentMySQL, DBAttachmentMySQL, DBChangeMySQL,
-                DBIssuesWatchersMySQL, DBIssueTempRelationshipMySQL]
+                DBIssuesWatchersMySQL, DBIssueTempRelationshipMySQL,
+                DBTrackerSyncStateMySQL]
 
         if backend is not None:
             clsl.extend([cls for cls in backend.MYSQL_EXT])
 
         self.suppress_warnings()
         self.create_tables(clsl)
+        self.upgrade_tables()
+
+        # Temporary tables are not listed on information_schema
+        tables = [cls.__storm_table__ for cls in clsl
+                  if cls is not DBIssueTempRelationshipMySQL]
+        self.transactional = self._has_transactions(tables)
+        self.text_cast = self._get_text_cast()
 
     def suppress_warnings(self):
         warnings.filterwarnings("ignore", message="Table .* already exists")
+        warnings.filterwarnings("ignore", message="Duplicate entry .*")
+
+    def upgrade_tables(self):
+        """
+        Add the columns missing in tables created by older versions.
+        """
+        for table in ('comments', 'attachments', 'changes'):
+            result = self.store.execute("SHOW COLUMNS FROM %s LIKE 'fingerprint'"
+                                        % table)
+            if result.get_one() is None:
+                self.store.execute('ALTER TABLE %s \
+                                    ADD COLUMN fingerprint CHAR(40) NULL, \
+                                    ADD UNIQUE KEY %s_fingerprint_idx(fingerprint)'
+                                   % (table, table))
+
+        result = self.store.execute("SHOW COLUMNS FROM issues LIKE 'fingerprint'")
+        if result.get_one() is None:
+            self.store.execute('ALTER TABLE issues \
+                                ADD COLUMN fingerprint CHAR(40) NULL')
+        self.store.commit()
+
+    def _has_transactions(self, tables):
+        """
+        Return whether all the given tables support transactions.
+
+        Tables are created with the MyISAM engine, which ignores
+        savepoints and rollbacks, but they may have been converted
+        to InnoDB.
+
+        @param tables: names of the tables
+        @type tables: C{list} of C{str}
+
+        @rtype: C{bool}
+        """
+        params = ', '.join(['?'] * len(tables))
+        result = self.store.execute("SELECT COUNT(*) \
+                                     FROM information_schema.TABLES \
+                                     WHERE TABLE_SCHEMA = DATABASE() \
+                                     AND TABLE_NAME IN (%s) \
+                                     AND ENGINE <> 'InnoDB'" % params,
+                                    tables)
+        return result.get_one()[0] == 0
+
+    def _get_text_cast(self):
+        """
+        Return the expression that converts a value to a string that
+        can be compared with the identifiers of the issues.
+
+        Values cast to CHAR get the collation of the connection, and
+        MySQL refuses to compare them with a column of a different
+        collation. The charset and the collation of C{issues.issue}
+        are set explicitly instead.
+
+        @rtype: C{str}
+        """
+        result = self.store.execute("SELECT CHARACTER_SET_NAME, COLLATION_NAME \
+                                     FROM information_schema.COLUMNS \
+                                     WHERE TABLE_SCHEMA = DATABASE() \
+                                     AND TABLE_NAME = 'issues' \
+                                     AND COLUMN_NAME = 'issue'")
+        charset, collation = result.get_one()
+        return 'CAST(%%s AS CHAR CHARACTER SET %s) COLLATE %s' % \
+            (charset, collation)
+
+    def _get_insert_statement(self, table, columns, nrows,
+                              ignore_duplicates=False):
+        stmt = DBDatabase._get_insert_statement(self, table, columns, nrows)
+        if ignore_duplicates:
+            stmt = stmt.replace('INSERT INTO', 'INSERT IGNORE INTO', 1)
+        return stmt
+
+    def _get_first_insert_id(self, nrows):
+        # LAST_INSERT_ID() returns the value generated for the first
+        # row of a multi-row INSERT. The rest of them get consecutive
+        # values because the statement is a simple insert.
+        return self.store.execute('SELECT LAST_INSERT_ID()').get_one()[0]
 
 
 class DBSupportedTracker(DBSupportedTracker):
@@ -95,6 +180,26 @@ class DBTrackerMySQL(DBTracker):
                      ) ENGINE=MYISAM;'
 
 
+class DBTrackerSyncStateMySQL(DBTrackerSyncState):
+    """
+    MySQL subclass of L{DBTrackerSyncState}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS tracker_sync_state ( \
+                     id INTEGER NOT NULL AUTO_INCREMENT, \
+                     tracker_id INTEGER NOT NULL, \
+                     backend VARCHAR(64) NOT NULL, \
+                     last_modification DATETIME NULL, \
+                     last_issue VARCHAR(255) NULL, \
+                     updated_on DATETIME NULL, \
+                     PRIMARY KEY(id), \
+                     UNIQUE KEY(tracker_id, backend), \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ) ENGINE=MYISAM;'
+
+
 class DBPeopleMySQL(DBPeople):
     """
     MySQL subclass of L{DBPeople}.
@@ -126,6 +231,7 @@ class DBIssueMySQL(DBIssue):
                      submitted_by INTEGER UNSIGNED NOT NULL, \
                      submitted_on DATETIME NOT NULL, \
                      assigned_to INTEGER UNSIGNED NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
                      PRIMARY KEY(id), \
                      UNIQUE KEY(issue, tracker_id), \
                      INDEX issues_submitted_idx(submitted_by), \
@@ -221,9 +327,11 @@ class DBCommentMySQL(DBComment):
                      text TEXT NOT NULL, \
                      submitted_by INTEGER UNSIGNED NOT NULL, \
                      submitted_on DATETIME NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
                      PRIMARY KEY(id), \
                      INDEX comments_submitted_idx(submitted_by), \
                      INDEX comments_issue_idx(issue_id), \
+                     UNIQUE KEY comments_fingerprint_idx(fingerprint), \
                      FOREIGN KEY(submitted_by) \
                        REFERENCES people(id) \
                          ON DELETE SET NULL \
@@ -247,9 +355,11 @@ class DBAttachmentMySQL(DBAttachment):
                      url VARCHAR(255) NOT NULL, \
                      submitted_by INTEGER UNSIGNED, \
                      submitted_on DATETIME, \
+                     fingerprint CHAR(40) NULL, \
                      PRIMARY KEY(id), \
                      INDEX attachments_submitted_idx(submitted_by), \
                      INDEX attachments_issue_idx(issue_id), \
+                     UNIQUE KEY attachments_fingerprint_idx(fingerprint), \
                      FOREIGN KEY(submitted_by) \
                        REFERENCES people(id) \
                          ON DELETE SET NULL \
@@ -273,9 +383,11 @@ class DBChangeMySQL(DBChange):
                      new_value TEXT NOT NULL, \
                      changed_by INTEGER UNSIGNED NOT NULL, \
                      changed_on DATETIME NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
                      PRIMARY KEY(id), \
                      INDEX changes_issue_idx(issue_id), \
                      INDEX changes_changed_idx(changed_by), \
+                     UNIQUE KEY changes_fingerprint_idx(fingerprint), \
                      FOREIGN KEY(issue_id) \
                        REFERENCES issues(id) \
                          ON DELETE CASCADE \
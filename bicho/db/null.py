@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Null output module, used to benchmark the backends
+"""
+
+from bicho.db.database import DBIssue
+from bicho.db.sqlite import DBSQLite
+from bicho.utils import printout, run_stats
+
+
+class DBNull(DBSQLite):
+    """
+    Output adapter that discards the issues.
+
+    The backend runs as usual but its issues are only counted, so
+    the throughput of fetching and parsing is measured without the
+    cost of a database. Trackers and the tables of the backend live
+    in an in-memory SQLite database, for the backends that query the
+    store. The stats of the run are printed when it finishes.
+    """
+    def __init__(self, backend=None):
+        DBSQLite.__init__(self, backend, ':memory:')
+        self._reported = False
+
+    def _insert_issues(self, issues, tracker_id):
+        return [DBIssue(issue.issue, tracker_id) for issue in issues]
+
+    def close(self):
+        DBSQLite.close(self)
+        self._report()
+
+    def _commit_on_exit(self):
+        DBSQLite._commit_on_exit(self)
+        self._report()
+
+    def _report(self):
+        """
+        Print the stats of the run, once.
+        """
+        if self._reported:
+            return
+        self._reported = True
+        printout(run_stats.report())
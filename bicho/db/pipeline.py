@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Storage pipeline module.
+
+Issues are stored by a dedicated thread while the backend goes on
+fetching and parsing the next ones.
+"""
+
+import atexit
+import sys
+import threading
+import Queue
+
+from storm.info import get_cls_info
+
+from bicho.db.database import NotFoundError
+from bicho.utils import printerr
+
+
+class DBTask(object):
+    """
+    Call to run on the storage thread.
+
+    @param func: function to call; it gets the database adapter as
+     first argument
+    @type func: C{callable}
+    @param args: other arguments of the function
+    @type args: C{tuple}
+    @param wait: whether the caller waits for the result
+    @type wait: C{bool}
+    @param skip_on_error: whether the task is skipped after an
+     error stops the storage thread
+    @type skip_on_error: C{bool}
+    """
+    def __init__(self, func, args=(), wait=False, skip_on_error=False):
+        self.func = func
+        self.args = args
+        self.skip_on_error = skip_on_error
+        self.result = None
+        self.exc_info = None
+        self.done = threading.Event() if wait else None
+
+    def run(self, db):
+        try:
+            self.result = self.func(db, *self.args)
+        except:
+            if self.done is None:
+                raise
+            self.exc_info = sys.exc_info()
+        finally:
+            if self.done is not None:
+                self.done.set()
+
+
+class DBStorageThread(threading.Thread):
+    """
+    Thread that owns the database adapter, and so its Storm store,
+    and runs the tasks sent to it in order.
+
+    @param factory: function that creates the database adapter
+    @type factory: C{callable}
+    @param queue_size: maximum number of pending tasks
+    @type queue_size: C{int}
+    """
+    def __init__(self, factory, queue_size):
+        threading.Thread.__init__(self, name='storage')
+        self.daemon = True
+        self.tasks = Queue.Queue(queue_size)
+        self.db = None
+        self.exc_info = None
+        self._factory = factory
+
+    def run(self):
+        while True:
+            task = self.tasks.get()
+            try:
+                if task is None:
+                    return
+                if self.exc_info is not None and task.skip_on_error:
+                    continue
+                if self.db is None:
+                    self.db = self._factory()
+                task.run(self.db)
+            except:
+                # The first error stops the storage of issues. It is
+                # raised on the thread of the backend on every call
+                # from then on, so no issue is silently lost
+                if self.exc_info is None:
+                    self.exc_info = sys.exc_info()
+            finally:
+                self.tasks.task_done()
+
+
+class DBPipeline(object):
+    """
+    Database adapter that stores the issues on a background thread.
+
+    L{insert_issue} queues the issue and returns at once, so fetching
+    and storing the issues overlap. When the queue is full, the
+    backend waits for the storage thread (backpressure). Any other
+    method waits until every queued issue is stored and then runs
+    on the storage thread. Database objects are returned detached
+    from the store, as L{DBDetached} objects, and the store itself
+    is not available.
+
+    The resume watermark is read by L{get_last_modification_date}
+    after the queue is drained and committed, so it only includes
+    committed issues.
+
+    @param factory: function that creates the database adapter
+    @type factory: C{callable}
+    @param queue_size: maximum number of queued issues
+    @type queue_size: C{int}
+    """
+    def __init__(self, factory, queue_size):
+        self._thread = DBStorageThread(factory, queue_size)
+        self._thread.start()
+        self._closed = False
+
+        # Create the adapter now, to report connection errors
+        self._call(lambda db: None)
+
+        atexit.register(self._close_on_exit)
+
+    def insert_issue(self, issue, tracker_id):
+        """
+        Queue the issue to be stored by the storage thread.
+
+        @param issue: issue to insert
+        @type issue: L{Issue}
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+        """
+        self._raise_error()
+        self._thread.tasks.put(DBTask(_store_issue, (issue, tracker_id),
+                                      skip_on_error=True))
+
+    def drain(self):
+        """
+        Wait until the queued issues are stored.
+        """
+        self._thread.tasks.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        Store the queued issues, commit them and stop the storage
+        thread.
+
+        Issues stored before an error are committed too.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        # Wait for the queued issues before committing them; the
+        # adapter is closed on the storage thread, which owns it
+        self._thread.tasks.join()
+        self._thread.tasks.put(DBTask(lambda db: db.close()))
+        self._thread.tasks.put(None)
+        self._thread.join()
+        self._raise_error()
+
+    def _close_on_exit(self):
+        """
+        Close the pipeline before the program exits.
+        """
+        try:
+            self.close()
+        except Exception, e:
+            printerr("Error storing pending issues: %s" % str(e))
+
+    def __getattr__(self, name):
+        if name == 'store':
+            # Objects of the store belong to the storage thread
+            raise AttributeError("the store is not available out of "
+                                 "the storage thread")
+        self.drain()
+        attr = getattr(self._thread.db, name)
+
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._call(lambda db: getattr(db, name)(*args, **kwargs))
+        return call
+
+    def _call(self, func):
+        """
+        Run the function on the storage thread and wait for its result.
+        """
+        self._raise_error()
+
+        task = DBTask(lambda db: detach(func(db)), wait=True)
+        self._thread.tasks.put(task)
+        task.done.wait()
+
+        if task.exc_info is not None:
+            raise task.exc_info[0], task.exc_info[1], task.exc_info[2]
+        return task.result
+
+    def _raise_error(self):
+        """
+        Raise the error that stopped the storage thread, if any.
+        """
+        exc_info = self._thread.exc_info
+        if exc_info is not None:
+            raise exc_info[0], exc_info[1], exc_info[2]
+
+
+class DBDetached(object):
+    """
+    Copy of the values of a database object.
+
+    Objects of the store can't be used out of the storage thread
+    because they are reloaded from the database after each commit.
+
+    @param obj: database object to copy
+    @type obj: C{object}
+    """
+    def __init__(self, obj):
+        for name in get_cls_info(type(obj)).attributes:
+            setattr(self, name, getattr(obj, name))
+
+
+def detach(value):
+    """
+    Return a detached copy of the given value when it is a database
+    object, or the value itself otherwise.
+    """
+    if hasattr(type(value), '__storm_table__'):
+        return DBDetached(value)
+    return value
+
+
+def _store_issue(db, issue, tracker_id):
+    """
+    Store the issue, skipping it on the same errors the backends skip.
+    """
+    try:
+        db.insert_issue(issue, tracker_id)
+    except UnicodeEncodeError:
+        printerr("UnicodeEncodeError: the issue %s couldn't be stored"
+                 % issue.issue)
+    except NotFoundError:
+        printerr("NotFoundError: the issue %s couldn't be stored"
+                 % issue.issue)
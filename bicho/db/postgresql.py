@@ -0,0 +1,500 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+PostgreSQL database module
+"""
+
+import cStringIO
+
+from storm.locals import create_database
+
+from bicho.config import Config
+from bicho.db.database import DBDatabase, DBTracker, DBPeople, \
+    DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, DBAttachment, \
+    DBChange, DBSupportedTracker, DBIssueTempRelationship, \
+    DBTrackerSyncState, convert_mysql_table
+
+
+# Batches with this number of rows or more are loaded using COPY
+COPY_MIN_ROWS = 20
+
+# MySQL types of the backend tables and their PostgreSQL equivalents.
+# PostgreSQL doesn't truncate long strings, so VARCHARs become TEXT.
+POSTGRESQL_TYPES = [(r'DATETIME', 'TIMESTAMP'),
+                    (r'(TINY|MEDIUM|LONG)TEXT', 'TEXT'),
+                    (r'VARCHAR\(\d+\)', 'TEXT')]
+
+
+class DBPostgreSQL(DBDatabase):
+    """
+    PostgreSQL database adapter.
+
+    Identifiers of new rows are taken from the sequence of the table
+    before writing them, so each row gets its identifier even when
+    rows with duplicated keys are ignored. This way, large batches of
+    rows are loaded with X{COPY ... FROM STDIN}, which is much faster
+    than INSERT but can't return the identifiers of the rows.
+
+    Issues without assignee store C{NULL}, as the column references
+    the people table.
+    """
+    multi_row_insert = True
+    unassigned_id = None
+    text_cast = 'CAST(%s AS TEXT)'
+
+    def __init__(self, backend=None):
+        DBDatabase.__init__(self, backend)
+        opts = Config()
+
+        self.database = create_database('postgres://' + opts.db_user_out + ':'
+                                        + opts.db_password_out + '@'
+                                        + opts.db_hostname_out + ':'
+                                        + opts.db_port_out + '/'
+                                        + opts.db_database_out)
+        self.store = self._create_store()
+
+        clsl = [DBSupportedTrackerPostgreSQL, DBTrackerPostgreSQL,
+                DBPeoplePostgreSQL, DBIssuePostgreSQL,
+                DBIssueRelationshipPostgreSQL, DBCommentPostgreSQL,
+                DBAttachmentPostgreSQL, DBChangePostgreSQL,
+                DBIssuesWatchersPostgreSQL,
+                DBIssueTempRelationshipPostgreSQL,
+                DBTrackerSyncStatePostgreSQL]
+
+        if backend is not None:
+            clsl.extend(self._get_backend_tables(backend))
+
+        self.create_tables(clsl)
+        self.store.commit()
+
+    def _get_backend_tables(self, backend):
+        """
+        Return the classes of the tables used by the backend.
+
+        Backends may define the PostgreSQL tables on
+        X{POSTGRESQL_EXT}. Otherwise, they are created from the
+        MySQL definitions of X{MYSQL_EXT}.
+
+        @param backend: database backend
+        @type backend: L{DBBackend}
+
+        @return: database classes
+        @rtype: C{list} of L{object}
+        """
+        postgresql_ext = getattr(backend, 'POSTGRESQL_EXT', None)
+        if postgresql_ext is not None:
+            return postgresql_ext
+
+        clsl = []
+        for cls in backend.MYSQL_EXT or []:
+            sql = convert_mysql_table(cls.__sql_table__, 'SERIAL PRIMARY KEY',
+                                      POSTGRESQL_TYPES)
+            clsl.append(type(cls.__name__ + 'PostgreSQL', (cls,),
+                             {'__sql_table__': sql}))
+        return clsl
+
+    def _insert_rows(self, table, columns, rows, key_column=None):
+        ids = self._get_next_ids(table, len(rows))
+        columns = ['id'] + list(columns)
+        rows = [(row_id,) + tuple(row) for row_id, row in zip(ids, rows)]
+
+        if len(rows) >= COPY_MIN_ROWS:
+            if key_column is None:
+                self._copy_rows(table, columns, rows)
+                return ids
+            inserted = self._copy_new_rows(table, columns, rows)
+            return [row_id if row_id in inserted else None for row_id in ids]
+
+        ignore_duplicates = key_column is not None
+        pos = columns.index(key_column) if ignore_duplicates else None
+        offset = 0
+
+        for chunk in self._split_rows(rows):
+            stmt = self._get_insert_statement(table, columns, len(chunk),
+                                              ignore_duplicates)
+            params = [value for row in chunk for value in row]
+            result = self.store.execute(stmt, params)
+
+            if ignore_duplicates and result.rowcount != len(chunk):
+                # Rows whose key was already stored are ignored
+                stored_ids = self._get_ids_by_key(table, key_column,
+                                                  [row[pos] for row in chunk])
+                ids[offset:offset + len(chunk)] = \
+                    [row[0] if row[0] == stored_id else None
+                     for row, stored_id in zip(chunk, stored_ids)]
+            offset += len(chunk)
+        return ids
+
+    def _copy_new_rows(self, table, columns, rows):
+        """
+        Load the given rows into X{table} using COPY, ignoring the
+        ones that violate a unique index.
+
+        COPY fails on the first duplicated row, so rows are loaded
+        into a staging table first and then moved to X{table} with
+        an INSERT that skips the duplicated ones.
+
+        @param table: name of the table
+        @type table: C{str}
+        @param columns: names of the columns set on each row, starting
+         by C{id}
+        @type columns: C{list} of C{str}
+        @param rows: values of each row, sorted as X{columns}
+        @type rows: C{list} of C{tuple}
+
+        @return: identifiers of the inserted rows
+        @rtype: C{set} of C{int}
+        """
+        # Staging tables are kept until the connection is closed, but
+        # they are gone when the transaction that created them is
+        # rolled back
+        staging = 'copy_' + table
+        self.store.execute('CREATE TEMPORARY TABLE IF NOT EXISTS %s '
+                           '(LIKE %s)' % (staging, table), noresult=True)
+        self._copy_rows(staging, columns, rows)
+
+        # Among the duplicated rows of the batch, the first one is kept
+        names = ', '.join(columns)
+        result = self.store.execute('INSERT INTO %s (%s) SELECT %s FROM %s '
+                                    'ORDER BY id ON CONFLICT DO NOTHING '
+                                    'RETURNING id'
+                                    % (table, names, names, staging))
+        inserted = set([row[0] for row in result])
+        self.store.execute('TRUNCATE %s' % staging, noresult=True)
+        return inserted
+
+    def _copy_rows(self, table, columns, rows):
+        """
+        Load the given rows into X{table} using COPY.
+
+        @param table: name of the table
+        @type table: C{str}
+        @param columns: names of the columns set on each row
+        @type columns: C{list} of C{str}
+        @param rows: values of each row, sorted as X{columns}
+        @type rows: C{list} of C{tuple}
+        """
+        data = cStringIO.StringIO()
+        for row in rows:
+            data.write('\t'.join([copy_value(value) for value in row]))
+            data.write('\n')
+        data.seek(0)
+
+        # Running a statement flushes the pending objects, which may
+        # be referenced by the rows
+        self.store.flush()
+
+        # Storm doesn't support COPY; the raw cursor shares its
+        # connection, so rows are written in the same transaction
+        cursor = self.store._connection.build_raw_cursor()
+        try:
+            cursor.copy_expert('COPY %s (%s) FROM STDIN' %
+                               (table, ', '.join(columns)), data)
+        finally:
+            cursor.close()
+
+    def _get_next_ids(self, table, nrows):
+        """
+        Take X{nrows} identifiers from the sequence of X{table}.
+
+        @param table: name of the table
+        @type table: C{str}
+        @param nrows: number of identifiers
+        @type nrows: C{int}
+
+        @return: the identifiers
+        @rtype: C{list} of C{int}
+        """
+        stmt = "SELECT nextval(pg_get_serial_sequence('%s', 'id')) " \
+            "FROM generate_series(1, %d)" % (table, nrows)
+        return [row[0] for row in self.store.execute(stmt)]
+
+    def _get_insert_statement(self, table, columns, nrows,
+                              ignore_duplicates=False):
+        stmt = DBDatabase._get_insert_statement(self, table, columns, nrows)
+        if ignore_duplicates:
+            stmt += ' ON CONFLICT DO NOTHING'
+        return stmt
+
+
+def copy_value(value):
+    """
+    Format a value for the text format of COPY.
+
+    @param value: value to format
+    @type value: C{object}
+
+    @return: the formatted value, encoded in UTF-8
+    @rtype: C{str}
+    """
+    if value is None:
+        return '\\N'
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    else:
+        value = str(value)
+    return value.replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class DBSupportedTrackerPostgreSQL(DBSupportedTracker):
+    """
+    PostgreSQL subclass of L{DBSupportedTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS supported_trackers ( \
+                     id SERIAL PRIMARY KEY, \
+                     name TEXT NOT NULL, \
+                     version TEXT NOT NULL, \
+                     UNIQUE(name, version) \
+                     );'
+
+
+class DBTrackerPostgreSQL(DBTracker):
+    """
+    PostgreSQL subclass of L{DBTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS trackers ( \
+                     id SERIAL PRIMARY KEY, \
+                     url TEXT NOT NULL, \
+                     type INTEGER NOT NULL, \
+                     retrieved_on TIMESTAMP NOT NULL, \
+                     UNIQUE(url), \
+                     FOREIGN KEY(type) \
+                       REFERENCES supported_trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     );'
+
+
+class DBTrackerSyncStatePostgreSQL(DBTrackerSyncState):
+    """
+    PostgreSQL subclass of L{DBTrackerSyncState}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS tracker_sync_state ( \
+                     id SERIAL PRIMARY KEY, \
+                     tracker_id INTEGER NOT NULL, \
+                     backend TEXT NOT NULL, \
+                     last_modification TIMESTAMP NULL, \
+                     last_issue TEXT NULL, \
+                     updated_on TIMESTAMP NULL, \
+                     UNIQUE(tracker_id, backend), \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     );'
+
+
+class DBPeoplePostgreSQL(DBPeople):
+    """
+    PostgreSQL subclass of L{DBPeople}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS people ( \
+                     id SERIAL PRIMARY KEY, \
+                     name TEXT NULL, \
+                     email TEXT NULL, \
+                     user_id TEXT NOT NULL, \
+                     UNIQUE(user_id) \
+                     );'
+
+
+class DBIssuePostgreSQL(DBIssue):
+    """
+    PostgreSQL subclass of L{DBIssue}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues ( \
+                     id SERIAL PRIMARY KEY, \
+                     tracker_id INTEGER NOT NULL, \
+                     issue TEXT NOT NULL, \
+                     type TEXT NULL, \
+                     summary TEXT NOT NULL, \
+                     description TEXT NOT NULL, \
+                     status TEXT NOT NULL, \
+                     resolution TEXT NULL, \
+                     priority TEXT NULL, \
+                     submitted_by INTEGER NOT NULL, \
+                     submitted_on TIMESTAMP NOT NULL, \
+                     assigned_to INTEGER NULL, \
+                     fingerprint CHAR(40) NULL, \
+                     UNIQUE(issue, tracker_id), \
+                     FOREIGN KEY(submitted_by) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(assigned_to) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS issues_submitted_idx \
+                       ON issues(submitted_by); \
+                     CREATE INDEX IF NOT EXISTS issues_assigned_idx \
+                       ON issues(assigned_to); \
+                     CREATE INDEX IF NOT EXISTS issues_tracker_idx \
+                       ON issues(tracker_id);'
+
+
+class DBIssuesWatchersPostgreSQL(DBIssuesWatchers):
+    """
+    PostgreSQL subclass of L{DBIssuesWatchers}
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_watchers ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     person_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, person_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(person_id) \
+                       REFERENCES people(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS issue_person_idx2 \
+                       ON issues_watchers(person_id);'
+
+
+class DBIssueRelationshipPostgreSQL(DBIssueRelationship):
+    """
+    PostgreSQL subclass of L{DBIssueRelationship}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS related_to ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     related_to INTEGER NOT NULL, \
+                     type TEXT NOT NULL, \
+                     UNIQUE(issue_id, related_to, type), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(related_to) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS issues_related_idx2 \
+                       ON related_to(related_to);'
+
+
+class DBIssueTempRelationshipPostgreSQL(DBIssueTempRelationship):
+    """
+    PostgreSQL subclass of L{DBIssueTempRelationship}.
+    """
+    __sql_table__ = 'CREATE TEMPORARY TABLE IF NOT EXISTS temp_related_to ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     related_to TEXT NOT NULL, \
+                     type TEXT NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, related_to, type, tracker_id) \
+                     );'
+
+
+class DBCommentPostgreSQL(DBComment):
+    """
+    PostgreSQL subclass of L{DBComment}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS comments ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     comment_id INTEGER, \
+                     text TEXT NOT NULL, \
+                     submitted_by INTEGER NOT NULL, \
+                     submitted_on TIMESTAMP NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
+                     UNIQUE(fingerprint), \
+                     FOREIGN KEY(submitted_by) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS comments_submitted_idx \
+                       ON comments(submitted_by); \
+                     CREATE INDEX IF NOT EXISTS comments_issue_idx \
+                       ON comments(issue_id);'
+
+
+class DBAttachmentPostgreSQL(DBAttachment):
+    """
+    PostgreSQL subclass of L{DBAttachment}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS attachments ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     name TEXT NOT NULL, \
+                     description TEXT NOT NULL, \
+                     url TEXT NOT NULL, \
+                     submitted_by INTEGER, \
+                     submitted_on TIMESTAMP, \
+                     fingerprint CHAR(40) NULL, \
+                     UNIQUE(fingerprint), \
+                     FOREIGN KEY(submitted_by) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS attachments_submitted_idx \
+                       ON attachments(submitted_by); \
+                     CREATE INDEX IF NOT EXISTS attachments_issue_idx \
+                       ON attachments(issue_id);'
+
+
+class DBChangePostgreSQL(DBChange):
+    """
+    PostgreSQL subclass of L{DBChange}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS changes ( \
+                     id SERIAL PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     field TEXT NOT NULL, \
+                     old_value TEXT NOT NULL, \
+                     new_value TEXT NOT NULL, \
+                     changed_by INTEGER NOT NULL, \
+                     changed_on TIMESTAMP NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
+                     UNIQUE(fingerprint), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(changed_by) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS changes_issue_idx \
+                       ON changes(issue_id); \
+                     CREATE INDEX IF NOT EXISTS changes_changed_idx \
+                       ON changes(changed_by);'
@@ -0,0 +1,468 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Database input module.
+
+Issues stored by Bicho are read back from a database and sent to
+the output, so they can be exported, moved to another driver or
+post-processed again without accessing the trackers.
+"""
+
+import inspect
+import sys
+
+from storm.info import get_cls_info
+from storm.locals import Store, create_database
+
+from bicho.backends import Backend
+from bicho.common import Tracker, People, Issue, Comment, Attachment, \
+    Change, TempRelationship
+from bicho.config import Config
+from bicho.db.database import DBSupportedTracker, DBTracker, DBPeople, \
+    DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, \
+    DBAttachment, DBChange, DBBackend, get_database
+from bicho.utils import printdbg, printerr, printout, LRUCache
+
+
+# Number of identities kept in memory while reading issues
+READER_PEOPLE_CACHE_SIZE = 50000
+
+
+class DBReader(object):
+    """
+    Reader of the issues of an input database.
+
+    Issues are read in batches of X{batch_size}, following the order
+    of their identifiers, and the comments, attachments, changes,
+    relationships and watchers of each batch are read with a query
+    for each kind. So memory doesn't grow with the size of the
+    database and there is no need to keep a cursor open while other
+    queries run.
+
+    Rows of the tables of X{backend} that belong to an issue are
+    read too, and set on the X{ext_rows} attribute of the issue.
+    Tables that don't belong to an issue are not read.
+
+    Relationships are sent as temporal relationships, whose issue is
+    an integer. Those of issues with other kinds of identifiers are
+    not sent; they are counted on X{skipped_relationships}.
+
+    @param database: input database
+    @type database: L{storm.database.Database}
+    @param batch_size: number of issues read on each query
+    @type batch_size: C{int}
+    @param backend: database backend that stored the issues
+    @type backend: L{DBBackend}
+    """
+    def __init__(self, database, batch_size, backend=None):
+        self.database = database
+        self.store = Store(database)
+        self.batch_size = batch_size
+        self.skipped_relationships = 0
+        self._people = LRUCache(READER_PEOPLE_CACHE_SIZE)
+
+        self._ext_classes = []
+        if backend is not None:
+            self._ext_classes = [cls for cls in backend.MYSQL_EXT or []
+                                 if 'issue_id' in get_cls_info(cls).attributes]
+
+    def get_trackers(self, url=None):
+        """
+        Get the trackers stored on the database.
+
+        @param url: only get the tracker with this URL
+        @type url: C{str}
+
+        @return: the trackers and their identifiers
+        @rtype: C{list} of C{tuple} of (C{int}, L{Tracker})
+        """
+        clauses = [DBTracker.type == DBSupportedTracker.id]
+        if url is not None:
+            clauses.append(DBTracker.url == unicode(url))
+
+        result = self.store.find((DBTracker, DBSupportedTracker), *clauses)
+        return [(db_tracker.id, Tracker(db_tracker.url, supported.name,
+                                        supported.version))
+                for db_tracker, supported in result.order_by(DBTracker.id)]
+
+    def get_issues(self, tracker_id):
+        """
+        Iterate over the issues of the tracker X{tracker_id}.
+
+        @param tracker_id: identifier of the tracker
+        @type tracker_id: C{int}
+
+        @return: the issues
+        @rtype: C{iterator} of L{Issue}
+        """
+        last_id = 0
+
+        while True:
+            result = self.store.find((DBIssue.id, DBIssue.issue,
+                                      DBIssue.type, DBIssue.summary,
+                                      DBIssue.description, DBIssue.status,
+                                      DBIssue.resolution, DBIssue.priority,
+                                      DBIssue.submitted_by,
+                                      DBIssue.submitted_on,
+                                      DBIssue.assigned_to),
+                                     DBIssue.tracker_id == tracker_id,
+                                     DBIssue.id > last_id)
+            rows = list(result.order_by(DBIssue.id)[:self.batch_size])
+            if not rows:
+                return
+
+            last_id = rows[-1][0]
+            printdbg("Read %d issues from the input database" % len(rows))
+
+            for issue in self._build_issues(rows):
+                yield issue
+
+    def _build_issues(self, rows):
+        """
+        Build the issues of a batch, with their children.
+        """
+        issue_ids = [row[0] for row in rows]
+
+        comments = self._group_by_issue(issue_ids, DBComment.issue_id,
+                                        DBComment.id, DBComment.text,
+                                        DBComment.submitted_by,
+                                        DBComment.submitted_on)
+        attachments = self._group_by_issue(issue_ids, DBAttachment.issue_id,
+                                           DBAttachment.id, DBAttachment.url,
+                                           DBAttachment.submitted_by,
+                                           DBAttachment.submitted_on,
+                                           DBAttachment.name,
+                                           DBAttachment.description)
+        changes = self._group_by_issue(issue_ids, DBChange.issue_id,
+                                       DBChange.id, DBChange.field,
+                                       DBChange.old_value, DBChange.new_value,
+                                       DBChange.changed_by,
+                                       DBChange.changed_on)
+        watchers = self._group_by_issue(issue_ids, DBIssuesWatchers.issue_id,
+                                        DBIssuesWatchers.id,
+                                        DBIssuesWatchers.person_id)
+        relationships = self._group_by_issue(issue_ids,
+                                             DBIssueRelationship.issue_id,
+                                             DBIssueRelationship.id,
+                                             DBIssueRelationship.type,
+                                             DBIssue.issue,
+                                             join=(DBIssueRelationship.related_to
+                                                   == DBIssue.id))
+
+        # Identities of submitters, assignees, authors and watchers
+        person_ids = set()
+        for row in rows:
+            person_ids.update([row[8], row[10]])
+        for rows_by_issue, column in ((comments, 2), (attachments, 2),
+                                      (changes, 4), (watchers, 1)):
+            for row in _values(rows_by_issue):
+                person_ids.add(row[column])
+        self._load_people(person_ids)
+
+        ext_rows = self._read_ext_rows(issue_ids)
+
+        for (issue_id, issue_name, type, summary, description, status,
+             resolution, priority, submitted_by, submitted_on,
+             assigned_to) in rows:
+            issue = Issue(issue_name, type, summary, description,
+                          self._get_people(submitted_by), submitted_on)
+            issue.set_status(status, resolution)
+            issue.set_priority(priority)
+
+            assigned_to = self._get_people(assigned_to)
+            if assigned_to is not None:
+                issue.set_assigned(assigned_to)
+
+            for _, text, submitted_by, submitted_on in comments.get(issue_id, []):
+                issue.add_comment(Comment(text, self._get_people(submitted_by),
+                                          submitted_on))
+
+            for (_, url, submitted_by, submitted_on,
+                 name, description) in attachments.get(issue_id, []):
+                attachment = Attachment(url, self._get_people(submitted_by),
+                                        submitted_on)
+                attachment.set_name(name)
+                attachment.set_description(description)
+                issue.add_attachment(attachment)
+
+            for (_, field, old_value, new_value,
+                 changed_by, changed_on) in changes.get(issue_id, []):
+                issue.add_change(Change(field, old_value, new_value,
+                                        self._get_people(changed_by),
+                                        changed_on))
+
+            for _, person_id in watchers.get(issue_id, []):
+                watcher = self._get_people(person_id)
+                if watcher is not None:
+                    issue.add_watcher(watcher)
+
+            # Relationships are stored again as temporal ones, so
+            # the output resolves them once every issue is there
+            issue_rels = relationships.get(issue_id, [])
+            if issue_rels and not issue_name.isdigit():
+                self.skipped_relationships += len(issue_rels)
+                issue_rels = []
+
+            for _, type, related_to in issue_rels:
+                issue.add_temp_relationship(TempRelationship(int(issue_name),
+                                                             type,
+                                                             related_to))
+
+            if self._ext_classes:
+                issue.ext_rows = ext_rows.get(issue_id, {})
+
+            yield issue
+
+    def _read_ext_rows(self, issue_ids):
+        """
+        Read the rows of the tables of the backend that belong to the
+        issues, without their primary keys.
+
+        @return: values of the rows by table, indexed by issue
+         identifier
+        @rtype: C{dict} of C{dict} of C{list} of C{dict}
+        """
+        ext_rows = {}
+
+        for cls in self._ext_classes:
+            names = get_ext_columns(cls)
+            for obj in self.store.find(cls, cls.issue_id.is_in(issue_ids)):
+                values = dict((name, getattr(obj, name)) for name in names)
+                ext_rows.setdefault(obj.issue_id, {}) \
+                    .setdefault(cls.__storm_table__, []).append(values)
+        return ext_rows
+
+    def _group_by_issue(self, issue_ids, issue_column, id_column, *columns,
+                        **kwargs):
+        """
+        Read the given columns of the rows that belong to the issues.
+
+        Only the columns of the oldest versions of the tables are
+        read, so databases created by any version can be read.
+
+        @param issue_ids: identifiers of the issues
+        @type issue_ids: C{list} of C{int}
+        @param issue_column: column with the identifier of the issue
+        @type issue_column: L{storm.locals.Int}
+        @param id_column: identifier of the rows, used to sort them
+        @type id_column: L{storm.locals.Int}
+        @param columns: other columns to read
+        @param join: condition to join other tables, if any
+
+        @return: tuples of X{id_column} and X{columns}, indexed by
+         issue identifier
+        @rtype: C{dict} of C{list}
+        """
+        clauses = [issue_column.is_in(issue_ids)]
+        if kwargs.get('join') is not None:
+            clauses.append(kwargs['join'])
+
+        rows = {}
+        result = self.store.find((issue_column, id_column) + columns,
+                                 *clauses)
+        for row in result.order_by(id_column):
+            rows.setdefault(row[0], []).append(row[1:])
+        return rows
+
+    def _load_people(self, person_ids):
+        """
+        Read the identities not in the cache.
+        """
+        missing = [pid for pid in person_ids
+                   if pid and pid not in self._people]
+        if not missing:
+            return
+
+        for db_people in self.store.find(DBPeople, DBPeople.id.is_in(missing)):
+            people = People(db_people.user_id)
+            people.set_name(db_people.name)
+            people.set_email(db_people.email)
+            self._people[db_people.id] = people
+
+    def _get_people(self, person_id):
+        """
+        Return the identity X{person_id}; C{None} when it's not set.
+        """
+        if not person_id:
+            return None
+        return self._people.get(person_id)
+
+
+class DBCopyBackend(DBBackend):
+    """
+    Database backend that stores the rows of the tables of
+    X{backend} read by L{DBReader}.
+
+    The rows of an issue replace those stored on the output for
+    it, so issues can be copied again.
+
+    @param backend: database backend that stored the issues
+    @type backend: L{DBBackend}
+    """
+    def __init__(self, backend):
+        self.MYSQL_EXT = backend.MYSQL_EXT
+        for name in ('SQLITE_EXT', 'POSTGRESQL_EXT'):
+            if hasattr(backend, name):
+                setattr(self, name, getattr(backend, name))
+
+        self._classes = dict((cls.__storm_table__, cls)
+                             for cls in self.MYSQL_EXT or [])
+
+    def insert_issue_ext(self, store, issue, issue_id):
+        for table, rows in getattr(issue, 'ext_rows', {}).items():
+            cls = self._classes[table]
+            store.find(cls, cls.issue_id == issue_id).remove()
+
+            for values in rows:
+                obj = cls.__new__(cls)
+                for name, value in values.items():
+                    setattr(obj, name, value)
+                obj.issue_id = issue_id
+                store.add(obj)
+        store.flush()
+
+    def insert_comment_ext(self, store, comment, comment_id):
+        pass
+
+    def insert_attachment_ext(self, store, attch, attch_id):
+        pass
+
+    def insert_change_ext(self, store, change, change_id):
+        pass
+
+    def insert_temp_rel(self, store, temp_relationship, trel_id, tracker_id):
+        pass
+
+    def get_last_modification_date(self, store, tracker_id=None):
+        return None
+
+
+def get_ext_columns(cls):
+    """
+    Return the attributes of a table of a backend that are copied:
+    all but the primary key and the issue.
+
+    @param cls: database class of the table
+    @type cls: C{class}
+
+    @rtype: C{list} of C{str}
+    """
+    cls_info = get_cls_info(cls)
+    # Columns are compared by identity; == builds an expression
+    primary_key = set(id(column) for column in cls_info.primary_key)
+    return [name for name, column in cls_info.attributes.items()
+            if name != 'issue_id' and id(column) not in primary_key]
+
+
+def get_db_backend(name):
+    """
+    Return the database backend of the backend X{name}.
+
+    @param name: name of the backend, like C{bg}
+    @type name: C{str}
+
+    @return: the database backend; C{None} when it has none
+    @rtype: L{DBBackend}
+    """
+    module = sys.modules[Backend._get_backend(name).__module__]
+
+    for value in vars(module).values():
+        if inspect.isclass(value) and issubclass(value, DBBackend) and \
+                value.__module__ == module.__name__:
+            return value()
+    return None
+
+
+def get_input_database():
+    """
+    Connect to the input database given on the configuration.
+
+    @return: the input database
+    @rtype: L{storm.database.Database}
+    """
+    if Config.db_driver_in == 'sqlite':
+        return create_database('sqlite:' + Config.db_database_in)
+
+    if Config.db_driver_in == 'postgresql':
+        scheme = 'postgres://'
+    else:
+        scheme = 'mysql://'
+    return create_database(scheme + Config.db_user_in + ':'
+                           + Config.db_password_in + '@'
+                           + Config.db_hostname_in + ':'
+                           + Config.db_port_in + '/'
+                           + Config.db_database_in)
+
+
+def run_db_input():
+    """
+    Send the issues of the input database to the output.
+
+    Only the tracker of X{url} is read when it is set. The tables of
+    X{backend}, if set, are copied too.
+    """
+    backend = None
+    if getattr(Config, 'backend', None):
+        backend = get_db_backend(Config.backend)
+
+    reader = DBReader(get_input_database(), Config.nissues, backend)
+    if backend is not None:
+        backend = DBCopyBackend(backend)
+    bugsdb = get_database(backend)
+
+    try:
+        url = getattr(Config, 'url', None)
+        trackers = reader.get_trackers(url)
+        if not trackers:
+            printout("No trackers found on the input database")
+            return
+
+        for tracker_id, tracker in trackers:
+            printout("Reading issues of %s" % tracker.url)
+            bugsdb.insert_supported_traker(tracker.name, tracker.version)
+            dbtrk = bugsdb.insert_tracker(tracker)
+
+            nissues = 0
+            reader.skipped_relationships = 0
+            for issue in reader.get_issues(tracker_id):
+                bugsdb.insert_issue(issue, dbtrk.id)
+                nissues += 1
+
+            if reader.skipped_relationships:
+                printerr("Warning: %d relationships of issues without a "
+                         "numeric identifier were not copied"
+                         % reader.skipped_relationships)
+
+            bugsdb.store_final_relationships(dbtrk.id)
+            printout("%d issues copied from %s" % (nissues, tracker.url))
+    finally:
+        reader.store.close()
+
+    # Issues must be stored before they are post-processed
+    bugsdb.close()
+
+
+def _values(rows):
+    """
+    Iterate over the rows grouped by L{DBReader._group_by_issue}.
+    """
+    for issue_rows in rows.itervalues():
+        for row in issue_rows:
+            yield row
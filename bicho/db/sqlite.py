@@ -0,0 +1,376 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+SQLite database module
+"""
+
+from storm.locals import create_database
+
+from bicho.config import Config
+from bicho.db.database import DBDatabase, DBTracker, DBPeople, \
+    DBIssue, DBIssuesWatchers, DBIssueRelationship, DBComment, DBAttachment, \
+    DBChange, DBSupportedTracker, DBIssueTempRelationship, \
+    DBTrackerSyncState, convert_mysql_table
+
+
+# Size of the page cache in KiB (negative values are KiB for SQLite)
+SQLITE_CACHE_SIZE = 256 * 1024
+
+# Maximum number of host parameters in a statement on SQLite builds
+# older than 3.32
+SQLITE_MAX_VARIABLE_NUMBER = 999
+
+
+class DBSQLite(DBDatabase):
+    """
+    SQLite database adapter.
+
+    The database is tuned for bulk loads: the journal is written
+    ahead (WAL), commits don't wait for the data to reach the disk
+    and the page cache is large enough to keep the indexes in memory.
+    WAL with X{synchronous=NORMAL} never corrupts the database; at
+    worst, the last commits are lost on a power failure.
+    """
+    multi_row_insert = True
+    max_insert_params = SQLITE_MAX_VARIABLE_NUMBER
+
+    def __init__(self, backend=None, path=None):
+        DBDatabase.__init__(self, backend)
+
+        if path is None:
+            path = Config().db_database_out
+
+        self.database = create_database('sqlite:' + path
+                                        + '?journal_mode=WAL'
+                                        + '&synchronous=NORMAL')
+        self.store = self._create_store()
+        self.store.execute('PRAGMA cache_size = -%d' % SQLITE_CACHE_SIZE)
+        self.store.execute('PRAGMA temp_store = MEMORY')
+
+        clsl = [DBSupportedTrackerSQLite, DBTrackerSQLite, DBPeopleSQLite,
+                DBIssueSQLite, DBIssueRelationshipSQLite,
+                DBCommentSQLite, DBAttachmentSQLite, DBChangeSQLite,
+                DBIssuesWatchersSQLite, DBIssueTempRelationshipSQLite,
+                DBTrackerSyncStateSQLite]
+
+        if backend is not None:
+            clsl.extend(self._get_backend_tables(backend))
+
+        self.create_tables(clsl)
+        self.store.commit()
+
+    def _get_backend_tables(self, backend):
+        """
+        Return the classes of the tables used by the backend.
+
+        Backends may define the SQLite tables on X{SQLITE_EXT}.
+        Otherwise, they are created from the MySQL definitions
+        of X{MYSQL_EXT}.
+
+        @param backend: database backend
+        @type backend: L{DBBackend}
+
+        @return: database classes
+        @rtype: C{list} of L{object}
+        """
+        sqlite_ext = getattr(backend, 'SQLITE_EXT', None)
+        if sqlite_ext is not None:
+            return sqlite_ext
+
+        clsl = []
+        for cls in backend.MYSQL_EXT or []:
+            sqlite_cls = type(cls.__name__ + 'SQLite', (cls,),
+                              {'__sql_table__':
+                               mysql_to_sqlite(cls.__sql_table__)})
+            clsl.append(sqlite_cls)
+        return clsl
+
+    def _get_insert_statement(self, table, columns, nrows,
+                              ignore_duplicates=False):
+        stmt = DBDatabase._get_insert_statement(self, table, columns, nrows)
+        if ignore_duplicates:
+            stmt = stmt.replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1)
+        return stmt
+
+    def _get_first_insert_id(self, nrows):
+        # Rows of a single INSERT get consecutive rowids because
+        # they are always assigned as max(rowid) + 1 and nobody
+        # else writes while the statement runs.
+        last_id = self.store.execute('SELECT last_insert_rowid()').get_one()[0]
+        return last_id - nrows + 1
+
+
+def mysql_to_sqlite(sql):
+    """
+    Convert a MySQL CREATE TABLE statement into SQLite statements.
+
+    @param sql: MySQL CREATE TABLE statement
+    @type sql: C{str}
+
+    @return: SQLite statements, separated by semicolons
+    @rtype: C{str}
+    """
+    return convert_mysql_table(sql, 'INTEGER PRIMARY KEY')
+
+
+class DBSupportedTrackerSQLite(DBSupportedTracker):
+    """
+    SQLite subclass of L{DBSupportedTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS supported_trackers ( \
+                     id INTEGER PRIMARY KEY, \
+                     name VARCHAR(64) NOT NULL, \
+                     version VARCHAR(64) NOT NULL, \
+                     UNIQUE(name, version) \
+                     );'
+
+
+class DBTrackerSQLite(DBTracker):
+    """
+    SQLite subclass of L{DBTracker}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS trackers ( \
+                     id INTEGER PRIMARY KEY, \
+                     url VARCHAR(255) NOT NULL, \
+                     type INTEGER NOT NULL, \
+                     retrieved_on DATETIME NOT NULL, \
+                     UNIQUE(url), \
+                     FOREIGN KEY(type) \
+                       REFERENCES supported_trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     );'
+
+
+class DBTrackerSyncStateSQLite(DBTrackerSyncState):
+    """
+    SQLite subclass of L{DBTrackerSyncState}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS tracker_sync_state ( \
+                     id INTEGER PRIMARY KEY, \
+                     tracker_id INTEGER NOT NULL, \
+                     backend VARCHAR(64) NOT NULL, \
+                     last_modification DATETIME NULL, \
+                     last_issue VARCHAR(255) NULL, \
+                     updated_on DATETIME NULL, \
+                     UNIQUE(tracker_id, backend), \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     );'
+
+
+class DBPeopleSQLite(DBPeople):
+    """
+    SQLite subclass of L{DBPeople}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS people ( \
+                     id INTEGER PRIMARY KEY, \
+                     name VARCHAR(64) NULL, \
+                     email VARCHAR(64) NULL, \
+                     user_id VARCHAR(255) NOT NULL, \
+                     UNIQUE(user_id) \
+                     );'
+
+
+class DBIssueSQLite(DBIssue):
+    """
+    SQLite subclass of L{DBIssue}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues ( \
+                     id INTEGER PRIMARY KEY, \
+                     tracker_id INTEGER NOT NULL, \
+                     issue VARCHAR(255) NOT NULL, \
+                     type VARCHAR(64) NULL, \
+                     summary VARCHAR(255) NOT NULL, \
+                     description TEXT NOT NULL, \
+                     status VARCHAR(64) NOT NULL, \
+                     resolution VARCHAR(64) NULL, \
+                     priority VARCHAR(64) NULL, \
+                     submitted_by INTEGER NOT NULL, \
+                     submitted_on DATETIME NOT NULL, \
+                     assigned_to INTEGER NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
+                     UNIQUE(issue, tracker_id), \
+                     FOREIGN KEY(submitted_by) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(assigned_to) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(tracker_id) \
+                       REFERENCES trackers(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS issues_submitted_idx \
+                       ON issues(submitted_by); \
+                     CREATE INDEX IF NOT EXISTS issues_assigned_idx \
+                       ON issues(assigned_to); \
+                     CREATE INDEX IF NOT EXISTS issues_tracker_idx \
+                       ON issues(tracker_id);'
+
+
+class DBIssuesWatchersSQLite(DBIssuesWatchers):
+    """
+    SQLite subclass of L{DBIssuesWatchers}
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_watchers ( \
+                     id INTEGER PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     person_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, person_id), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(person_id) \
+                       REFERENCES people(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS issue_person_idx2 \
+                       ON issues_watchers(person_id);'
+
+
+class DBIssueRelationshipSQLite(DBIssueRelationship):
+    """
+    SQLite subclass of L{DBIssueRelationship}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS related_to ( \
+                     id INTEGER PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     related_to INTEGER NOT NULL, \
+                     type VARCHAR(64) NOT NULL, \
+                     UNIQUE(issue_id, related_to, type), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(related_to) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS issues_related_idx2 \
+                       ON related_to(related_to);'
+
+
+class DBIssueTempRelationshipSQLite(DBIssueTempRelationship):
+    """
+    SQLite subclass of L{DBIssueTempRelationship}.
+    """
+    __sql_table__ = 'CREATE TEMPORARY TABLE IF NOT EXISTS temp_related_to ( \
+                     id INTEGER PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     related_to VARCHAR(64) NOT NULL, \
+                     type VARCHAR(64) NOT NULL, \
+                     tracker_id INTEGER NOT NULL, \
+                     UNIQUE(issue_id, related_to, type, tracker_id) \
+                     );'
+
+
+class DBCommentSQLite(DBComment):
+    """
+    SQLite subclass of L{DBComment}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS comments ( \
+                     id INTEGER PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     comment_id INTEGER, \
+                     text TEXT NOT NULL, \
+                     submitted_by INTEGER NOT NULL, \
+                     submitted_on DATETIME NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
+                     UNIQUE(fingerprint), \
+                     FOREIGN KEY(submitted_by) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS comments_submitted_idx \
+                       ON comments(submitted_by); \
+                     CREATE INDEX IF NOT EXISTS comments_issue_idx \
+                       ON comments(issue_id);'
+
+
+class DBAttachmentSQLite(DBAttachment):
+    """
+    SQLite subclass of L{DBAttachment}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS attachments ( \
+                     id INTEGER PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     name VARCHAR(64) NOT NULL, \
+                     description TEXT NOT NULL, \
+                     url VARCHAR(255) NOT NULL, \
+                     submitted_by INTEGER, \
+                     submitted_on DATETIME, \
+                     fingerprint CHAR(40) NULL, \
+                     UNIQUE(fingerprint), \
+                     FOREIGN KEY(submitted_by) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS attachments_submitted_idx \
+                       ON attachments(submitted_by); \
+                     CREATE INDEX IF NOT EXISTS attachments_issue_idx \
+                       ON attachments(issue_id);'
+
+
+class DBChangeSQLite(DBChange):
+    """
+    SQLite subclass of L{DBChange}.
+    """
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS changes ( \
+                     id INTEGER PRIMARY KEY, \
+                     issue_id INTEGER NOT NULL, \
+                     field VARCHAR(64) NOT NULL, \
+                     old_value TEXT NOT NULL, \
+                     new_value TEXT NOT NULL, \
+                     changed_by INTEGER NOT NULL, \
+                     changed_on DATETIME NOT NULL, \
+                     fingerprint CHAR(40) NULL, \
+                     UNIQUE(fingerprint), \
+                     FOREIGN KEY(issue_id) \
+                       REFERENCES issues(id) \
+                         ON DELETE CASCADE \
+                         ON UPDATE CASCADE, \
+                     FOREIGN KEY(changed_by) \
+                       REFERENCES people(id) \
+                         ON DELETE SET NULL \
+                         ON UPDATE CASCADE \
+                     ); \
+                     CREATE INDEX IF NOT EXISTS changes_issue_idx \
+                       ON changes(issue_id); \
+                     CREATE INDEX IF NOT EXISTS changes_changed_idx \
+                       ON changes(changed_by);'
@@ -0,0 +1,725 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+HTTP client shared by the backends.
+
+Connections are kept alive and pooled by host, so requests to the
+same tracker don't set up a new TCP and TLS connection each time.
+Responses are requested compressed with gzip or deflate.
+Cookies set by the trackers, like the ones of a login, are kept on
+the client and sent on the next requests.
+
+Responses with an C{ETag} or a C{Last-Modified} header are kept on
+an on-disk cache. When the same URL is requested again, the request
+is conditional and the cached body is used when the server replies
+with C{304 Not Modified}.
+"""
+
+import collections
+import cPickle
+import cStringIO
+import hashlib
+import os
+import tempfile
+import threading
+import urllib2
+import urlparse
+
+import requests
+import requests.adapters
+import requests.structures
+import requests.utils
+
+from bicho.archive import get_archive
+from bicho.config import Config
+from bicho.ratelimit import RateLimiter
+from bicho.retry import retry, NETWORK_POLICY, SERVER_POLICY
+from bicho.utils import printdbg, bicho_cache_dir, run_stats
+
+
+# Seconds to wait for the server to accept the connection or to send
+# data, before giving up
+HTTP_TIMEOUT = 120
+
+# Number of hosts whose connections are pooled, and connections kept
+# alive for each host
+HTTP_POOL_HOSTS = 10
+HTTP_POOL_SIZE = 10
+
+# Encodings accepted on the responses. Bodies are decompressed as
+# they are read
+HTTP_ACCEPT_ENCODING = 'gzip, deflate'
+
+# Maximum number of requests sent at once to a host
+HTTP_HOST_REQUESTS = 4
+
+# Maximum size of the on-disk cache of responses, in megabytes
+HTTP_CACHE_SIZE = 256
+
+# Headers of a cached response that don't apply to its stored body
+HTTP_CACHE_SKIP_HEADERS = ('content-encoding', 'content-length',
+                           'transfer-encoding')
+
+# Status codes of responses that are retried
+HTTP_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+
+class ServerBusy(Exception):
+    """
+    The server answered with an error that may go away by retrying.
+
+    @param response: response of the server
+    @type response: L{requests.Response}
+    """
+    def __init__(self, response):
+        Exception.__init__(self, "HTTP %s %s" % (response.status_code,
+                                                 response.url))
+        self.response = response
+
+
+class HTTPClient(object):
+    """
+    HTTP client with a pool of persistent connections per host.
+
+    L{get}, L{post} and L{request} return L{requests.Response}
+    objects. L{urlopen} is a replacement of C{urllib2.urlopen} for
+    the backends written for it: it returns a file-like object and
+    raises C{urllib2.HTTPError} and C{urllib2.URLError}.
+
+    GET requests are revalidated against X{cache}, when it's set.
+    Responses are recorded on X{archive}, or read from it when it's
+    being replayed. Requests sent to the network wait for
+    X{rate_limiter}, if any, and for one of the X{host_requests}
+    slots of their host, so threads sharing the client don't flood
+    a tracker.
+
+    @param timeout: seconds to wait for the server
+    @type timeout: C{int}
+    @param cache: cache of responses
+    @type cache: L{HTTPCache}
+    @param archive: archive of the traffic
+    @type archive: L{bicho.archive.TrafficArchive}
+    @param rate_limiter: rate limiter of the requests
+    @type rate_limiter: L{bicho.ratelimit.RateLimiter}
+    @param host_requests: maximum number of requests sent at once
+     to a host
+    @type host_requests: C{int}
+    """
+    def __init__(self, timeout=HTTP_TIMEOUT, cache=None, archive=None,
+                 rate_limiter=None, host_requests=HTTP_HOST_REQUESTS):
+        self.timeout = timeout
+        self.cache = cache
+        self.archive = archive
+        self.rate_limiter = rate_limiter
+        self.host_requests = max(host_requests, 1)
+        self._host_slots = {}
+        self._host_slots_lock = threading.Lock()
+        self.session = requests.Session()
+
+        # Every request in flight to a host may keep a connection
+        pool_size = max(HTTP_POOL_SIZE, self.host_requests)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_HOSTS,
+                                                pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Accept-Encoding'] = HTTP_ACCEPT_ENCODING
+
+    @property
+    def cookies(self):
+        """
+        Cookies kept by the client.
+
+        @rtype: L{requests.cookies.RequestsCookieJar}
+        """
+        return self.session.cookies
+
+    def set_auth(self, user, password):
+        """
+        Send the given credentials with HTTP basic authentication
+        on every request.
+        """
+        self.session.auth = (user, password)
+
+    def request(self, method, url, **kwargs):
+        """
+        Send a request.
+
+        Takes the arguments of L{requests.Session.request}. Requests
+        that fail to reach the server or that get a response of an
+        overloaded server are retried; see L{bicho.retry}.
+
+        The time spent is accounted to the C{fetch} phase of
+        L{bicho.utils.run_stats}, as the bytes of the body; those of
+        streamed bodies are accounted as they are read.
+
+        @param method: HTTP method
+        @type method: C{str}
+        @param url: URL to request
+        @type url: C{str}
+
+        @return: the response
+        @rtype: L{requests.Response}
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        printdbg("HTTP %s %s" % (method, url))
+
+        with run_stats.phase('fetch'):
+            response = self._request(method, url, **kwargs)
+
+        if not _is_streamed(response):
+            run_stats.add_bytes(len(response.content))
+        return response
+
+    def _request(self, method, url, **kwargs):
+        """
+        Send a request, replaying or recording it on the archive.
+        """
+        body = _get_request_body(kwargs)
+        if self.archive is not None and self.archive.replaying:
+            return _build_response(*self.archive.replay('http', url, method, body))
+
+        try:
+            response = retry(lambda: self._send(method, url, **kwargs),
+                             _get_retry_policy)
+        except ServerBusy, e:
+            response = e.response
+
+        if self.archive is not None:
+            # The body is recorded decompressed
+            headers = dict((name, value)
+                           for name, value in response.headers.items()
+                           if name.lower() not in HTTP_CACHE_SKIP_HEADERS)
+            self.archive.record((response.url, response.status_code,
+                                 response.reason, headers,
+                                 response.content),
+                                'http', url, method, body)
+        return response
+
+    def _send(self, method, url, **kwargs):
+        """
+        Send a request to the network, once.
+
+        @raise ServerBusy: when the response may change by retrying
+        """
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(url)
+
+        with self._get_host_slots(url):
+            if method != 'GET' or self.cache is None:
+                response = self.session.request(method, url, **kwargs)
+            else:
+                response = self._cached_request(url, **kwargs)
+
+        # GitHub answers 403 when its rate limit is exhausted; the
+        # rate limiter waits for the reset before the retry
+        busy = response.status_code in HTTP_RETRY_STATUS or \
+            (response.status_code == 403 and
+             response.headers.get('x-ratelimit-remaining') == '0')
+
+        # The last busy response is returned when the retries are
+        # exhausted, so its body is kept
+        if busy and _is_streamed(response):
+            _read_body(response)
+
+        # Streamed bodies are counted once read; see HTTPResponse.close
+        if not _is_streamed(response):
+            run_stats.add_transferred(_get_transferred_bytes(response))
+
+        if self.rate_limiter is not None:
+            self.rate_limiter.update(url, response.status_code,
+                                     response.headers)
+
+        if busy:
+            raise ServerBusy(response)
+        return response
+
+    def _get_host_slots(self, url):
+        """
+        Return the semaphore limiting the requests sent to the host
+        of X{url}.
+        """
+        host = urlparse.urlparse(url).netloc
+        with self._host_slots_lock:
+            if host not in self._host_slots:
+                self._host_slots[host] = threading.BoundedSemaphore(self.host_requests)
+            return self._host_slots[host]
+
+    def _cached_request(self, url, **kwargs):
+        """
+        Send a GET request, revalidating the cached response, if any.
+
+        Bodies of streamed responses that can be cached are read at
+        once to store them, so only the rest are streamed.
+        """
+        headers = dict(kwargs.pop('headers', None) or {})
+        key = self.cache.get_key(url, self._get_auth_scope(headers))
+
+        entry = self.cache.get(key)
+        if entry is not None:
+            if entry.etag:
+                headers['If-None-Match'] = entry.etag
+            if entry.last_modified:
+                headers['If-Modified-Since'] = entry.last_modified
+
+        response = self.session.request('GET', url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            printdbg("HTTP 304 %s, using the cached response" % url)
+            _read_body(response)
+            return entry.to_response(response)
+        elif response.status_code == 200:
+            self.cache.store(key, response)
+        return response
+
+    def _get_auth_scope(self, headers):
+        """
+        Identify the credentials the request is sent with.
+
+        Responses may depend on who requests them, so they are only
+        reused for requests sent with the same credentials.
+        """
+        scope = [str(getattr(Config, 'backend_user', None))]
+        if self.session.auth:
+            scope.append(str(self.session.auth[0]))
+        for name, value in headers.items():
+            if name.lower() == 'authorization':
+                scope.append(hashlib.sha1(value).hexdigest())
+        return '\0'.join(scope)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def urlopen(self, url, data=None, headers=None, stream=False):
+        """
+        Open the URL as C{urllib2.urlopen} does.
+
+        The request is a POST when X{data} is given. With X{stream},
+        the body is read from the network as the response is read,
+        instead of when it arrives; the response must be closed to
+        release the connection.
+
+        @param url: URL to open, or a C{urllib2.Request}
+        @type url: C{str}
+        @param data: encoded data of the POST request
+        @type data: C{str}
+        @param headers: extra HTTP headers
+        @type headers: C{dict}
+        @param stream: stream the body of the response
+        @type stream: C{bool}
+
+        @return: the response
+        @rtype: L{HTTPResponse}
+
+        @raise urllib2.HTTPError: when the server returns an error
+        @raise urllib2.URLError: when the server can't be reached
+        """
+        headers = dict(headers or {})
+
+        if isinstance(url, urllib2.Request):
+            headers.update(url.header_items())
+            if data is None:
+                data = url.get_data()
+            url = url.get_full_url()
+
+        method = 'POST' if data is not None else 'GET'
+
+        try:
+            response = self.request(method, url, data=data, headers=headers,
+                                    stream=stream)
+        except requests.RequestException, e:
+            raise urllib2.URLError(e)
+
+        if response.status_code >= 400:
+            raise urllib2.HTTPError(response.url, response.status_code,
+                                    response.reason, response.headers,
+                                    cStringIO.StringIO(_read_body(response)))
+        return HTTPResponse(response, stream)
+
+
+class HTTPResponse(object):
+    """
+    File-like response returned by L{HTTPClient.urlopen}.
+
+    The body is read when the response arrives, so the connection
+    goes back to the pool at once. Streamed bodies are read, and
+    decompressed, from the connection as they are read from the
+    response instead; that keeps the connection until the response
+    is closed.
+
+    @param response: response of the request
+    @type response: L{requests.Response}
+    @param stream: stream the body
+    @type stream: C{bool}
+    """
+    def __init__(self, response, stream=False):
+        self.response = response
+        self.code = response.status_code
+        self.headers = response.headers
+
+        # Bodies of recorded or cached responses are already read
+        self._streamed = stream and _is_streamed(response)
+        if self._streamed:
+            response.raw.decode_content = True
+            self._body = response.raw
+        else:
+            self._body = cStringIO.StringIO(response.content)
+
+    def read(self, size=-1):
+        if not self._streamed:
+            return self._body.read(size)
+
+        if size < 0:
+            data = self._body.read()
+        else:
+            data = self._body.read(size)
+        run_stats.add_bytes(len(data))
+        return data
+
+    def readline(self, size=-1):
+        line = self._body.readline(size)
+        if self._streamed:
+            run_stats.add_bytes(len(line))
+        return line
+
+    def readlines(self):
+        return list(self)
+
+    def __iter__(self):
+        return iter(self.readline, '')
+
+    def info(self):
+        return self.headers
+
+    def getcode(self):
+        return self.code
+
+    def geturl(self):
+        return self.response.url
+
+    def close(self):
+        if self._streamed:
+            if hasattr(self._body, 'tell'):
+                run_stats.add_transferred(self._body.tell())
+            self.response.close()
+        else:
+            self._body.close()
+
+
+class HTTPCacheEntry(object):
+    """
+    Response stored on the cache.
+
+    @param url: URL of the response
+    @type url: C{str}
+    @param headers: headers of the response
+    @type headers: C{dict}
+    @param body: decoded body of the response
+    @type body: C{str}
+    """
+    def __init__(self, url, headers, body):
+        self.url = url
+        self.headers = headers
+        self.body = body
+
+    @property
+    def etag(self):
+        return self.headers.get('etag')
+
+    @property
+    def last_modified(self):
+        return self.headers.get('last-modified')
+
+    def to_response(self, response):
+        """
+        Build a response with the body of the entry.
+
+        Headers of X{response}, the one that revalidated the entry,
+        replace the stored ones; that keeps up to date headers like
+        the remaining rate limit of GitHub.
+
+        @param response: C{304 Not Modified} response
+        @type response: L{requests.Response}
+
+        @rtype: L{requests.Response}
+        """
+        headers = dict(self.headers)
+        for name, value in response.headers.items():
+            if name.lower() not in HTTP_CACHE_SKIP_HEADERS:
+                headers[name.lower()] = value
+
+        cached = _build_response(self.url, 200, 'OK', headers, self.body)
+        cached.request = response.request
+        cached.connection = response.connection
+        cached.elapsed = response.elapsed
+        cached.from_cache = True
+        return cached
+
+
+class HTTPCache(object):
+    """
+    On-disk cache of HTTP responses.
+
+    Only responses that can be revalidated, the ones with C{ETag}
+    or C{Last-Modified} headers, are stored. Each one is kept on
+    its own file, named after its URL and the credentials of the
+    request. When the files take more than X{max_size} bytes, the
+    least recently used ones are removed.
+
+    @param path: directory of the cache
+    @type path: C{str}
+    @param max_size: maximum size of the cache in bytes
+    @type max_size: C{int}
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self._lock = threading.Lock()
+
+        if not os.path.isdir(path):
+            os.makedirs(path, 0700)
+
+        # Size of the entries, from the least to the most recently used
+        self._entries = collections.OrderedDict()
+        self._size = 0
+
+        files = []
+        for name in os.listdir(path):
+            try:
+                st = os.stat(os.path.join(path, name))
+            except OSError:
+                continue
+            files.append((st.st_mtime, name, st.st_size))
+
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self._size += size
+
+    def get_key(self, url, scope):
+        """
+        Return the key of the response of X{url} requested with
+        the credentials X{scope}.
+        """
+        return hashlib.sha1(url + '\0' + scope).hexdigest()
+
+    def get(self, key):
+        """
+        Return the entry of X{key}; C{None} when it's not cached.
+
+        @rtype: L{HTTPCacheEntry}
+        """
+        with self._lock:
+            if key not in self._entries:
+                return None
+            path = os.path.join(self.path, key)
+
+            try:
+                with open(path, 'rb') as f:
+                    entry = cPickle.load(f)
+                os.utime(path, None)
+            except (IOError, OSError, EOFError, cPickle.UnpicklingError):
+                self._remove(key)
+                return None
+
+            self._entries[key] = self._entries.pop(key)
+            return entry
+
+    def store(self, key, response):
+        """
+        Store the response on X{key}, when it can be revalidated.
+
+        @param response: response to store
+        @type response: L{requests.Response}
+        """
+        if 'etag' not in response.headers and \
+                'last-modified' not in response.headers:
+            return
+        if 'no-store' in response.headers.get('cache-control', ''):
+            return
+
+        headers = dict((name.lower(), value)
+                       for name, value in response.headers.items()
+                       if name.lower() not in HTTP_CACHE_SKIP_HEADERS)
+        entry = HTTPCacheEntry(response.url, headers, response.content)
+        data = cPickle.dumps(entry, cPickle.HIGHEST_PROTOCOL)
+
+        if len(data) > self.max_size:
+            return
+
+        with self._lock:
+            # Written on a temporary file, so readers never see
+            # a partial entry
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, prefix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.rename(tmp_path, os.path.join(self.path, key))
+            except (IOError, OSError), e:
+                printdbg("Error caching %s: %s" % (response.url, e))
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return
+
+            self._size -= self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            self._size += len(data)
+            self._evict()
+
+    def _evict(self):
+        """
+        Remove the least recently used entries until the cache
+        fits on its maximum size.
+        """
+        while self._size > self.max_size and self._entries:
+            key = next(iter(self._entries))
+            self._remove(key)
+
+    def _remove(self, key):
+        self._size -= self._entries.pop(key, 0)
+        try:
+            os.remove(os.path.join(self.path, key))
+        except OSError:
+            pass
+
+
+def _build_response(url, status_code, reason, headers, content):
+    """
+    Build a response that was not read from the network.
+
+    @rtype: L{requests.Response}
+    """
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response.reason = reason
+    response.headers = requests.structures.CaseInsensitiveDict(headers)
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    response._content = content
+    return response
+
+
+def _is_streamed(response):
+    """
+    Return whether the body of the response is still to be read
+    from the network.
+    """
+    return response.raw is not None and not response._content_consumed
+
+
+def _read_body(response):
+    """
+    Read the body of the response, releasing its connection even
+    when reading it fails.
+
+    @rtype: C{str}
+    """
+    try:
+        return response.content
+    finally:
+        response.close()
+
+
+def _get_transferred_bytes(response):
+    """
+    Return the bytes of the body of the response read from the
+    network, before being decompressed.
+    """
+    if getattr(response, 'from_cache', False):
+        # The body of the 304 response that revalidated it is empty
+        return 0
+    try:
+        return response.raw.tell()
+    except AttributeError:
+        return len(response.content)
+
+
+def _get_retry_policy(error):
+    """
+    Return the retry policy of an error of a request.
+    """
+    if isinstance(error, ServerBusy):
+        return SERVER_POLICY
+    elif isinstance(error, (requests.ConnectionError, requests.Timeout)):
+        return NETWORK_POLICY
+    return None
+
+
+def _get_request_body(kwargs):
+    """
+    Return the parameters and data sent on a request, as a string
+    that identifies them.
+    """
+    body = []
+    for name in ('params', 'data', 'json'):
+        value = kwargs.get(name)
+        if isinstance(value, dict):
+            value = sorted(value.items())
+        body.append(repr(value))
+    return ' '.join(body)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_http_client():
+    """
+    Return the HTTP client shared by the backends.
+
+    @rtype: L{HTTPClient}
+    """
+    global _client
+
+    with _client_lock:
+        if _client is None:
+            archive = get_archive()
+
+            cache = None
+            cache_size = getattr(Config, 'http_cache_size', HTTP_CACHE_SIZE)
+            if cache_size > 0 and not (archive and archive.replaying):
+                cache = HTTPCache(os.path.join(bicho_cache_dir(), 'http'),
+                                  cache_size * 1024 * 1024)
+            rate_limiter = RateLimiter(getattr(Config, 'delay', 0) or 0)
+            _client = HTTPClient(getattr(Config, 'http_timeout', HTTP_TIMEOUT),
+                                 cache, archive, rate_limiter,
+                                 get_host_requests())
+        return _client
+
+
+def get_host_requests():
+    """
+    Return the maximum number of requests sent at once to a host.
+
+    It's X{host_requests} when set. Otherwise, it's
+    L{HTTP_HOST_REQUESTS}, unless the fetch engine is gevent: its
+    workers are meant to keep many requests in flight, so each of
+    them gets a slot.
+
+    @rtype: C{int}
+    """
+    host_requests = getattr(Config, 'host_requests', None)
+    if host_requests is not None:
+        return host_requests
+
+    if getattr(Config, 'fetch_engine', None) == 'gevent':
+        return max(HTTP_HOST_REQUESTS, getattr(Config, 'fetch_workers', 1) or 1)
+    return HTTP_HOST_REQUESTS
@@ -47,13 +47,31 @@ def main():
         printerr(str(e))
         sys.exit(2)
 
-    try:
-        backend = Backend.create_backend(Config.backend)
-    except ImportError, e:
-        printerr("Backend ''" + Config.backend + "'' doesn't exist. " + str(e))
-        sys.exit(2)
-    printdbg("Bicho object created, options and backend initialized")
-    backend.run()
+    if getattr(Config, 'fetch_engine', None) == 'gevent':
+        # The standard library is patched by the bicho script before
+        # anything is imported; it's too late to do it here
+        from bicho.pool import is_green_patched
+        if not is_green_patched():
+            printerr("The gevent fetch engine needs the standard library "
+                     "patched by gevent before Bicho is imported")
+            sys.exit(2)
+
+    if Config.input == 'db':
+        # Issues are read from a database instead of a tracker
+        from bicho.db.reader import run_db_input
+        run_db_input()
+    else:
+        try:
+            backend = Backend.create_backend(Config.backend)
+        except ImportError, e:
+            printerr("Backend ''" + Config.backend + "'' doesn't exist. " + str(e))
+            sys.exit(2)
+        printdbg("Bicho object created, options and backend initialized")
+        backend.run()
+
+    # Pending issues must be stored before they are post-processed
+    from bicho.db.database import close_databases
+    close_databases()
 
     if Config.logtable:
         try:
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Pool of workers that fetch the details of the issues.
+
+Backends fetch the comments, changes or other details of each issue
+with follow-up requests. The pool sends them concurrently, while the
+backend gets the results in the order of the issues, so they are
+stored in the same order as when fetched one by one.
+
+Workers are threads, or greenlets when gevent is the fetch engine.
+"""
+
+import atexit
+import collections
+import itertools
+import Queue
+import sys
+import threading
+
+from bicho.config import Config
+
+
+# Number of pending tasks per worker
+FETCH_POOL_WINDOW = 2
+
+
+class FetchPoolClosed(Exception):
+    """
+    The pool was closed before running the task.
+    """
+    pass
+
+
+class FetchTask(object):
+    """
+    Call of a function run by the pool.
+    """
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.exc_info = None
+        self._done = threading.Event()
+
+    def run(self):
+        try:
+            self.result = self.func(*self.args)
+        except Exception:
+            self.exc_info = sys.exc_info()
+        self._done.set()
+
+    def cancel(self):
+        try:
+            raise FetchPoolClosed()
+        except FetchPoolClosed:
+            self.exc_info = sys.exc_info()
+        self._done.set()
+
+    def get(self):
+        """
+        Wait for the task and return its result, raising the error
+        of the function if it failed.
+        """
+        self._done.wait()
+        if self.exc_info is not None:
+            raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+        return self.result
+
+
+class FetchPool(object):
+    """
+    Pool of X{workers} threads.
+
+    With a single worker, functions run on the calling thread, as
+    they did before the pool existed.
+
+    @param workers: number of threads
+    @type workers: C{int}
+    """
+    def __init__(self, workers):
+        self.workers = max(workers, 1)
+        self._tasks = Queue.Queue()
+        self._threads = []
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def map(self, func, *iterables):
+        """
+        Iterate over the results of X{func} applied to the items of
+        X{iterables}, in their order.
+
+        Items are read as the results are consumed, so only a few
+        tasks per worker are pending at once.
+
+        @param func: function to run
+        @type func: C{callable}
+
+        @return: the results
+        @rtype: C{iterator}
+        """
+        if self.workers == 1:
+            for args in itertools.izip(*iterables):
+                yield func(*args)
+            return
+
+        pending = collections.deque()
+        for args in itertools.izip(*iterables):
+            pending.append(self._submit(func, args))
+
+            if len(pending) >= self.workers * FETCH_POOL_WINDOW:
+                yield pending.popleft().get()
+
+        while pending:
+            yield pending.popleft().get()
+
+    def close(self):
+        """
+        Stop the threads once they finish their current tasks.
+        Pending tasks are cancelled.
+        """
+        with self._lock:
+            self._closed = True
+            threads = self._threads
+            self._threads = []
+
+        for thread in threads:
+            self._tasks.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _submit(self, func, args):
+        """
+        Run X{func} on a worker.
+
+        @return: the task, whose C{get} method returns the result
+        @rtype: L{FetchTask}
+        """
+        self._start()
+
+        task = FetchTask(func, args)
+        self._tasks.put(task)
+        return task
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._run)
+                thread.daemon = True
+                thread.start()
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                return
+            elif self._closed:
+                task.cancel()
+            else:
+                task.run()
+
+
+class GreenFetchPool(FetchPool):
+    """
+    Pool of X{workers} greenlets, run by the event loop of gevent.
+
+    Greenlets are cheap, so hundreds of requests can be kept in
+    flight on a single thread. The standard library must be patched
+    by gevent before Bicho is imported, as the bicho script does;
+    see L{is_green_patched}.
+
+    @param workers: number of greenlets
+    @type workers: C{int}
+    """
+    def __init__(self, workers):
+        import gevent.pool
+
+        FetchPool.__init__(self, workers)
+        self._group = gevent.pool.Pool(self.workers)
+
+    def close(self):
+        self._group.kill()
+
+    def _submit(self, func, args):
+        # Blocks while all the greenlets are busy
+        return self._group.spawn(func, *args)
+
+
+def is_green_patched():
+    """
+    Return whether gevent patched the blocking calls of the standard
+    library, like sockets or sleeps, so they yield to its event loop.
+    """
+    try:
+        from gevent import monkey
+    except ImportError:
+        return False
+    return monkey.is_module_patched('socket')
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_fetch_pool():
+    """
+    Return the pool shared by the backends, with X{fetch_workers}
+    threads or, when X{fetch_engine} is C{gevent}, greenlets.
+
+    @rtype: L{FetchPool}
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            workers = getattr(Config, 'fetch_workers', 1) or 1
+            if getattr(Config, 'fetch_engine', None) == 'gevent':
+                _pool = GreenFetchPool(workers)
+            else:
+                _pool = FetchPool(workers)
+            # Threads must be stopped before the interpreter shuts down
+            atexit.register(_pool.close)
+        return _pool
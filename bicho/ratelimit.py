@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Rate limiting of the requests sent to the trackers.
+
+Each host has its own token bucket. The time between requests
+starts at X{delay} and adapts to the responses of the server: it
+grows when the server asks to slow down and shrinks back while the
+server answers fine. It never goes below X{delay}, so the delay
+given by the user is always respected.
+"""
+
+import calendar
+import email.utils
+import threading
+import time
+import urlparse
+
+from bicho.utils import printdbg
+
+
+# Requests that can be sent at once to a host after being idle
+RATE_LIMIT_BURST = 3
+
+# Maximum time between requests, in seconds
+RATE_LIMIT_MAX_INTERVAL = 300
+
+# Factor applied to the time between requests after a healthy
+# response and after the server asks to slow down
+RATE_LIMIT_SPEEDUP = 0.9
+RATE_LIMIT_BACKOFF = 2
+
+# Status codes of servers asking to slow down
+RATE_LIMIT_STATUS = (429, 503)
+
+
+class HostRateLimiter(object):
+    """
+    Token bucket limiting the requests sent to a host.
+
+    A token is taken for each request. Tokens are added one each
+    X{interval} seconds, up to X{burst} tokens. Besides, the host
+    can be blocked until a given time, like the one of a
+    C{Retry-After} header.
+
+    @param interval: initial and minimum time between requests,
+     in seconds
+    @type interval: C{float}
+    @param burst: maximum number of tokens
+    @type burst: C{int}
+    """
+    def __init__(self, interval, burst=RATE_LIMIT_BURST):
+        self.interval = float(interval)
+        self.min_interval = self.interval
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.time()
+        self.blocked_until = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a request can be sent.
+        """
+        with self._lock:
+            now = time.time()
+            self._refill(now)
+
+            wait = max(0, self.blocked_until - now)
+            if self.tokens < 1:
+                wait = max(wait, (1 - self.tokens) * self.interval)
+            # Tokens may go below zero; they are owed by the
+            # requests waiting for them
+            self.tokens -= 1
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def update(self, status, headers):
+        """
+        Adapt the rate to a response of the host.
+
+        @param status: status code of the response
+        @type status: C{int}
+        @param headers: headers of the response
+        @type headers: C{dict}
+        """
+        now = time.time()
+
+        with self._lock:
+            retry_after = _parse_retry_after(headers.get('retry-after'), now)
+
+            if status in RATE_LIMIT_STATUS:
+                self.interval = min(max(self.interval * RATE_LIMIT_BACKOFF, 1),
+                                    RATE_LIMIT_MAX_INTERVAL)
+                self._block(now + (retry_after or self.interval))
+                return
+
+            if retry_after:
+                self._block(now + retry_after)
+
+            if status < 400:
+                self.interval = max(self.interval * RATE_LIMIT_SPEEDUP,
+                                    self.min_interval)
+
+            remaining = _parse_number(headers.get('x-ratelimit-remaining'))
+            reset = _parse_number(headers.get('x-ratelimit-reset'))
+            if remaining is None or reset is None:
+                return
+
+            # The reset is a timestamp on GitHub, but some servers
+            # send the number of seconds left
+            if reset < now - 365 * 24 * 3600:
+                reset += now
+
+            if remaining < 1:
+                self._block(reset)
+            else:
+                # Spread the requests left until the reset
+                self.interval = min(max(self.interval,
+                                        (reset - now) / remaining),
+                                    RATE_LIMIT_MAX_INTERVAL)
+
+    def _refill(self, now):
+        if self.interval > 0:
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.updated) / self.interval)
+        else:
+            self.tokens = self.burst
+        self.updated = now
+
+    def _block(self, until):
+        if until > self.blocked_until:
+            printdbg("Server asked to wait %.1f seconds" % (until - time.time()))
+            self.blocked_until = until
+
+
+class RateLimiter(object):
+    """
+    Rate limiter of the requests sent to each host.
+
+    @param delay: initial and minimum time between requests to a
+     host, in seconds
+    @type delay: C{float}
+    """
+    def __init__(self, delay):
+        self.delay = delay
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url):
+        """
+        Wait until a request to X{url} can be sent.
+        """
+        self._get_host(url).acquire()
+
+    def update(self, url, status, headers):
+        """
+        Adapt the rate of the host of X{url} to a response.
+        """
+        self._get_host(url).update(status, headers)
+
+    def _get_host(self, url):
+        host = urlparse.urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = HostRateLimiter(self.delay)
+            return self._hosts[host]
+
+
+def _parse_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _parse_retry_after(value, now):
+    """
+    Return the seconds to wait given by a C{Retry-After} header,
+    which are either a number or an HTTP date.
+    """
+    if value is None:
+        return None
+
+    seconds = _parse_number(value)
+    if seconds is not None:
+        return max(seconds, 0)
+
+    date = email.utils.parsedate(value)
+    if date is None:
+        return None
+    return max(calendar.timegm(date) - now, 0)
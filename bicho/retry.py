@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2007-2011  GSyC/LibreSoft, Universidad Rey Juan Carlos
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Retries of the requests sent to the trackers.
+
+Failed requests are retried with exponential backoff and jitter.
+Each kind of error has its own policy, and the time spent retrying
+a request is bounded by X{retry_max_time}.
+"""
+
+import random
+import time
+
+from bicho.config import Config
+from bicho.utils import printdbg, run_stats
+
+
+# Maximum number of seconds spent retrying a request
+RETRY_MAX_TIME = 600
+
+
+class RetryPolicy(object):
+    """
+    How the requests failed with a kind of error are retried.
+
+    The wait before the n-th retry is drawn between the half and
+    the whole of C{min_wait * 2 ** n}, bounded by X{max_wait}.
+
+    @param name: name of the kind of error
+    @type name: C{str}
+    @param max_retries: maximum number of retries
+    @type max_retries: C{int}
+    @param min_wait: wait before the first retry, in seconds
+    @type min_wait: C{float}
+    @param max_wait: maximum wait between retries, in seconds
+    @type max_wait: C{float}
+    """
+    def __init__(self, name, max_retries, min_wait, max_wait):
+        self.name = name
+        self.max_retries = max_retries
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+
+    def get_wait(self, retry):
+        """
+        Return the seconds to wait before the retry number X{retry},
+        starting on zero.
+        """
+        wait = min(self.max_wait, self.min_wait * 2 ** retry)
+        return wait / 2.0 + random.uniform(0, wait / 2.0)
+
+
+# Errors reaching the server, like timeouts or refused connections
+NETWORK_POLICY = RetryPolicy('network', 8, 1, 60)
+
+# Servers that are overloaded or ask to slow down
+SERVER_POLICY = RetryPolicy('server', 6, 2, 120)
+
+
+def retry(func, get_policy, max_time=None):
+    """
+    Call X{func} until it succeeds.
+
+    When X{func} raises an error, X{get_policy} gives the policy
+    to retry it; errors without policy are raised at once. The last
+    error is raised when the retries of its policy are exhausted or
+    when the next retry would exceed X{max_time} seconds.
+
+    Retries are counted on L{bicho.utils.run_stats}.
+
+    @param func: function to call, without arguments
+    @type func: C{callable}
+    @param get_policy: function that returns the L{RetryPolicy} of
+     an error, or C{None}
+    @type get_policy: C{callable}
+    @param max_time: maximum number of seconds spent retrying;
+     X{retry_max_time} by default
+    @type max_time: C{int}
+
+    @return: the value returned by X{func}
+    """
+    if max_time is None:
+        max_time = getattr(Config, 'retry_max_time', RETRY_MAX_TIME)
+
+    start = time.time()
+    retries = {}
+
+    while True:
+        try:
+            return func()
+        except Exception, e:
+            policy = get_policy(e)
+            if policy is None:
+                raise
+
+            n = retries.get(policy.name, 0)
+            wait = policy.get_wait(n)
+            if n >= policy.max_retries or \
+                    time.time() - start + wait > max_time:
+                printdbg("Giving up after %d retries: %s" % (n, e))
+                run_stats.add_retry(policy.name + ' failed')
+                raise
+
+            retries[policy.name] = n + 1
+            run_stats.add_retry(policy.name)
+            printdbg("%s; retrying in %.1f seconds" % (e, wait))
+            time.sleep(wait)
@@ -22,12 +22,15 @@
 #
 
 import cgi
+import collections
+import contextlib
 import errno
 import os
-import random
 import sys
+import threading
 import time
 import urllib
+import xml.sax
 
 from config import Config
 
@@ -93,13 +96,6 @@ def url_get_attr(url, attr=None):
 
     return None
 
-def rdelay():
-    # it adds a random delay
-    random.seed()
-    if Config.delay:
-        printdbg("delay")
-        time.sleep(random.randint(0,20))
-
 _dirs = {}
 
 def create_dir(dir):
@@ -127,6 +123,20 @@ def bicho_dot_dir():
 
     return dot_dir
 
+
+def bicho_cache_dir():
+    try:
+        return _dirs['cache']
+    except KeyError:
+        pass
+
+    cache_dir = os.path.join(bicho_dot_dir(), "cache")
+    create_dir(cache_dir)
+
+    _dirs['cache'] = cache_dir
+
+    return cache_dir
+
 # http://stackoverflow.com/questions/8733233/filtering-out-certain-bytes-in-python
 def valid_XML_char_ordinal(i):
     return (
@@ -136,3 +146,176 @@ def valid_XML_char_ordinal(i):
             or 0xE000 <= i <= 0xFFFD
             or 0x10000 <= i <= 0x10FFFF
     )
+
+
+# Bytes that can't be on an XML document, whatever its encoding
+INVALID_XML_BYTES = ''.join(chr(i) for i in range(0x20)
+                            if not valid_XML_char_ordinal(i))
+
+# Number of bytes read on each step of the parsing of a document
+XML_CHUNK_SIZE = 64 * 1024
+
+
+def parse_xml_stream(f, handler, chunk_size=XML_CHUNK_SIZE):
+    """
+    Parse an XML document with a SAX handler, as it is read.
+
+    The document is fed to the parser in chunks of X{chunk_size}
+    bytes, so it's never fully in memory and it's parsed while the
+    rest is downloaded. Bytes that can't be on XML documents are
+    removed from each chunk.
+
+    @param f: file-like object with the document
+    @param handler: SAX handler
+    @type handler: L{xml.sax.handler.ContentHandler}
+    @param chunk_size: bytes read on each step
+    @type chunk_size: C{int}
+    """
+    parser = xml.sax.make_parser()
+    parser.setContentHandler(handler)
+
+    while True:
+        with run_stats.phase('fetch'):
+            chunk = f.read(chunk_size)
+        if not chunk:
+            break
+
+        with run_stats.phase('parse'):
+            parser.feed(chunk.translate(None, INVALID_XML_BYTES))
+
+    with run_stats.phase('parse'):
+        parser.close()
+
+
+class LRUCache(object):
+    """
+    Mapping that keeps up to X{size} entries, discarding the least
+    recently used ones when it is full.
+    """
+    def __init__(self, size):
+        self.size = size
+        self._items = collections.OrderedDict()
+
+    def get(self, key, default=None):
+        try:
+            value = self._items.pop(key)
+        except KeyError:
+            return default
+        self._items[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._items.pop(key, None)
+        self._items[key] = value
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def clear(self):
+        self._items.clear()
+
+
+class RunStats(object):
+    """
+    Throughput of a run: issues stored, bytes fetched, bytes
+    transferred by HTTP (compressed, if so), time spent on each phase
+    (fetch, parse, store) of the backend and requests retried.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        self.start = time.time()
+        self.nissues = 0
+        self.nbytes = 0
+        self.ntransferred = 0
+        self.phases = collections.OrderedDict()
+        self.retries = collections.OrderedDict()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Account the time spent running the block to the given phase.
+
+        Phases may be nested, like the requests sent while parsing an
+        issue; the time of the inner phase is not accounted to the
+        outer one.
+        """
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+
+        # Time spent on the phases nested in this one
+        nested = [0.0]
+        stack.append(nested)
+        start = time.time()
+        try:
+            yield
+        finally:
+            total = time.time() - start
+            stack.pop()
+            if stack:
+                stack[-1][0] += total
+
+            with self._lock:
+                elapsed, ncalls = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (elapsed + total - nested[0],
+                                     ncalls + 1)
+
+    def timed(self, name, func):
+        """
+        Return a function that runs X{func}, accounting its time to
+        the given phase.
+        """
+        def run(*args, **kwargs):
+            with self.phase(name):
+                return func(*args, **kwargs)
+        return run
+
+    def add_bytes(self, nbytes):
+        with self._lock:
+            self.nbytes += nbytes
+
+    def add_transferred(self, nbytes):
+        with self._lock:
+            self.ntransferred += nbytes
+
+    def add_issues(self, nissues):
+        with self._lock:
+            self.nissues += nissues
+
+    def add_retry(self, name):
+        with self._lock:
+            self.retries[name] = self.retries.get(name, 0) + 1
+
+    def report(self):
+        """
+        Return a human readable summary of the stats.
+
+        @rtype: C{str}
+        """
+        elapsed = max(time.time() - self.start, 1e-6)
+        lines = ["%d issues in %.2f s (%.2f issues/s), %d bytes fetched "
+                 "(%.0f bytes/s)" % (self.nissues, elapsed,
+                                     self.nissues / elapsed, self.nbytes,
+                                     self.nbytes / elapsed)]
+        if self.ntransferred:
+            lines.append("  %d bytes transferred by HTTP" % self.ntransferred)
+        for name, (phase_elapsed, ncalls) in self.phases.items():
+            lines.append("  %-6s %9.2f s %7d calls %9.2f ms/call"
+                         % (name, phase_elapsed, ncalls,
+                            phase_elapsed * 1000 / ncalls))
+        if self.retries:
+            lines.append("  retries: " + ', '.join("%s %d" % item for item
+                                                   in self.retries.items()))
+        return '\n'.join(lines)
+
+
+run_stats = RunStats()
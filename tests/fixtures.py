@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Fixtures shared by the tests of the storage of issues.
+"""
+
+import contextlib
+import cStringIO
+import datetime
+import sys
+import unittest
+
+from bicho.common import Tracker, People, Issue, Comment, Change, Attachment
+from bicho.config import Config
+from bicho.db.database import DBBackend
+from bicho.db.sqlite import DBSQLite
+
+
+class RecordingBackend(DBBackend):
+    """
+    Database backend that records the calls to its hooks.
+    """
+    def __init__(self):
+        self.MYSQL_EXT = []
+        self.calls = []
+
+    def insert_issue_ext(self, store, issue, issue_id):
+        self.calls.append(('issue', issue_id))
+
+    def insert_comment_ext(self, store, comment, comment_id):
+        self.calls.append(('comment', comment_id))
+
+    def insert_attachment_ext(self, store, attch, attch_id):
+        self.calls.append(('attachment', attch_id))
+
+    def insert_change_ext(self, store, change, change_id):
+        self.calls.append(('change', change_id))
+
+    def insert_temp_rel(self, store, temp_relationship, trel_id, tracker_id):
+        self.calls.append(('temp_rel', trel_id))
+
+    def get_issue_modification_date(self, issue):
+        return getattr(issue, 'mod_date', None)
+
+    def get_last_modification_date(self, store, tracker_id=None):
+        return None
+
+    def get_calls(self, kind):
+        return [call[1] for call in self.calls if call[0] == kind]
+
+
+class FailingBackend(RecordingBackend):
+    """
+    Database backend that fails to store the given issues.
+    """
+    def __init__(self, failing):
+        RecordingBackend.__init__(self)
+        self.failing = failing
+
+    def insert_issue_ext(self, store, issue, issue_id):
+        if issue.issue in self.failing:
+            raise ValueError(issue.issue)
+        RecordingBackend.insert_issue_ext(self, store, issue, issue_id)
+
+
+def make_people(user_id):
+    people = People(user_id)
+    people.set_name(user_id.capitalize())
+    people.set_email(user_id + '@example.com')
+    return people
+
+
+def make_issue(issue_id, ncomments=3, nchanges=2, watchers=('bob', 'carol')):
+    date = datetime.datetime(2014, 1, 1, 10, 0, 0)
+    issue = Issue(unicode(issue_id), u'bug', u'Summary %s' % issue_id,
+                  u'Description', make_people(u'alice'), date)
+    issue.set_status(u'open')
+
+    for i in range(ncomments):
+        issue.add_comment(Comment(u'Comment %d' % i, make_people(u'bob'),
+                                  date + datetime.timedelta(minutes=i)))
+    for i in range(nchanges):
+        issue.add_change(Change(u'status', u'old %d' % i, u'new %d' % i,
+                                make_people(u'carol'),
+                                date + datetime.timedelta(minutes=i)))
+    attachment = Attachment(u'http://example.com/%s.patch' % issue_id,
+                            make_people(u'alice'), date)
+    attachment.set_name(u'%s.patch' % issue_id)
+    attachment.set_description(u'Patch')
+    issue.add_attachment(attachment)
+
+    for user_id in watchers:
+        issue.add_watcher(make_people(user_id))
+    return issue
+
+
+def make_dated_issue(issue_id, day):
+    issue = make_issue(issue_id)
+    issue.mod_date = datetime.datetime(2014, 2, day, 12, 0, 0)
+    return issue
+
+
+def set_commit_options(commit_every=1):
+    """
+    Commit every X{commit_every} issues, with no time limit.
+    """
+    Config.commit_every = commit_every
+    Config.commit_interval = None
+
+
+def insert_tracker(db, url=u'http://example.com'):
+    """
+    Insert a tracker of the test type on X{db}.
+
+    @return: identifier of the tracker
+    @rtype: C{int}
+    """
+    db.insert_supported_traker('test', '1.0')
+    return db.insert_tracker(Tracker(url, 'test', '1.0')).id
+
+
+@contextlib.contextmanager
+def captured_stdout():
+    """
+    Capture what is printed on the standard output while running
+    the block.
+    """
+    stdout = sys.stdout
+    sys.stdout = output = cStringIO.StringIO()
+    try:
+        yield output
+    finally:
+        sys.stdout = stdout
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Test case run on a new database, with a tracker to store the
+    issues on.
+
+    Subclasses set X{db_class} or override L{create_database} to
+    run on other databases.
+    """
+    db_class = DBSQLite
+    commit_every = 1
+
+    def setUp(self):
+        set_commit_options(self.commit_every)
+        self.backend = RecordingBackend()
+        self.db = self.create_database(self.backend)
+        self.tracker_id = insert_tracker(self.db)
+
+    def tearDown(self):
+        if self.db.store is not None:
+            self.db.close()
+
+    def create_database(self, backend):
+        return self.db_class(backend, ':memory:')
+
+    def count(self, table):
+        return self.db.store.execute('SELECT COUNT(*) FROM %s' % table).get_one()[0]
+
+    def select_ids(self, table):
+        result = self.db.store.execute('SELECT id FROM %s ORDER BY id' % table)
+        return [row[0] for row in result]
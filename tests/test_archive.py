@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the archive of the traffic, recorded from a server on
+localhost and replayed through the HTTP client.
+
+    $ python test_archive.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bicho.config import Config, InvalidConfig
+Config.debug = False
+Config.quiet = True
+
+from bicho.archive import TrafficArchive, ArchiveExists, NotRecorded
+from bicho.http import HTTPClient
+
+import test_http
+from test_http import BODY
+
+
+class ArchiveTest(test_http.HTTPTestCase):
+
+    def setUp(self):
+        test_http.HTTPTestCase.setUp(self)
+        self.path = os.path.join(self.tmpdir, 'archive')
+
+    def record(self, paths):
+        archive = TrafficArchive(self.path)
+        client = HTTPClient(archive=archive)
+        for path in paths:
+            client.get(self.get_url(path))
+        archive.close()
+
+    def test_responses_are_replayed(self):
+        self.record(['/issues', '/nocache'])
+
+        archive = TrafficArchive(self.path, replaying=True)
+        client = HTTPClient(archive=archive)
+        response = client.get(self.get_url('/issues'))
+        other = client.get(self.get_url('/nocache'))
+        archive.close()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, BODY)
+        self.assertEqual(response.headers['etag'], test_http.ETAG)
+        self.assertEqual(other.content, BODY)
+        # The replayed run didn't access the server
+        self.assertEqual(self.server.requests, ['/issues', '/nocache'])
+
+    def test_requests_not_recorded_fail(self):
+        self.record(['/issues'])
+
+        archive = TrafficArchive(self.path, replaying=True)
+        client = HTTPClient(archive=archive)
+        try:
+            client.get(self.get_url('/other'))
+            self.fail('NotRecorded not raised')
+        except NotRecorded, e:
+            self.assertTrue(self.get_url('/other') in str(e))
+        finally:
+            archive.close()
+        self.assertEqual(self.server.requests, ['/issues'])
+
+    def test_archives_are_not_recorded_over(self):
+        self.record(['/issues'])
+
+        self.assertRaises(ArchiveExists, TrafficArchive, self.path)
+
+        # The recorded archive is kept
+        archive = TrafficArchive(self.path, replaying=True)
+        response = HTTPClient(archive=archive).get(self.get_url('/issues'))
+        archive.close()
+        self.assertEqual(response.content, BODY)
+
+    def test_options_are_checked(self):
+        self.record(['/issues'])
+        Config.url = self.get_url('/')
+        Config.backend = 'allura'
+        Config.replay = None
+        Config.record = self.path
+
+        try:
+            self.assertRaises(InvalidConfig, Config.check_config)
+        finally:
+            Config.record = None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,557 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the storage of issues, run on in-memory SQLite databases.
+
+    $ python test_database.py
+"""
+
+import datetime
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bicho.config import Config
+Config.debug = False
+Config.quiet = True
+
+from storm.locals import Int, Unicode
+
+from bicho.common import Comment, Change, TempRelationship
+from bicho.db.jsonl import DBJSONLines
+from bicho.db.null import DBNull
+from bicho.db.reader import DBReader, DBCopyBackend
+from bicho.db.sqlite import DBSQLite
+from bicho.utils import run_stats
+
+from fixtures import DatabaseTestCase, RecordingBackend, FailingBackend, \
+    make_people, make_issue, make_dated_issue, set_commit_options, \
+    insert_tracker, captured_stdout
+
+
+class ChildRowsTest(DatabaseTestCase):
+
+    def test_children_are_written(self):
+        self.db.insert_issue(make_issue(1), self.tracker_id)
+
+        self.assertEqual(self.count('issues'), 1)
+        self.assertEqual(self.count('comments'), 3)
+        self.assertEqual(self.count('changes'), 2)
+        self.assertEqual(self.count('attachments'), 1)
+        self.assertEqual(self.count('issues_watchers'), 2)
+
+    def test_hooks_get_the_identifiers_of_the_rows(self):
+        self.db.insert_issue(make_issue(1), self.tracker_id)
+
+        self.assertEqual(self.backend.get_calls('comment'),
+                         self.select_ids('comments'))
+        self.assertEqual(self.backend.get_calls('change'),
+                         self.select_ids('changes'))
+        self.assertEqual(self.backend.get_calls('attachment'),
+                         self.select_ids('attachments'))
+
+    def test_stored_children_are_not_written_again(self):
+        self.db.insert_issue(make_issue(1), self.tracker_id)
+        del self.backend.calls[:]
+
+        issue = make_issue(1)
+        issue.add_comment(Comment(u'New comment', make_people(u'dave'),
+                                  datetime.datetime(2015, 1, 1)))
+        self.db.insert_issue(issue, self.tracker_id)
+
+        self.assertEqual(self.count('comments'), 4)
+        self.assertEqual(self.count('changes'), 2)
+        self.assertEqual(len(self.backend.get_calls('comment')), 1)
+        self.assertEqual(self.backend.get_calls('change'), [])
+        self.assertEqual(self.backend.get_calls('attachment'), [])
+
+    def test_changes_are_inserted_apart(self):
+        issue = make_issue(1)
+        db_issue = self.db.insert_issue(issue, self.tracker_id)
+        del self.backend.calls[:]
+
+        new = Change(u'status', u'new 1', u'closed', make_people(u'dave'),
+                     datetime.datetime(2015, 1, 1))
+        self.db.insert_changes([issue.changes[0], new, new], db_issue.id,
+                               self.tracker_id)
+
+        self.assertEqual(self.count('changes'), 3)
+        self.assertEqual(self.backend.get_calls('change'),
+                         [max(self.select_ids('changes'))])
+
+    def test_rows_are_split_in_several_statements(self):
+        issue = make_issue(1, ncomments=1200)
+        self.db.insert_issue(issue, self.tracker_id)
+
+        self.assertEqual(self.count('comments'), 1200)
+        self.assertEqual(self.backend.get_calls('comment'),
+                         self.select_ids('comments'))
+
+    def test_ignored_rows_get_no_identifier(self):
+        self.db.insert_issue(make_issue(1, ncomments=1), self.tracker_id)
+        stored = self.db.store.execute('SELECT text, submitted_by, '
+                                       'submitted_on, issue_id, fingerprint '
+                                       'FROM comments').get_one()
+        new = (u'Other', stored[1], stored[2], stored[3], u'f' * 40)
+
+        columns = ['text', 'submitted_by', 'submitted_on', 'issue_id',
+                   'fingerprint']
+        ids = self.db._insert_rows('comments', columns, [stored, new],
+                                   key_column='fingerprint')
+
+        self.assertEqual(ids[0], None)
+        self.assertEqual(ids[1], max(self.select_ids('comments')))
+
+    def test_watchers_are_synced(self):
+        self.db.insert_issue(make_issue(1, watchers=('bob', 'carol')),
+                             self.tracker_id)
+        self.db.insert_issue(make_issue(1, watchers=('carol', 'dave')),
+                             self.tracker_id)
+
+        result = self.db.store.execute('SELECT p.user_id '
+                                       'FROM issues_watchers w, people p '
+                                       'WHERE w.person_id = p.id '
+                                       'ORDER BY p.user_id')
+        self.assertEqual([row[0] for row in result], [u'carol', u'dave'])
+
+
+class FingerprintTest(DatabaseTestCase):
+
+    def test_unchanged_issue_is_skipped(self):
+        self.db.insert_issue(make_issue(1), self.tracker_id)
+        del self.backend.calls[:]
+
+        self.db.insert_issue(make_issue(1), self.tracker_id)
+
+        self.assertEqual(self.backend.calls, [])
+        self.assertEqual(self.count('comments'), 3)
+
+    def test_changed_issue_is_stored(self):
+        self.db.insert_issue(make_issue(1), self.tracker_id)
+        del self.backend.calls[:]
+
+        issue = make_issue(1)
+        issue.set_status(u'closed')
+        self.db.insert_issue(issue, self.tracker_id)
+
+        self.assertEqual(self.backend.get_calls('issue'),
+                         self.select_ids('issues'))
+        status = self.db.store.execute('SELECT status FROM issues').get_one()[0]
+        self.assertEqual(status, u'closed')
+
+    def test_fingerprint_is_saved_after_the_children(self):
+        fingerprints = []
+
+        def insert_comment_ext(store, comment, comment_id):
+            result = store.execute('SELECT fingerprint FROM issues')
+            fingerprints.append(result.get_one()[0])
+        self.backend.insert_comment_ext = insert_comment_ext
+
+        self.db.insert_issue(make_issue(1, ncomments=1), self.tracker_id)
+
+        self.assertEqual(fingerprints, [None])
+        result = self.db.store.execute('SELECT fingerprint FROM issues')
+        self.assertNotEqual(result.get_one()[0], None)
+
+
+class SavepointTest(DatabaseTestCase):
+
+    commit_every = 10
+
+    def setUp(self):
+        DatabaseTestCase.setUp(self)
+        self.db.backend = FailingBackend([u'2'])
+
+    def test_failed_issue_is_rolled_back(self):
+        self.db.insert_issue(make_issue(1), self.tracker_id)
+        self.assertRaises(ValueError, self.db.insert_issue,
+                          make_issue(2), self.tracker_id)
+        self.db.insert_issue(make_issue(3), self.tracker_id)
+        self.db.commit()
+
+        result = self.db.store.execute('SELECT issue FROM issues ORDER BY issue')
+        self.assertEqual([row[0] for row in result], [u'1', u'3'])
+        self.assertEqual(self.count('comments'), 6)
+        self.assertEqual(self.count('issues_watchers'), 4)
+
+
+class RelationshipsTest(DatabaseTestCase):
+
+    def insert_issue(self, issue_id, relationships=()):
+        issue = make_issue(issue_id, ncomments=0, nchanges=0)
+        for rel_type, related_to in relationships:
+            issue.add_temp_relationship(TempRelationship(issue_id, rel_type,
+                                                         related_to))
+        self.db.insert_issue(issue, self.tracker_id)
+
+    def select_relationships(self):
+        result = self.db.store.execute('SELECT i1.issue, r.type, i2.issue '
+                                       'FROM related_to r, issues i1, '
+                                       'issues i2 '
+                                       'WHERE r.issue_id = i1.id '
+                                       'AND r.related_to = i2.id '
+                                       'ORDER BY i1.issue, i2.issue')
+        return [tuple(row) for row in result]
+
+    def test_relationships_are_resolved(self):
+        self.insert_issue(1, [(u'blocks', u'2'), (u'blocks', u'9')])
+        self.insert_issue(2, [(u'depends_on', u'1')])
+        self.db.store_final_relationships(self.tracker_id)
+
+        # Issue 9 is not stored
+        self.assertEqual(self.select_relationships(),
+                         [(u'1', u'blocks', u'2'),
+                          (u'2', u'depends_on', u'1')])
+
+    def test_stored_relationships_are_skipped(self):
+        self.insert_issue(1, [(u'blocks', u'2')])
+        self.insert_issue(2)
+        self.db.store_final_relationships(self.tracker_id)
+
+        self.insert_issue(3, [(u'blocks', u'1')])
+        self.db.store_final_relationships(self.tracker_id)
+
+        self.assertEqual(self.select_relationships(),
+                         [(u'1', u'blocks', u'2'),
+                          (u'3', u'blocks', u'1')])
+
+    def test_relationships_of_other_trackers_are_not_stored(self):
+        self.insert_issue(1, [(u'blocks', u'2')])
+        self.insert_issue(2)
+        self.db.store_final_relationships(self.tracker_id + 1)
+
+        self.assertEqual(self.select_relationships(), [])
+
+
+class PeopleCacheTest(DatabaseTestCase):
+
+    commit_every = 10
+
+    def test_people_are_inserted_once(self):
+        first = self.db.insert_people(make_people(u'alice'))
+        second = self.db.insert_people(make_people(u'alice'))
+
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(self.db._get_people_id(make_people(u'alice')),
+                         first.id)
+        self.assertEqual(self.count('people'), 1)
+
+    def test_rolled_back_people_are_forgotten(self):
+        self.db.backend = FailingBackend([u'1'])
+        self.assertRaises(ValueError, self.db.insert_issue,
+                          make_issue(1), self.tracker_id)
+        self.assertEqual(len(self.db._people_cache), 0)
+
+        self.db.insert_issue(make_issue(2), self.tracker_id)
+        self.db.commit()
+
+        result = self.db.store.execute('SELECT COUNT(*) FROM comments '
+                                       'WHERE submitted_by NOT IN '
+                                       '(SELECT id FROM people)')
+        self.assertEqual(result.get_one()[0], 0)
+        self.assertEqual(self.count('people'), 3)
+
+
+class WatermarkTest(DatabaseTestCase):
+
+    commit_every = 10
+
+    def test_watermark_is_saved_on_commit(self):
+        self.db.insert_issue(make_dated_issue(1, 5), self.tracker_id)
+        self.db.insert_issue(make_dated_issue(2, 3), self.tracker_id)
+        self.assertEqual(self.db.get_sync_state(self.tracker_id), None)
+
+        self.db.commit()
+
+        sync_state = self.db.get_sync_state(self.tracker_id)
+        self.assertEqual(sync_state.last_modification,
+                         datetime.datetime(2014, 2, 5, 12, 0, 0))
+        self.assertEqual(sync_state.last_issue, u'1')
+        self.assertEqual(sync_state.backend, u'RecordingBackend')
+
+    def test_watermark_does_not_go_back(self):
+        self.db.insert_issue(make_dated_issue(1, 5), self.tracker_id)
+        self.db.commit()
+        self.db.insert_issue(make_dated_issue(2, 3), self.tracker_id)
+        self.db.commit()
+
+        sync_state = self.db.get_sync_state(self.tracker_id)
+        self.assertEqual(sync_state.last_issue, u'1')
+
+    def test_failed_issues_do_not_move_the_watermark(self):
+        self.db.backend = FailingBackend([u'2'])
+        self.db.insert_issue(make_dated_issue(1, 3), self.tracker_id)
+        self.assertRaises(ValueError, self.db.insert_issue,
+                          make_dated_issue(2, 5), self.tracker_id)
+        self.db.commit()
+
+        sync_state = self.db.get_sync_state(self.tracker_id)
+        self.assertEqual(sync_state.last_issue, u'1')
+
+
+class StoreCacheTest(DatabaseTestCase):
+
+    def setUp(self):
+        Config.store_cache_size = 20
+        DatabaseTestCase.setUp(self)
+
+    def tearDown(self):
+        DatabaseTestCase.tearDown(self)
+        del Config.store_cache_size
+
+    def test_store_is_bounded(self):
+        # Objects referenced out of the store are kept alive
+        db_issues = []
+        for i in range(30):
+            db_issues.append(self.db.insert_issue(make_issue(i),
+                                                  self.tracker_id))
+            self.assertTrue(len(self.db.store._alive) <= 20)
+        self.assertTrue(self.db.get_store_stats()['resets'] > 0)
+
+
+class NullOutputTest(unittest.TestCase):
+
+    def setUp(self):
+        run_stats.reset()
+        self.db = DBNull(RecordingBackend())
+        self.tracker_id = insert_tracker(self.db)
+
+    def test_issues_are_counted_and_discarded(self):
+        db_issues = self.db.insert_issues([make_issue(1), make_issue(2)],
+                                          self.tracker_id)
+
+        self.assertEqual([db_issue.issue for db_issue in db_issues],
+                         [u'1', u'2'])
+        self.assertEqual(self.db.store.execute('SELECT COUNT(*) '
+                                               'FROM issues').get_one()[0], 0)
+        self.assertEqual(run_stats.nissues, 2)
+        self.assertEqual(run_stats.phases['store'][1], 1)
+
+    def tearDown(self):
+        self.close()
+
+    def close(self):
+        """
+        Close the database, returning the lines it printed.
+        """
+        with captured_stdout() as output:
+            self.db.close()
+            self.db._commit_on_exit()
+        return output.getvalue().splitlines()
+
+    def test_stats_are_reported_once(self):
+        self.db.insert_issue(make_issue(1), self.tracker_id)
+
+        lines = self.close()
+        self.assertEqual(len([line for line in lines
+                              if line.startswith('1 issues')]), 1)
+
+
+class JSONLinesTest(unittest.TestCase):
+
+    def setUp(self):
+        set_commit_options()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_issues(self, path, issues):
+        db = DBJSONLines(RecordingBackend(), path)
+        tracker_id = insert_tracker(db)
+        for issue in issues:
+            db.insert_issue(issue, tracker_id)
+
+        with captured_stdout():
+            db.close()
+
+    def test_issues_are_written_on_lines(self):
+        path = os.path.join(self.tmpdir, 'issues.jsonl')
+        self.write_issues(path, [make_issue(1), make_issue(2)])
+
+        records = [json.loads(line) for line in open(path)]
+        self.assertEqual([record['issue'] for record in records],
+                         [u'1', u'2'])
+
+        record = records[0]
+        self.assertEqual(record['tracker'], u'http://example.com')
+        self.assertEqual(record['submitted_on'], u'2014-01-01T10:00:00')
+        self.assertEqual(record['submitted_by']['user_id'], u'alice')
+        self.assertEqual(len(record['comments']), 3)
+        self.assertEqual(len(record['watchers']), 2)
+
+    def test_gzip_output(self):
+        path = os.path.join(self.tmpdir, 'issues.jsonl.gz')
+        self.write_issues(path, [make_issue(1)])
+
+        lines = gzip.open(path).read().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['issue'], u'1')
+
+    def test_standard_output(self):
+        with captured_stdout() as output:
+            db = DBJSONLines(RecordingBackend(), '-')
+            # Messages are moved out of the way of the issues
+            self.assertTrue(sys.stdout is sys.stderr)
+
+            db.insert_issue(make_issue(1), insert_tracker(db))
+            db.close()
+            self.assertTrue(sys.stdout is output)
+
+        lines = output.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(json.loads(lines[0])['issue'], u'1')
+
+
+class DBTestIssueExt(object):
+    """
+    Table of a backend with extra data of the issues.
+    """
+    __storm_table__ = 'issues_ext_test'
+    __sql_table__ = 'CREATE TABLE IF NOT EXISTS issues_ext_test ( \
+                     id INTEGER NOT NULL AUTO_INCREMENT, \
+                     label VARCHAR(32) NULL, \
+                     issue_id INTEGER NOT NULL, \
+                     PRIMARY KEY(id), \
+                     UNIQUE KEY(issue_id) \
+                     ) ENGINE=MYISAM;'
+
+    id = Int(primary=True)
+    label = Unicode()
+    issue_id = Int()
+
+
+class ExtBackend(RecordingBackend):
+    """
+    Database backend that stores the summary of each issue on its
+    own table.
+    """
+    def __init__(self):
+        RecordingBackend.__init__(self)
+        self.MYSQL_EXT = [DBTestIssueExt]
+
+    def insert_issue_ext(self, store, issue, issue_id):
+        ext = DBTestIssueExt()
+        ext.label = issue.summary
+        ext.issue_id = issue_id
+        store.add(ext)
+        store.flush()
+
+
+class ReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        set_commit_options()
+        self.tmpdir = tempfile.mkdtemp()
+
+        # Identifiers of the input differ from those of the output
+        self.input = DBSQLite(ExtBackend(),
+                              os.path.join(self.tmpdir, 'input.db'))
+        self.tracker_id = insert_tracker(self.input)
+
+        self.input.insert_issue(make_issue(u'A-1', ncomments=1),
+                                self.tracker_id)
+        for i in range(1, 6):
+            issue = make_issue(i, ncomments=i)
+            if i > 1:
+                issue.add_temp_relationship(TempRelationship(i, u'blocks',
+                                                             u'1'))
+            self.input.insert_issue(issue, self.tracker_id)
+        self.input.store_final_relationships(self.tracker_id)
+
+        # Relationship of an issue without a numeric identifier
+        self.input.store.execute('INSERT INTO related_to '
+                                 '(issue_id, related_to, type) '
+                                 'SELECT i1.id, i2.id, ? FROM issues i1, issues i2 '
+                                 "WHERE i1.issue = 'A-1' AND i2.issue = '1'",
+                                 (u'blocks',))
+        self.input.commit()
+
+        self.reader = DBReader(self.input.database, 2, ExtBackend())
+
+    def tearDown(self):
+        self.reader.store.close()
+        self.input.close()
+        shutil.rmtree(self.tmpdir)
+
+    def test_issues_are_read_in_batches(self):
+        issues = list(self.reader.get_issues(self.tracker_id))
+
+        self.assertEqual([issue.issue for issue in issues],
+                         [u'A-1', u'1', u'2', u'3', u'4', u'5'])
+        self.assertEqual([len(issue.comments) for issue in issues],
+                         [1, 1, 2, 3, 4, 5])
+        self.assertEqual(issues[3].watchers[0].user_id, u'bob')
+        self.assertEqual(issues[3].ext_rows,
+                         {'issues_ext_test': [{'label': u'Summary 3'}]})
+
+    def test_relationships_need_numeric_identifiers(self):
+        issues = list(self.reader.get_issues(self.tracker_id))
+
+        self.assertEqual(issues[0].temp_relationships, [])
+        self.assertEqual(self.reader.skipped_relationships, 1)
+        rel = issues[2].temp_relationships[0]
+        self.assertEqual((rel.issue, rel.type, rel.related_to),
+                         (2, u'blocks', u'1'))
+
+    def test_issues_are_copied(self):
+        output = DBSQLite(DBCopyBackend(ExtBackend()), ':memory:')
+        output.insert_issue(make_issue(u'other'),
+                            insert_tracker(output, u'http://example.org'))
+        tracker_id = insert_tracker(output)
+
+        # Copying twice doesn't duplicate the rows
+        for i in range(2):
+            for issue in self.reader.get_issues(self.tracker_id):
+                output.insert_issue(issue, tracker_id)
+            output.store_final_relationships(tracker_id)
+
+        result = output.store.execute('SELECT i.issue, e.label '
+                                      'FROM issues_ext_test e, issues i '
+                                      'WHERE e.issue_id = i.id '
+                                      'ORDER BY i.id')
+        self.assertEqual(list(result)[:2], [(u'A-1', u'Summary A-1'),
+                                            (u'1', u'Summary 1')])
+        count = output.store.execute('SELECT COUNT(*) FROM issues_ext_test')
+        self.assertEqual(count.get_one()[0], 6)
+        count = output.store.execute('SELECT COUNT(*) FROM related_to')
+        self.assertEqual(count.get_one()[0], 4)
+        output.close()
+
+
+class SingleRowSQLite(DBSQLite):
+    """
+    SQLite adapter that inserts a row per statement.
+    """
+    multi_row_insert = False
+
+
+class SingleRowInsertTest(ChildRowsTest):
+
+    db_class = SingleRowSQLite
+
+
+if __name__ == '__main__':
+    unittest.main()
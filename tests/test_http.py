@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the HTTP client, run against a server on localhost.
+
+    $ python test_http.py
+"""
+
+import BaseHTTPServer
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urllib2
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import requests
+
+from bicho.config import Config
+Config.debug = False
+Config.quiet = True
+
+from bicho.http import HTTPClient, HTTPCache
+from bicho.utils import run_stats
+
+
+BODY = '<issues>' + '<issue>Issue</issue>' * 100 + '</issues>'
+ETAG = '"v1"'
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Serves L{BODY} with an C{ETag}, answering C{304 Not Modified}
+    when it's revalidated.
+    """
+    def do_GET(self):
+        self.server.requests.append(self.path)
+
+        if self.path == '/busy':
+            self.send_response(503)
+            self.send_header('Content-Length', str(len(BODY)))
+            self.end_headers()
+            self.wfile.write(BODY)
+            return
+
+        if self.headers.get('If-None-Match') == ETAG:
+            self.send_response(304)
+            self.send_header('ETag', ETAG)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(BODY)))
+        if self.path != '/nocache':
+            self.send_header('ETag', ETAG)
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HTTPTestCase(unittest.TestCase):
+
+    def setUp(self):
+        run_stats.reset()
+        self.tmpdir = tempfile.mkdtemp()
+
+        self.server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        self.client = HTTPClient(cache=HTTPCache(self.tmpdir, 1024 * 1024))
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tmpdir)
+
+    def get_url(self, path='/issues'):
+        return 'http://127.0.0.1:%d%s' % (self.server.server_address[1], path)
+
+
+def make_response(url, body, headers, status_code=200):
+    response = requests.Response()
+    response.url = url
+    response.status_code = status_code
+    response.headers = requests.structures.CaseInsensitiveDict(headers)
+    response._content = body
+    response.connection = None
+    return response
+
+
+class HTTPCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = HTTPCache(self.tmpdir, 1024 * 1024)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def store(self, cache, url, body='body', headers=None):
+        if headers is None:
+            headers = {'ETag': ETAG}
+        key = cache.get_key(url, '')
+        cache.store(key, make_response(url, body, headers))
+        return key
+
+    def test_entries_are_stored(self):
+        key = self.store(self.cache, 'http://example.com/1', BODY,
+                         {'ETag': ETAG, 'Content-Type': 'text/xml'})
+
+        entry = self.cache.get(key)
+        self.assertEqual(entry.body, BODY)
+        self.assertEqual(entry.etag, ETAG)
+        self.assertEqual(entry.headers['content-type'], 'text/xml')
+
+        # The cache is kept on disk
+        entry = HTTPCache(self.tmpdir, 1024 * 1024).get(key)
+        self.assertEqual(entry.body, BODY)
+
+    def test_credentials_have_their_own_entries(self):
+        url = 'http://example.com/1'
+        self.assertNotEqual(self.cache.get_key(url, 'alice'),
+                            self.cache.get_key(url, 'bob'))
+
+    def test_responses_without_validators_are_not_stored(self):
+        key = self.store(self.cache, 'http://example.com/1', headers={})
+        self.assertEqual(self.cache.get(key), None)
+
+        key = self.store(self.cache, 'http://example.com/2',
+                         headers={'ETag': ETAG, 'Cache-Control': 'no-store'})
+        self.assertEqual(self.cache.get(key), None)
+
+    def test_least_recently_used_entries_are_removed(self):
+        cache = HTTPCache(self.tmpdir, 1000)
+        keys = [self.store(cache, 'http://example.com/%d' % i, 'x' * 300)
+                for i in range(2)]
+        cache.get(keys[0])
+
+        keys.append(self.store(cache, 'http://example.com/2', 'x' * 300))
+
+        self.assertNotEqual(cache.get(keys[0]), None)
+        self.assertEqual(cache.get(keys[1]), None)
+        self.assertNotEqual(cache.get(keys[2]), None)
+        self.assertEqual(len(os.listdir(self.tmpdir)), 2)
+
+    def test_broken_entries_are_removed(self):
+        key = self.store(self.cache, 'http://example.com/1')
+        with open(os.path.join(self.tmpdir, key), 'wb') as f:
+            f.write('broken')
+
+        self.assertEqual(self.cache.get(key), None)
+        self.assertEqual(os.listdir(self.tmpdir), [])
+
+    def test_headers_of_the_revalidation_are_used(self):
+        key = self.store(self.cache, 'http://example.com/1', BODY,
+                         {'ETag': ETAG, 'X-RateLimit-Remaining': '10'})
+        not_modified = make_response('http://example.com/1', '',
+                                     {'X-RateLimit-Remaining': '9'}, 304)
+
+        response = self.cache.get(key).to_response(not_modified)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, BODY)
+        self.assertEqual(response.headers['etag'], ETAG)
+        self.assertEqual(response.headers['x-ratelimit-remaining'], '9')
+        self.assertTrue(response.from_cache)
+
+
+class TransferredBytesTest(HTTPTestCase):
+
+    def test_body_is_counted(self):
+        self.client.get(self.get_url())
+
+        self.assertEqual(run_stats.ntransferred, len(BODY))
+        self.assertEqual(run_stats.nbytes, len(BODY))
+
+    def test_cache_hits_are_not_transferred(self):
+        self.client.get(self.get_url())
+        response = self.client.get(self.get_url())
+
+        self.assertTrue(response.from_cache)
+        self.assertEqual(response.content, BODY)
+        self.assertEqual(run_stats.ntransferred, len(BODY))
+
+
+class StreamTest(HTTPTestCase):
+
+    def tearDown(self):
+        HTTPTestCase.tearDown(self)
+        vars(Config).pop('retry_max_time', None)
+
+    def test_cacheable_streams_are_cached(self):
+        for i in range(2):
+            f = self.client.urlopen(self.get_url(), stream=True)
+            self.assertEqual(f.read(), BODY)
+            f.close()
+
+        self.assertTrue(f.response.from_cache)
+        self.assertEqual(len(self.server.requests), 2)
+        self.assertEqual(run_stats.ntransferred, len(BODY))
+
+    def test_other_responses_are_streamed(self):
+        f = self.client.urlopen(self.get_url('/nocache'), stream=True)
+        self.assertTrue(f._streamed)
+
+        self.assertEqual(f.read(10), BODY[:10])
+        self.assertEqual(f.read(), BODY[10:])
+        f.close()
+
+        self.assertEqual(run_stats.nbytes, len(BODY))
+        self.assertEqual(run_stats.ntransferred, len(BODY))
+
+    def test_busy_responses_are_read(self):
+        Config.retry_max_time = 0
+
+        try:
+            self.client.urlopen(self.get_url('/busy'), stream=True)
+        except urllib2.HTTPError, e:
+            self.assertEqual(e.code, 503)
+            self.assertEqual(e.read(), BODY)
+        else:
+            self.fail('HTTPError not raised')
+
+        # The connection was released
+        f = self.client.urlopen(self.get_url('/nocache'), stream=True)
+        self.assertEqual(f.read(), BODY)
+        f.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
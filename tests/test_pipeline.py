@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the storage thread, run on SQLite databases.
+
+    $ python test_pipeline.py
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bicho.config import Config
+Config.debug = False
+Config.quiet = True
+
+import bicho.db.database
+from bicho.common import Tracker
+from bicho.db.database import get_database, close_databases
+from bicho.db.pipeline import DBPipeline, DBDetached
+from bicho.db.sqlite import DBSQLite
+
+from fixtures import RecordingBackend, FailingBackend, make_issue, \
+    set_commit_options
+
+
+class SlowBackend(RecordingBackend):
+    """
+    Database backend that takes a while to store each issue.
+    """
+    def insert_issue_ext(self, store, issue, issue_id):
+        time.sleep(0.01)
+        RecordingBackend.insert_issue_ext(self, store, issue, issue_id)
+
+
+class CountingSQLite(DBSQLite):
+    """
+    SQLite adapter that counts its rows and records the threads it
+    runs on.
+    """
+    def __init__(self, backend, path):
+        DBSQLite.__init__(self, backend, path)
+        self.threads = set([threading.current_thread().name])
+
+    def count(self, table):
+        self.threads.add(threading.current_thread().name)
+        return self.store.execute('SELECT COUNT(*) FROM %s'
+                                  % table).get_one()[0]
+
+    def select_issues(self):
+        result = self.store.execute('SELECT issue FROM issues ORDER BY id')
+        return [row[0] for row in result]
+
+
+class PipelineTest(unittest.TestCase):
+
+    def setUp(self):
+        set_commit_options(10)
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'bicho.db')
+        self.db = None
+
+    def tearDown(self):
+        try:
+            self.db.close()
+        except ValueError:
+            pass
+        shutil.rmtree(self.tmpdir)
+
+    def start(self, backend):
+        """
+        Start a pipeline storing the issues with the given backend.
+        """
+        self.backend = backend
+        self.db = DBPipeline(lambda: CountingSQLite(backend, self.path), 4)
+        self.db.insert_supported_traker('test', '1.0')
+        self.tracker_id = self.db.insert_tracker(
+            Tracker(u'http://example.com', 'test', '1.0')).id
+
+    def select_stored_issues(self):
+        db = DBSQLite(None, self.path)
+        result = db.store.execute('SELECT issue FROM issues ORDER BY id')
+        issues = [row[0] for row in result]
+        db.close()
+        return issues
+
+    def test_issues_are_stored_in_order(self):
+        self.start(RecordingBackend())
+        for i in range(20):
+            self.db.insert_issue(make_issue(i), self.tracker_id)
+
+        self.assertEqual(self.db.select_issues(),
+                         [unicode(i) for i in range(20)])
+        self.assertEqual(self.backend.get_calls('issue'), range(1, 21))
+
+    def test_queue_is_drained_before_other_calls(self):
+        self.start(SlowBackend())
+        for i in range(5):
+            self.db.insert_issue(make_issue(i), self.tracker_id)
+
+        self.assertEqual(self.db.count('issues'), 5)
+        self.assertEqual(self.db.threads, set(['storage']))
+
+    def test_database_objects_are_detached(self):
+        self.start(RecordingBackend())
+        db_tracker = self.db.insert_tracker(
+            Tracker(u'http://example.com', 'test', '1.0'))
+
+        self.assertTrue(isinstance(db_tracker, DBDetached))
+        self.assertEqual(db_tracker.id, self.tracker_id)
+        self.assertEqual(db_tracker.url, u'http://example.com')
+        self.assertRaises(AttributeError, getattr, self.db, 'store')
+
+    def test_errors_are_raised_on_the_caller(self):
+        self.start(FailingBackend([u'2']))
+        for i in range(1, 4):
+            self.db.insert_issue(make_issue(i), self.tracker_id)
+
+        self.assertRaises(ValueError, self.db.drain)
+        self.assertRaises(ValueError, self.db.insert_issue, make_issue(4),
+                          self.tracker_id)
+        self.assertRaises(ValueError, self.db.close)
+
+        # Issues stored before the error are committed; the ones
+        # queued after it are skipped
+        self.assertEqual(self.select_stored_issues(), [u'1'])
+
+    def test_queued_issues_are_committed_on_close(self):
+        self.start(SlowBackend())
+        for i in range(5):
+            self.db.insert_issue(make_issue(i), self.tracker_id)
+        self.db.close()
+
+        self.assertEqual(self.select_stored_issues(),
+                         [unicode(i) for i in range(5)])
+
+
+class ExitCommitTest(unittest.TestCase):
+
+    def setUp(self):
+        set_commit_options()
+        self.tmpdir = tempfile.mkdtemp()
+        Config.url = u'http://example.com'
+        Config.output = 'db'
+        Config.db_driver_out = 'sqlite'
+        Config.db_database_out = os.path.join(self.tmpdir, 'bicho.db')
+
+        self.registered = []
+        self._atexit = bicho.db.database.atexit
+        bicho.db.database.atexit = self
+
+    def tearDown(self):
+        bicho.db.database.atexit = self._atexit
+        close_databases()
+        Config.store_queue_size = 0
+        shutil.rmtree(self.tmpdir)
+
+    def register(self, func):
+        self.registered.append(func)
+
+    def test_adapters_commit_on_exit(self):
+        Config.store_queue_size = 0
+        db = get_database(RecordingBackend())
+
+        self.assertEqual(self.registered, [db._commit_on_exit])
+
+    def test_pipeline_adapters_leave_it_to_the_pipeline(self):
+        Config.store_queue_size = 4
+        db = get_database(RecordingBackend())
+
+        self.assertTrue(isinstance(db, DBPipeline))
+        self.assertEqual(self.registered, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
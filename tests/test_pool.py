@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the pool of workers that fetch the details of the issues.
+
+    $ python test_pool.py
+"""
+
+import os
+import random
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bicho.config import Config
+Config.debug = False
+Config.quiet = True
+
+from bicho.pool import FetchPool, FETCH_POOL_WINDOW
+
+
+def slow_square(x):
+    time.sleep(random.uniform(0, 0.01))
+    return x * x
+
+
+def fail_on_five(x):
+    if x == 5:
+        raise ValueError(x)
+    return x
+
+
+class FetchPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = FetchPool(4)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_results_keep_the_order(self):
+        results = list(self.pool.map(slow_square, range(50)))
+
+        self.assertEqual(results, [x * x for x in range(50)])
+
+    def test_several_iterables(self):
+        results = list(self.pool.map(lambda x, y: x + y, range(5),
+                                     range(10, 15)))
+
+        self.assertEqual(results, [10, 12, 14, 16, 18])
+
+    def test_errors_are_raised_in_order(self):
+        results = self.pool.map(fail_on_five, range(10))
+
+        self.assertEqual([results.next() for i in range(5)], range(5))
+        self.assertRaises(ValueError, results.next)
+
+    def test_tasks_run_on_several_threads(self):
+        threads = set()
+
+        def record(x):
+            threads.add(threading.current_thread().name)
+            time.sleep(0.01)
+            return x
+
+        list(self.pool.map(record, range(20)))
+        self.assertTrue(len(threads) > 1)
+
+    def test_pending_tasks_are_bounded(self):
+        consumed = []
+
+        def items():
+            for i in range(100):
+                consumed.append(i)
+                yield i
+
+        results = self.pool.map(lambda x: x, items())
+        results.next()
+
+        self.assertEqual(len(consumed), self.pool.workers * FETCH_POOL_WINDOW)
+
+    def test_single_worker_runs_on_the_caller(self):
+        pool = FetchPool(1)
+        results = list(pool.map(lambda x: threading.current_thread(),
+                                range(3)))
+
+        self.assertEqual(results, [threading.current_thread()] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
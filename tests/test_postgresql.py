@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the storage of issues on a PostgreSQL server.
+
+The tables of Bicho are dropped from the database before each test,
+so use a database created for them. Tests are skipped unless its name
+is given:
+
+    $ BICHO_TEST_PG_DATABASE=bicho_test python test_postgresql.py
+
+BICHO_TEST_PG_USER, BICHO_TEST_PG_PASSWORD, BICHO_TEST_PG_HOSTNAME and
+BICHO_TEST_PG_PORT set the rest of the connection options.
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bicho.config import Config
+Config.debug = False
+Config.quiet = True
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+from storm.locals import create_database, Store
+
+from bicho.db.postgresql import DBPostgreSQL, COPY_MIN_ROWS
+
+import test_database
+from fixtures import DatabaseTestCase, make_issue
+
+PG_DATABASE = os.environ.get('BICHO_TEST_PG_DATABASE')
+
+# Dependent tables go first
+TABLES = ['issues_watchers', 'related_to', 'comments', 'attachments',
+          'changes', 'issues', 'people', 'tracker_sync_state', 'trackers',
+          'supported_trackers']
+
+
+def set_database_options():
+    Config.db_database_out = PG_DATABASE
+    Config.db_user_out = os.environ.get('BICHO_TEST_PG_USER', 'postgres')
+    Config.db_password_out = os.environ.get('BICHO_TEST_PG_PASSWORD', '')
+    Config.db_hostname_out = os.environ.get('BICHO_TEST_PG_HOSTNAME',
+                                            'localhost')
+    Config.db_port_out = os.environ.get('BICHO_TEST_PG_PORT', '5432')
+
+
+def drop_tables():
+    database = create_database('postgres://%s:%s@%s:%s/%s' %
+                               (Config.db_user_out, Config.db_password_out,
+                                Config.db_hostname_out, Config.db_port_out,
+                                Config.db_database_out))
+    store = Store(database)
+    for table in TABLES:
+        store.execute('DROP TABLE IF EXISTS %s CASCADE' % table,
+                      noresult=True)
+    store.commit()
+    store.close()
+
+
+@unittest.skipUnless(PG_DATABASE and psycopg2,
+                     'BICHO_TEST_PG_DATABASE is not set or psycopg2 '
+                     'is not installed')
+class PostgreSQLTestCase(DatabaseTestCase):
+
+    def create_database(self, backend):
+        set_database_options()
+        drop_tables()
+        return DBPostgreSQL(backend)
+
+
+class PostgreSQLChildRowsTest(PostgreSQLTestCase,
+                              test_database.ChildRowsTest):
+    pass
+
+
+class PostgreSQLFingerprintTest(PostgreSQLTestCase,
+                                test_database.FingerprintTest):
+    pass
+
+
+class PostgreSQLSavepointTest(PostgreSQLTestCase,
+                              test_database.SavepointTest):
+    pass
+
+
+class PostgreSQLRelationshipsTest(PostgreSQLTestCase,
+                                  test_database.RelationshipsTest):
+    pass
+
+
+class CopyTest(PostgreSQLTestCase):
+
+    def test_large_batches_are_copied(self):
+        issue = make_issue(1, ncomments=COPY_MIN_ROWS, watchers=[])
+        issue.comments[0].comment = u'Tab\there,\nnew line and \\ backslash'
+        self.db.insert_issue(issue, self.tracker_id)
+
+        self.assertEqual(self.count('comments'), COPY_MIN_ROWS)
+        self.assertEqual(self.backend.get_calls('comment'),
+                         self.select_ids('comments'))
+        result = self.db.store.execute('SELECT text FROM comments '
+                                       'ORDER BY id')
+        self.assertEqual(result.get_one()[0], issue.comments[0].comment)
+
+    def test_copied_duplicates_get_no_identifier(self):
+        self.db.insert_issue(make_issue(1, ncomments=1), self.tracker_id)
+        stored = self.db.store.execute('SELECT text, submitted_by, '
+                                       'submitted_on, issue_id, fingerprint '
+                                       'FROM comments').get_one()
+        rows = [stored]
+        for i in range(COPY_MIN_ROWS):
+            rows.append((u'Other %d' % i,) + tuple(stored[1:4]) +
+                        (u'%040d' % i,))
+        # Duplicated within the batch
+        rows.append(rows[1])
+
+        columns = ['text', 'submitted_by', 'submitted_on', 'issue_id',
+                   'fingerprint']
+        ids = self.db._insert_rows('comments', columns, rows,
+                                   key_column='fingerprint')
+
+        self.assertEqual(ids[0], None)
+        self.assertEqual(ids[-1], None)
+        self.assertEqual(ids[1:-1], self.select_ids('comments')[1:])
+        self.assertEqual(self.count('comments'), COPY_MIN_ROWS + 1)
+
+    def test_staging_table_is_emptied(self):
+        self.db.insert_issue(make_issue(1, ncomments=COPY_MIN_ROWS),
+                             self.tracker_id)
+        self.db.insert_issue(make_issue(2, ncomments=COPY_MIN_ROWS),
+                             self.tracker_id)
+
+        self.assertEqual(self.count('comments'), 2 * COPY_MIN_ROWS)
+        self.assertEqual(self.count('copy_comments'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
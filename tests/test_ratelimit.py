@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the rate limiter, run on a fake clock.
+
+    $ python test_ratelimit.py
+"""
+
+import email.utils
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bicho.config import Config
+Config.debug = False
+Config.quiet = True
+
+import bicho.ratelimit
+from bicho.ratelimit import HostRateLimiter, RateLimiter
+
+
+class FakeClock(object):
+    """
+    Replaces the C{time} module; sleeping moves the clock forward.
+    """
+    def __init__(self):
+        self.now = 1000000000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class RateLimitTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self._time = bicho.ratelimit.time
+        bicho.ratelimit.time = self.clock
+
+    def tearDown(self):
+        bicho.ratelimit.time = self._time
+
+
+class HostRateLimiterTest(RateLimitTestCase):
+
+    def test_burst_is_not_delayed(self):
+        limiter = HostRateLimiter(2, burst=3)
+        for i in range(3):
+            limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+        limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [2])
+
+    def test_waiting_requests_are_spaced(self):
+        limiter = HostRateLimiter(2, burst=1)
+        limiter.acquire()
+        limiter.acquire()
+        limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [2, 2])
+
+    def test_tokens_are_refilled(self):
+        limiter = HostRateLimiter(2, burst=1)
+        limiter.acquire()
+        self.clock.now += 5
+        limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_healthy_responses_speed_up(self):
+        limiter = HostRateLimiter(1)
+        limiter.update(429, {})
+        limiter.update(200, {})
+        self.assertAlmostEqual(limiter.interval, 1.8)
+
+        for i in range(100):
+            limiter.update(200, {})
+        self.assertEqual(limiter.interval, 1)
+
+    def test_delay_is_never_shortened(self):
+        limiter = HostRateLimiter(5)
+        for i in range(100):
+            limiter.update(200, {})
+
+        self.assertEqual(limiter.interval, 5)
+
+    def test_overload_slows_down(self):
+        limiter = HostRateLimiter(0.2, burst=1)
+        limiter.update(429, {})
+
+        self.assertEqual(limiter.interval, 1)
+        limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [1])
+
+        limiter.update(503, {})
+        self.assertEqual(limiter.interval, 2)
+
+    def test_retry_after_seconds(self):
+        limiter = HostRateLimiter(1)
+        limiter.update(503, {'retry-after': '30'})
+        limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [30])
+
+    def test_retry_after_date(self):
+        limiter = HostRateLimiter(1)
+        date = email.utils.formatdate(self.clock.now + 60, usegmt=True)
+        limiter.update(200, {'retry-after': date})
+        limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [60])
+
+    def test_exhausted_quota_waits_for_the_reset(self):
+        limiter = HostRateLimiter(1)
+        limiter.update(200, {'x-ratelimit-remaining': '0',
+                             'x-ratelimit-reset': str(self.clock.now + 120)})
+        limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [120])
+
+    def test_quota_is_spread_until_the_reset(self):
+        limiter = HostRateLimiter(1)
+        # Seconds left until the reset
+        limiter.update(200, {'x-ratelimit-remaining': '10',
+                             'x-ratelimit-reset': '50'})
+
+        self.assertEqual(limiter.interval, 5)
+
+
+class RateLimiterTest(RateLimitTestCase):
+
+    def test_hosts_are_limited_apart(self):
+        limiter = RateLimiter(1)
+        limiter.update('http://a.example.com/1', 429, {})
+
+        limiter.acquire('http://b.example.com/1')
+        self.assertEqual(self.clock.sleeps, [])
+
+        limiter.acquire('http://a.example.com/2')
+        self.assertEqual(self.clock.sleeps, [2])
+
+
+if __name__ == '__main__':
+    unittest.main()
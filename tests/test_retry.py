@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the retries of the requests, run on a fake clock.
+
+    $ python test_retry.py
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bicho.config import Config
+Config.debug = False
+Config.quiet = True
+
+import bicho.retry
+from bicho.retry import RetryPolicy, retry
+from bicho.utils import run_stats
+
+from test_ratelimit import FakeClock
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_waits_grow_exponentially(self):
+        policy = RetryPolicy('test', 5, 1, 60)
+
+        for n in range(5):
+            for i in range(20):
+                wait = policy.get_wait(n)
+                self.assertTrue(2 ** n / 2.0 <= wait <= 2 ** n)
+
+    def test_waits_are_bounded(self):
+        policy = RetryPolicy('test', 20, 1, 60)
+
+        for i in range(20):
+            wait = policy.get_wait(15)
+            self.assertTrue(30 <= wait <= 60)
+
+
+class Failing(object):
+    """
+    Function that fails the first X{failures} times it's called.
+    """
+    def __init__(self, failures, error=IOError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error('failure %d' % self.calls)
+        return 'done'
+
+
+POLICY = RetryPolicy('test', 3, 1, 60)
+
+
+def get_policy(e):
+    if isinstance(e, IOError):
+        return POLICY
+    return None
+
+
+class RetryTest(unittest.TestCase):
+
+    def setUp(self):
+        run_stats.reset()
+        self.clock = FakeClock()
+        self._time = bicho.retry.time
+        bicho.retry.time = self.clock
+
+    def tearDown(self):
+        bicho.retry.time = self._time
+
+    def test_failed_calls_are_retried(self):
+        func = Failing(2)
+
+        self.assertEqual(retry(func, get_policy, 600), 'done')
+        self.assertEqual(func.calls, 3)
+        self.assertEqual(len(self.clock.sleeps), 2)
+        self.assertEqual(run_stats.retries, {'test': 2})
+
+    def test_errors_without_policy_are_raised(self):
+        func = Failing(1, ValueError)
+
+        self.assertRaises(ValueError, retry, func, get_policy, 600)
+        self.assertEqual(func.calls, 1)
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_retries_are_limited(self):
+        func = Failing(10)
+
+        self.assertRaises(IOError, retry, func, get_policy, 600)
+        self.assertEqual(func.calls, 4)
+        self.assertEqual(run_stats.retries, {'test': 3, 'test failed': 1})
+
+    def test_time_is_limited(self):
+        func = Failing(10)
+
+        # The second retry waits at least one second
+        self.assertRaises(IOError, retry, func, get_policy, 1.2)
+        self.assertEqual(func.calls, 2)
+        self.assertTrue(sum(self.clock.sleeps) <= 1.2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+#
+
+"""
+Tests of the helpers of bicho.utils.
+
+    $ python test_utils.py
+"""
+
+import cStringIO
+import os
+import sys
+import time
+import unittest
+import xml.sax.handler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from bicho.config import Config
+Config.debug = False
+Config.quiet = True
+
+from bicho.utils import LRUCache, RunStats, parse_xml_stream
+
+
+class LRUCacheTest(unittest.TestCase):
+
+    def test_least_recently_used_is_discarded(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        self.assertEqual(cache.get('a'), 1)
+
+        cache['c'] = 3
+
+        self.assertEqual(len(cache), 2)
+        self.assertFalse('b' in cache)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_updates_are_used(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache['b'] = 2
+        cache['a'] = 3
+        cache['c'] = 4
+
+        self.assertEqual(cache.get('a'), 3)
+        self.assertEqual(cache.get('b', 0), 0)
+
+    def test_clear(self):
+        cache = LRUCache(2)
+        cache['a'] = 1
+        cache.clear()
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get('a'), None)
+
+
+class RunStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stats = RunStats()
+
+    def test_phases_are_accounted(self):
+        for i in range(3):
+            with self.stats.phase('parse'):
+                pass
+
+        elapsed, ncalls = self.stats.phases['parse']
+        self.assertEqual(ncalls, 3)
+        self.assertTrue(elapsed >= 0)
+
+    def test_nested_phases_are_not_accounted_twice(self):
+        with self.stats.phase('parse'):
+            with self.stats.phase('fetch'):
+                time.sleep(0.05)
+
+        self.assertTrue(self.stats.phases['fetch'][0] >= 0.05)
+        self.assertTrue(self.stats.phases['parse'][0] < 0.05)
+
+    def test_timed_function(self):
+        func = self.stats.timed('parse', lambda x, y: x + y)
+
+        self.assertEqual(func(1, y=2), 3)
+        self.assertEqual(self.stats.phases['parse'][1], 1)
+
+    def test_errors_are_accounted(self):
+        def fail():
+            with self.stats.phase('fetch'):
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual(self.stats.phases['fetch'][1], 1)
+
+    def test_report(self):
+        self.stats.add_issues(2)
+        self.stats.add_bytes(100)
+        with self.stats.phase('store'):
+            pass
+
+        report = self.stats.report()
+        self.assertTrue(report.startswith('2 issues'))
+        self.assertTrue('100 bytes fetched' in report)
+        self.assertTrue('store' in report)
+
+
+class TextHandler(xml.sax.handler.ContentHandler):
+    """
+    SAX handler that collects the text of the elements.
+    """
+    def __init__(self):
+        xml.sax.handler.ContentHandler.__init__(self)
+        self.elements = []
+        self.text = []
+
+    def startElement(self, name, attrs):
+        self.elements.append(name)
+
+    def characters(self, content):
+        self.text.append(content)
+
+
+class ParseXMLStreamTest(unittest.TestCase):
+
+    def parse(self, data, chunk_size):
+        handler = TextHandler()
+        parse_xml_stream(cStringIO.StringIO(data), handler, chunk_size)
+        return handler
+
+    def test_document_is_parsed_in_chunks(self):
+        data = '<bugs>' + ''.join('<bug>%d</bug>' % i
+                                  for i in range(100)) + '</bugs>'
+
+        handler = self.parse(data, 7)
+
+        self.assertEqual(len(handler.elements), 101)
+        self.assertEqual(u''.join(handler.text),
+                         u''.join(unicode(i) for i in range(100)))
+
+    def test_invalid_bytes_are_removed(self):
+        handler = self.parse('<bug>a\x00b\x08c\x1fd</bug>', 3)
+
+        self.assertEqual(u''.join(handler.text), u'abcd')
+
+    def test_utf8_split_between_chunks(self):
+        handler = self.parse(u'<bug>\xe1rbol</bug>'.encode('utf-8'), 6)
+
+        self.assertEqual(u''.join(handler.text), u'\xe1rbol')
+
+    def test_errors_are_raised(self):
+        self.assertRaises(xml.sax.SAXParseException, self.parse,
+                          '<bug><a></bug>', 4)
+
+
+if __name__ == '__main__':
+    unittest.main()